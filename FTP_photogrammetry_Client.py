@@ -10,42 +10,159 @@
 '''
 
 # Import modules
-from    time                        import  sleep                       # Add delays and wait times
-from    threading                   import  Thread                      # Use threads to free up main()
-from    subprocess                  import  Popen                       # Run batch script from within Python
+from    time                        import  sleep, time, strftime       # Add delays and wait times
+from    threading                   import  Thread, Event               # Use threads to free up main()
+from    threading                   import  Lock                        # Serialize console output from workers
 from    ftplib                      import  FTP                         # For file transfer
+from    frame_stream                import  FrameStreamClient           # For direct in-memory frame transfer
+from    recon_pipeline              import  ReconPipeline               # Run VisualSFM stages as images land
+from    recon_jobs                  import  ReconJobQueue, Full         # Queue reconstructions of finished scans
+from    image_cache                 import  ImageCache                  # Skip frames we already have
+from    artifact_cache              import  ArtifactCache               # Skip features & matches we already have
+from    transfer_engine             import  LinkTuner, TransferEngine   # Large-buffer, self-tuning transfers
+from    scan_metrics                import  Tracer, monotonic           # Per-frame stage timings
+import  json                                                            # Job status & commands
+import  os                                                              # Manage partial downloads
+import  socket                                                          # Unique MQTT client ID
 import  paho.mqtt.client            as      mqtt                        # For general communications
+import  scan_manifest                                                   # Structured frame announcements
+import  scan_nodes                                                      # Per-node topics & state
+import  preview_tier                                                    # Previews sent ahead of full frames
+import  recon_partition                                                 # Reconstruct large scans in clusters
 
 # ************************************************************************
 # ============================> DEFINE CLASS <============================
 # ************************************************************************ 
 class FTP_photogrammetery_Client( object ):
 
-    def __init__( self, MQTT_broker_ip, username, password ):
+    def __init__( self, MQTT_broker_ip, username, password, NUM_WORKERS=4, STREAM=True,
+                  IMAGE_CMD=None, RECON_WORKERS=2, CACHE_DIR=None, CACHE_BYTES=2*2**30,
+                  IMG_DIR=r".\imgs", FTP_DIR="./Pictures/", FTP_PORT=21, MQTT_PORT=1883,
+                  RECON_CMD=[r".\main.bat"], NODES=1, DAEMON=False, RECON_JOBS=1,
+                  MAX_JOBS=8, TRACE_LOG=None, METRICS_PORT=None, PREVIEW_CMD=None,
+                  PAIR_CMD=None, ARTIFACT_DIR=None, ARTIFACT_BYTES=4*2**30,
+                  ARTIFACTS=(".sift",), TOOL_PARAMS=None, CLUSTER_SIZE=None,
+                  OVERLAP=8, CLUSTER_BY="order", CLUSTER_PROCS=None ):
         '''
         Initialize class
+
+        INPUTS:
+             - MQTT_broker_ip: IP address of MQTT broker
+             - username      : FTP login username
+             - password      : FTP login password
+             - NUM_WORKERS   : Number of concurrent download workers per camera node
+             - STREAM        : Fetch frames from a node's in-memory endpoint
+                               when it advertises one, instead of FTP
+             - IMAGE_CMD     : Per-image command run as soon as each image lands,
+                               "{image}" is replaced by its path (None == disabled)
+             - RECON_WORKERS : Max number of per-image processes at once
+             - CACHE_DIR     : Directory of the content-addressed image cache (None == disabled)
+             - CACHE_BYTES   : Size budget of the image cache
+             - IMG_DIR       : Local directory images are stored in (in daemon
+                               mode, each scan gets its own directory below it)
+             - FTP_DIR       : Directory holding the images on the FTP server
+             - FTP_PORT      : Port of FTP server, unless a node advertises its own
+             - MQTT_PORT     : Port of MQTT broker
+             - RECON_CMD     : Command running the global reconstruction stages
+                               once the scan is complete (None == none),
+                               "{scan}" is replaced by the scan's image directory
+                               and "{model}" by the model it should write there
+             - NODES         : Number of camera nodes that make up a scan; the
+                               session ends once that many have finished
+             - DAEMON        : Keep taking scans; each finished scan is queued
+                               as a reconstruction job instead of run in place
+             - RECON_JOBS    : Max number of reconstruction jobs running at once
+             - MAX_JOBS      : Max number of reconstruction jobs waiting to run
+             - TRACE_LOG     : JSON-lines file per-frame stage timings are appended to
+             - METRICS_PORT  : Serve stage histograms on http://<client>:<port>/metrics
+             - PREVIEW_CMD   : Quick reconstruction run over a scan's previews once
+                               they are all in, while full frames keep arriving;
+                               "{scan}" is replaced by the preview directory (None == none)
+             - PAIR_CMD      : Command matching one pair of images before the global
+                               stages; "{a}", "{b}" and "{out}" are replaced by the
+                               images and the match file to write (None == none).
+                               With CLUSTER_SIZE, only pairs within a cluster
+                               are matched
+             - ARTIFACT_DIR  : Directory of the feature & match cache (None == disabled)
+             - ARTIFACT_BYTES: Size budget of the feature & match cache
+             - ARTIFACTS     : Extensions of the files IMAGE_CMD writes next to each image
+             - TOOL_PARAMS   : Anything else features & matches depend on (tool version,
+                               settings, ...); changing it invalidates the cache
+             - CLUSTER_SIZE  : Reconstruct scans of more frames than this as overlapping
+                               clusters, one RECON_CMD process each, and merge the
+                               partial models (None == always in one piece)
+             - OVERLAP       : Frames shared by neighbouring clusters (at least 3)
+             - CLUSTER_BY    : Order frames are clustered in: "order" (capture time),
+                               "angle" (turntable) or "similarity" (preview hashes)
+             - CLUSTER_PROCS : Max clusters reconstructing at once (None == one per core)
         '''
         
-        self.MQTT_topics = { "IP_addr": "ftp/IP_addr",                  # For IP address communications
-                             "status" : "ftp/status" ,                  # For handshakes communications
-                             "images" : "ftp/images" ,                  # For image name communications
-                             "general": "ftp/general" }                 # For things that are not in any previous category
-
-        self.FTP_server_ip = None                                       # FTP IP address placeholder
-        self.MQTT_client_setup( MQTT_broker_ip )                        # Setup MQTT client
+        self.MQTT_topics = { "nodes"  : scan_nodes.NODES_ROOT + "/#" ,  # Every camera node's namespace
+                             "status" : "ftp/client/status" ,           # For the client's own handshakes
+                             "jobs"   : "ftp/client/jobs"   ,           # Reconstruction job status
+                             "control": "ftp/client/control",           # Job commands (cancel, priority)
+                             "preview": "ftp/client/preview" }          # Coverage of the landed previews
+
+        self.nodes_lock = Lock()                                        # Guard nodes
+        self.min_nodes = max( 1, NODES )                                # Nodes to wait for before finishing
+        self.FTP_port = FTP_PORT                                        # FTP port
+        self.FTP_dir = FTP_DIR                                          # Directory holding the images on the server
+        self.img_root = IMG_DIR                                         # Local image storage
+        self.num_workers = max( 1, NUM_WORKERS )                        # Size of each node's download pool
+        self.stream = STREAM                                            # Use nodes' frame endpoints if available
+        self.tuner = LinkTuner()                                        # Block/socket buffer sizes tuned per link
+        self.image_cmd = IMAGE_CMD                                      # Per-image stages run as images land,
+        self.recon_cmd = RECON_CMD                                      # ...RECON_CMD runs the global stages
+        self.recon_workers = RECON_WORKERS                              # ...
+        self.cluster = None                                             # Partitioned reconstruction
+        if( CLUSTER_SIZE is not None ):                                 # ...
+            self.cluster = { "size"   : CLUSTER_SIZE, "overlap": OVERLAP,
+                             "by"     : CLUSTER_BY,   "workers": CLUSTER_PROCS }
+        self.preview_cmd = PREVIEW_CMD                                  # Reconstruction over previews
+        self.pair_cmd = PAIR_CMD                                        # Per-pair matching
+        self.artifacts = ARTIFACTS                                      # Per-image outputs of IMAGE_CMD
+        self.tool_params = TOOL_PARAMS                                  # ...
+        self.artifact_cache = None                                      # Features & matches kept across scans
+        if( ARTIFACT_DIR is not None ):                                 # ...
+            self.artifact_cache = ArtifactCache( ARTIFACT_DIR, ARTIFACT_BYTES )
+        self.print_lock = Lock()                                        # Keep worker output from interleaving
+        self.manifest_lock = Lock()                                     # Guard manifest & landed set
+        self.tracer = Tracer( "client", TRACE_LOG, METRICS_PORT )       # Stage timings of every frame
+        self.connected = Event()                                        # Set once the broker accepts our connection
+        self.node_found = Event()                                       # Set once the first node registers
+        self.t_end = None                                               # When the last scan ended
+
+        self.daemon = DAEMON                                            # Keep taking scans
+        self.jobs = None                                                # Reconstructions of finished scans
+        if( DAEMON ):                                                   # ...
+            self.jobs = ReconJobQueue( RECON_JOBS, MAX_JOBS,            # ...
+                                       self.publish_job )               # ...
+        self.finished_scans = set()                                     # (node, scan id) pairs already taken
+        self.session = 0                                                # Number of scan sessions so far
+        self.new_session()                                              # State of the first scan
+        self.cache = None                                               # Images kept across scans by checksum
+        if( CACHE_DIR is not None ):                                    # ...
+            self.cache = ImageCache( CACHE_DIR, CACHE_BYTES )           # ...
+        self.MQTT_client_setup( MQTT_broker_ip, MQTT_PORT )             # Setup MQTT client
         self.USER, self.PASS = username, password                       # FTP Username and Password
         self.run()                                                      # Run program
         
 # ------------------------------------------------------------------------
 
-    def MQTT_client_setup( self, addr ):
+    def MQTT_client_setup( self, addr, port=1883 ):
         '''
         Setup MQTT client
+
+        INPUTS:
+            - addr: IP address of MQTT broker
+            - port: Port of MQTT broker
         '''
 
         # Error handling in case MQTT communcation setup fails (1/2)
         try:
-            self.client = mqtt.Client( client_id="Client",              # Initialize MQTT client object
+            client_id = "Client-{}-{}".format( socket.gethostname(),    # Unique, so several clients
+                                               os.getpid() )            # ...can share a broker
+            self.client = mqtt.Client( client_id=client_id,             # Initialize MQTT client object
                                        clean_session=True )             # ...
             
             self.client.max_inflight_messages_set( 60 )                 # Max number of messages that can be part of network flow at once
@@ -60,12 +177,13 @@ class FTP_photogrammetery_Client( object ):
             self.client.on_connect = self.on_connect                    # Assign callback functions
             self.client.on_message = self.on_message                    # ...
             
-            self.client.connect( addr, port=1883, keepalive=60 )        # Connect to MQTT network
+            self.client.connect( addr, port=port, keepalive=60 )        # Connect to MQTT network
             self.t_client_loop=Thread(target=self.client_loop, args=()) # Start threaded MQTT data processing loop()
             self.t_client_loop.deamon = True                            # Allow program to shutdown even if thread is running
             self.t_client_loop.start()                                  # ...
 
-            sleep( 0.5 )                                                # Allow some time for connection to be established
+            if( not self.connected.wait(10.0) ):                        # Wait for the broker to accept us
+                raise IOError( "No CONNACK from {}:{}".format(addr, port) )
             
         # Error handling in case MQTT communcation setup fails (2/2)
         except Exception as e:
@@ -81,13 +199,15 @@ class FTP_photogrammetery_Client( object ):
         '''
         Callback function for when connection is established/attempted.
         
-        Prints connection status and subscribes to ftp/# topic on
-        successful connection.
+        Prints connection status and subscribes to every node's
+        topics on successful connection.
         '''
         
         if  ( rc == 0 ):                                                # Upon successful connection
             print(  "MQTT Connection Successful"  )                     #   Subscribe to topic of choice
-            self.client.subscribe( "ftp/#", qos=1 )                     #   ...
+            self.client.subscribe( self.MQTT_topics["nodes"], qos=1 )   #   ...
+            self.client.subscribe( self.MQTT_topics["control"], qos=1 ) #   ...
+            self.connected.set()                                        #   Wake MQTT_client_setup()
 
         elif( rc == 1 ):                                                # Otherwise if connection failed
             print( "Connection Refused - Incorrect Protocol Version" )  #   Troubleshoot
@@ -116,67 +236,701 @@ class FTP_photogrammetery_Client( object ):
         Callback function for when a message is received.
         '''
         
-        if( msg.topic == self.MQTT_topics[ "IP_addr" ] ):               # If we receive something on the IP topic
-            inData = msg.payload.decode( "utf-8" )                      #   Decode payload
-            if( len(inData) < 4 ): pass                                 #   Check it is a valid IP address
-            else:                                                       #   If IP address is valid
-                self.FTP_server_ip = inData                             #       Store IP address
-                self.client.publish( self.MQTT_topics[ "status" ],      #       Send SOH to indicate that we are ready
-                                     "SOH", qos=1, retain=False  )      #       ...
-                    
-                print( "Using IP: {}\n".format(self.FTP_server_ip) )    #       [INFO] ...
-
-        elif( msg.topic == self.MQTT_topics[ "images" ] ):              # If we receive something on the images topic
-            img_name = msg.payload.decode( "utf-8" )                    #   Decode image name
-            if( img_name == '' ): pass                                  #   If empty string (used to clear retained messages), pass
-            else: self.get_file( img_name )                             #   Else, retrieve it from FTP folder on server
-
-        elif( msg.topic == self.MQTT_topics[ "status" ] ):              # If we receive something on the status topic
-            status = msg.payload.decode( "utf-8" )                      #   Decode it and determine next action
-
-            if( status == "EOT" ):                                      #   If end of transmission is indicated
-                print( "Disconnectiong MQTT" ) ,                        #       [INFO] ...
-                self.client.publish( self.MQTT_topics[ "status" ],      #       Send EOT to inform server to
-                                     "EOT", qos=1, retain=False  )      #       ...shuwtdown MQTT client as
-                self.loop = False                                       #       Set loop flag to FALSE
-                sleep( 0.10 )                                           #       Allow time for state of flag to change
-                self.client.disconnect()                                #       Disconnect MQTT client
-                print( "...DONE!" )                                     #       [INFO] ...
-
-            else                 : pass
+        name, kind = scan_nodes.parse_topic( msg.topic )                # Which node sent it, and what it is
+        payload = msg.payload.decode( "utf-8" )                         # Decode payload
+
+        if( msg.topic == self.MQTT_topics[ "control" ] ):               # If we receive a job command
+            self.job_command( payload )                                 #   Carry it out
+
+        elif( kind == "info" ):                                         # If we receive something on an info topic
+            info = scan_nodes.decode_info( payload )                    #   Decode registration
+            if( info is None ): self.finish_node( name, lost=True )     #   Registration cleared, node is gone
+            else              : self.add_node( info )                   #   Otherwise start pulling from the node
+
+        elif( kind == "images" ):                                       # If we receive something on an images topic
+            node = self.nodes.get( name )                               #   Node it came from
+            if( payload == '' or node is None ): pass                   #   If empty string (used to clear retained messages), pass
+            else:                                                       #   Else, queue new images for the node's download pool
+                entries, final = scan_manifest.decode( payload )        #       ...
+                with self.manifest_lock:                                #       Remember what each image should look like
+                    for entry in entries:                               #       ...
+                        self.manifest[ node.local_name(entry["name"]) ] = entry
+                    again = set( e["name"] for e in entries             #       ...and which of them are in already
+                                 if node.local_name(e["name"]) in self.landed )
+
+                if( final ):                                            #       Final manifest only needs to be recorded
+                    node.final_manifest = entries                       #       ...
+                    node.got_manifest.set()                             #       ...
+                else:                                                   #       Queue announced images
+                    for entry in entries:                               #       ...
+                        if( preview_tier.is_preview(entry) ):           #       Previews go ahead of every
+                            node.enqueue( entry["name"],                #       ...queued full frame
+                                          scan_nodes.PREVIEW )          #       ...
+                            continue                                    #       ...
+                        if( entry["name"] not in again ):               #       Announced again: its trace is done,
+                            self.begin_trace( node, entry )             #       ...the worker only acks it
+                        node.enqueue( entry["name"] )                   #       ...
+
+        elif( kind == "status" ):                                       # If we receive something on a status topic
+            if( payload == "EOT" ):                                     #   If end of transmission is indicated
+                self.finish_node( name, lost=False )                    #       Wrap up that node
+
+            else                  : pass
         
-        else: pass
+        else: pass                                                      # Our own control messages, etc.
+
+# ------------------------------------------------------------------------
+
+    def add_node( self, info ):
+        '''
+        Register a camera node, start its download pool and tell
+        it we are ready
+
+        INPUT:
+            - info: Registration received from the node
+        '''
+
+        with self.nodes_lock:                                           # Ignore repeated registrations, and
+            if( info["node"] in self.nodes ): return                    # ...nodes whose scan we already took;
+            if( (info["node"], info.get("scan")) in self.finished_scans ): return
+            node = scan_nodes.RemoteNode( info, self.FTP_port,          # ...a node's next scan is picked up
+                                          self.stream )                 # ...when the next session starts
+            self.nodes[ node.name ] = node                              # ...
+
+        print( "Using node {} at {} ({})".format(node.name, node.ip,    # [INFO] ...
+               "stream" if node.stream_port else "FTP") )               # ...
+        if( node.capabilities.get("preview") ):                         # Node sends a preview of every frame
+            self.previews.expect( node.name,                            # ...
+                                  node.capabilities.get("images", 0) )  # ...
+
+        for i in range( self.num_workers ):                             # Start node's pool of download workers
+            t = Thread( target=self.download_worker, args=(node,) )     #   Each worker owns its own session
+            t.daemon = True                                             #   Allow program to shutdown even if thread is running
+            t.start()                                                   #   ...
+
+        self.client.publish( node.topics[ "control" ],                  # Send SOH to indicate that we are ready
+                             "SOH", qos=1, retain=False  )              # ...
+        self.node_found.set()                                           # Wake run()
+
+# ------------------------------------------------------------------------
+
+    def finish_node( self, name, lost ):
+        '''
+        Start wrapping up a node once it sends EOT or drops off
+
+        INPUTS:
+            - name: Name of node
+            - lost: True if the node went away before its EOT
+        '''
+
+        with self.nodes_lock:                                           # Only wrap up each node once
+            node = self.nodes.get( name )                               # ...
+            if( node is None or node.finishing ): return                # ...
+            node.finishing, node.lost = True, lost                      # ...
+
+        t = Thread( target=self.end_of_transmission, args=(node,) )     # Drain downloads off the MQTT thread so
+        t.daemon = True                                                 # ...traffic keeps flowing meanwhile
+        t.start()                                                       # ...
+
+# ------------------------------------------------------------------------
+
+    def begin_trace( self, node, entry ):
+        '''
+        Pick up an announced frame's trace on this side. The time
+        from capture to announcement is measured on the wall clock,
+        as the two hosts' monotonic clocks cannot be compared.
+
+        INPUTS:
+            - node : RemoteNode that announced the frame
+            - entry: Its manifest entry
+        '''
+
+        local = node.local_name( entry["name"] )                        # Frames without a trace ID (old
+        delivery = None                                                 # ...protocol) are traced by local name
+        if( "t" in entry ):                                             # Capture to announcement received
+            delivery = max( 0.0, time() - entry["t"] )                  # ...
+            self.tracer.observe( "delivery", delivery )                 # ...
+        self.tracer.begin( entry.get("trace") or local, name=local,     # ...
+                           source=node.name, delivery=delivery )        # ...
+
+# ------------------------------------------------------------------------
+
+    def end_of_transmission( self, node ):
+        '''
+        Wait for a node's download pool to drain, then acknowledge
+        its EOT. Once every node is done, shutdown the MQTT client.
+
+        INPUT:
+            - node: RemoteNode to wrap up
+        '''
+
+        print( "Waiting for downloads from {} to finish".format(node.name) )
+        node.queue.join()                                               # Block until every queued image has landed
+
+        if( node.lost ):                                                # Node is gone, keep whatever we got
+            print( "Lost node {} before its EOT".format(node.name) )    # [INFO] ...
+
+        elif( node.got_manifest.wait( 5.0 ) ):                          # Check against the final manifest
+            for attempt in range( 3 ):                                  #   Re-fetch missing/corrupt frames a few times
+                with self.manifest_lock:                                #   ...
+                    missing = [ e["name"] for e in node.final_manifest  #   ...
+                                if node.local_name(e["name"]) not in self.landed ]
+                if( len(missing) == 0 ): break                          #   ...
+                print( "Re-fetching {} missing frame(s) from {}".format(len(missing), node.name) )
+                for name in missing: node.enqueue( name )               #   ...
+                node.queue.join()                                       #   ...
+
+            with self.manifest_lock:                                    #   [INFO] ...
+                intact = sum( 1 for e in node.final_manifest            #   ...
+                              if node.local_name(e["name"]) in self.landed )
+            print( "{}: {}/{} frames landed intact".format(             #   ...
+                   node.name, intact, len(node.final_manifest)) )       #   ...
+
+        with self.nodes_lock:                                           # Remember we took this scan
+            self.finished_scans.add( (node.name, node.scan) )           # ...
+        if( not node.lost ):                                            # Send EOT to inform node to
+            eot = self.client.publish( node.topics[ "control" ],        # ...shutdown its MQTT client
+                                       "EOT", qos=1, retain=False  )    # ...
+            eot.wait_for_publish()                                      # ...before we may disconnect
+        for i in range( self.num_workers ):                             # Stop node's download workers
+            node.enqueue( None, scan_nodes.STOP )                       # ...
+        node.done.set()                                                 # Node's share of the scan is in
+
+        with self.nodes_lock:                                           # Session is over once enough nodes
+            nodes = list( self.nodes.values() )                         # ...registered and all of them are done
+            if( self.ending or len(nodes) < self.min_nodes ): return    # ...
+            if( not all(n.done.is_set() for n in nodes) ): return       # ...
+            self.ending = True                                          # ...only end it once
+
+        self.end_session()                                              # Wrap up the scan
+
+# ------------------------------------------------------------------------
+
+    def new_session( self ):
+        '''
+        Reset per-scan state for the next scan session. In daemon
+        mode each scan gets its own image directory under IMG_DIR
+        and nodes already waiting to be scanned are picked up.
+        '''
+
+        self.session += 1                                               # Name the scan
+        if( self.daemon ):                                              # ...and give it a directory
+            self.session_name = "scan-{}-{}".format( strftime("%Y%m%d-%H%M%S"), self.session )
+            self.img_dir = os.path.join( self.img_root, self.session_name )
+            os.makedirs( self.img_dir )                                 # ...
+            final_cmd = None                                            # Global stages go to the job queue
+        else:                                                           # Single scan straight into IMG_DIR
+            self.session_name = "scan"                                  # ...
+            self.img_dir = self.img_root                                # ...
+            final_cmd = self.fill_scan( self.recon_cmd, self.img_dir )  # ...run in place by run()
+
+        self.pipeline = ReconPipeline( self.image_cmd, final_cmd,       # Per-image & pair stages of this scan
+                                       self.recon_workers, self.tracer, # ...
+                                       self.artifact_cache,             # ...
+                                       self.artifacts, self.pair_cmd,   # ...
+                                       self.tool_params,                # ...
+                                       self.cluster_plan(self.img_dir) )# ...pairs matched within clusters
+        preview_dir = os.path.join( self.img_dir, preview_tier.PREVIEW_DIR )
+        if( not os.path.isdir(preview_dir) ): os.makedirs( preview_dir )# Previews land apart from full frames
+        self.previews = preview_tier.PreviewMonitor( preview_dir,       # ...and are checked for coverage
+                                                     self.preview_cmd,  # ...
+                                                     self.publish_coverage )
+        with self.manifest_lock:                                        # Nothing announced or landed yet
+            self.manifest = {}                                          # Local image name -> announced size/checksum/time
+            self.landed = set()                                         # Images downloaded and verified
+            self.landed_at = {}                                         # Local image name -> time it landed
+        with self.nodes_lock:                                           # No nodes yet
+            self.nodes = {}                                             # Node name -> RemoteNode
+            self.ending = False                                         # Set once the scan is wrapping up
+
+        if( self.session > 1 ):                                         # Re-subscribing re-delivers retained
+            self.client.subscribe( self.MQTT_topics["nodes"], qos=1 )   # ...registrations of waiting nodes
+
+# ------------------------------------------------------------------------
+
+    def end_session( self ):
+        '''
+        Wrap up a scan once every node is done. A single scan
+        shuts down the MQTT client and run() reconstructs it; a
+        daemon starts the next session right away and queues this
+        scan's reconstruction as a job.
+        '''
+
+        self.record_frames()                                            # What the reconstruction gets to order
+
+        if( not self.daemon ):                                          # Single scan
+            print( "Disconnectiong MQTT" ) ,                            # [INFO] ...
+            self.t_end = monotonic()                                    # Shutdown is timed from here
+            self.client.disconnect()                                    # Disconnect MQTT client (ends loop_forever())
+            print( "...DONE!" )                                         # [INFO] ...
+            return
+
+        name, img_dir, pipeline = self.session_name, self.img_dir, self.pipeline
+        previews = self.previews                                        # ...
+        self.new_session()                                              # Next scan can start landing now
+        print( "Scan {} complete, next one may start".format(name) )    # [INFO] ...
+
+        pipeline.finish()                                               # Wait for this scan's per-image stages
+        pipeline.close()                                                # ...
+        self.finish_previews( previews )                                # ...and its preview reconstruction
+        if( self.recon_cmd is None ): return                            # Nothing to reconstruct with
+
+        try:                                                            # Queue global stages as a job
+            self.jobs.submit( name, self.fill_scan(self.recon_cmd, img_dir), block=False )
+        except Full:                                                    # Queue is full, leave images on disk
+            print( "Job queue full, not reconstructing {}".format(name) )
+            self.publish_job( {"id": name, "status": "rejected"} )      # ...
+
+# ------------------------------------------------------------------------
+
+    def fill_scan( self, cmd, img_dir ):
+        '''
+        Fill a scan's image directory into a command template; with
+        clustering on, the command runs on each cluster instead
+        '''
+
+        if( cmd is None ): return( None )
+        if( self.cluster is not None ):                                 # Partitioned over the scan
+            return( recon_partition.partition_command(cmd, img_dir, **self.cluster) )
+        model = os.path.join( img_dir, recon_partition.MODEL_FILE )     # ...or run on it as a whole
+        return( [ arg.replace("{scan}", img_dir).replace("{model}", model) for arg in cmd ] )
+
+# ------------------------------------------------------------------------
+
+    def cluster_plan( self, img_dir ):
+        '''
+        What a scan's pair stage calls for the clusters it will be
+        reconstructed in, planned from the frame record exactly as
+        the partitioned reconstruction plans them, so only pairs
+        within a cluster are matched (None == not partitioned)
+        '''
+
+        if( self.cluster is None or self.recon_cmd is None ): return( None )
+        planner = recon_partition.PartitionedRecon( None, **self.cluster )
+        return( lambda: planner.plan(img_dir) )
+
+# ------------------------------------------------------------------------
+
+    def record_frames( self ):
+        '''
+        Write the entries of the scan's landed full frames next to
+        them, named as stored locally, so the reconstruction can
+        order them by capture time, turntable angle, ...
+        '''
+
+        with self.manifest_lock:
+            entries = [ dict(self.manifest.get(name, {}), name=name)    # ...
+                        for name in sorted( self.landed )               # ...
+                        if not preview_tier.is_preview( self.manifest.get(name, {}) ) ]
+        scan_manifest.save_frames( os.path.join(self.img_dir, scan_manifest.FRAMES_FILE), entries )
+
+# ------------------------------------------------------------------------
+
+    def publish_job( self, status ):
+        '''
+        Publish the status of a reconstruction job
+
+        INPUT:
+            - status: ReconJob.describe() dictionary
+        '''
+
+        self.client.publish( self.MQTT_topics[ "jobs" ],                # Publish status for operators
+                             json.dumps(status), qos=1 )                # ...
+        if( status["status"] in ("done", "failed") ):                   # Time the global stages
+            self.tracer.observe( "reconstruct",                         # ...
+                                 status["finished"] - status["started"] )
+        with self.print_lock:                                           # [INFO] ...
+            print( "Job {}: {}".format(status["id"], status["status"]) )
+
+# ------------------------------------------------------------------------
+
+    def job_command( self, payload ):
+        '''
+        Carry out a command received on the control topic:
+            { "cmd": "cancel", "job": "<id>" }
+            { "cmd": "priority", "job": "<id>", "priority": N }
+        '''
+
+        if( self.jobs is None ): return                                 # Not running as a daemon
+        try:
+            cmd = json.loads( payload )                                 # Decode command
+            if  ( cmd["cmd"] == "cancel"   ): ok = self.jobs.cancel( cmd["job"] )
+            elif( cmd["cmd"] == "priority" ): ok = self.jobs.prioritize( cmd["job"], int(cmd["priority"]) )
+            else                            : ok = False
+        except( ValueError, KeyError, TypeError ):                      # Malformed command
+            ok = False                                                  # ...
+        if( not ok ): print( "Ignored job command {}".format(payload) ) # [INFO] ...
 
 # ------------------------------------------------------------------------
 
     def client_loop( self ):
         '''
-        A simple, basic workaround for the MQTT's library stupid 
-        threaded implementation of loop() that doesn't really work.
+        MQTT network loop. Blocks in select() until there is traffic
+        and returns as soon as disconnect() is called, so neither
+        messages nor shutdown wait on a polling timeout.
         '''
         
-        self.loop = True                                                # Boolean loop flag
-        while( self.loop ):                                             # Loop 43va while loop flag is TRUE
-            self.client.loop( timeout=1.0 )                             #   Pool messages queue for new data
+        self.client.loop_forever( retry_first_connection=False )        # Process messages until we disconnect
+
+        if( self.t_end is not None ):                                   # Time from end of scan until we are down
+            self.tracer.observe( "shutdown", monotonic() - self.t_end ) # ...
         
 # ------------------------------------------------------------------------
 
-    def get_file( self, file_name ):
+    def FTP_connect( self, node ):
+        '''
+        Open a new FTP session to a node and change into the
+        directory holding the images
+
+        INPUT:
+            - node: RemoteNode to connect to
+
+        OUTPUT:
+            - ftp: Logged in FTP session
+        '''
+
+        ftp = FTP()                                                     # Connect to host
+        ftp.connect( node.ip, node.ftp_port )                           # ...
+        ftp.login( self.USER, self.PASS )                               # Login as a known user (NOT anonymous user)
+
+        ftp.cwd( self.FTP_dir )                                         # Change current working directory to FTP directory
+##        ftp.retrlines( "LIST" )                                         # List contents of FTP directory (make sure things are working)
+
+        return( ftp )
+
+# ------------------------------------------------------------------------
+
+    def stream_connect( self, node ):
+        '''
+        Open a new connection to a node's in-memory frame endpoint
+
+        INPUT:
+            - node: RemoteNode to connect to
+
+        OUTPUT:
+            - conn: FrameStreamClient connected to the node
+        '''
+
+        return( FrameStreamClient( node.ip, node.stream_port,           # Buffer tuned before connecting,
+                                   rcvbuf=self.tuner.sockbuf(node.ip),  # ...and the node's scan token
+                                   token=node.token ) )                 # ...
+
+# ------------------------------------------------------------------------
+
+    def download_worker( self, node ):
+        '''
+        Pull image names off a node's queue and retrieve them over a
+        persistent FTP (or frame stream) session owned by this
+        worker. The session is re-established whenever a transfer
+        fails, and the transfer resumes from where it stopped.
+
+        INPUT:
+            - node: RemoteNode this worker downloads from
+        '''
+
+        if( node.stream_port is None ):                                 # Pick transfer method
+            connect, fetch = self.FTP_connect, self.get_file            #   FTP folder on the node
+        else:                                                           #   ...or
+            connect, fetch = self.stream_connect, self.get_stream       #   RAM on the node
+
+        session = None                                                  # Worker's own session
+        engine = TransferEngine( self.tuner, node.ip )                  # Worker's own receive buffer
+        while( True ):                                                  # Serve the queue until the node is done
+            _, _, file_name = node.queue.get()                          #   Block until an image is announced
+            if( file_name is None ):                                    #   Node is done
+                try   : session.close()                                 #       Close session
+                except: pass                                            #       ...
+                node.queue.task_done()                                  #       ...
+                return                                                  #       ...
+            local = node.local_name( file_name )                        #   Name it is stored under here
+            with self.manifest_lock:                                    #   Announced again (pause timeout, QoS 1
+                again = local in self.landed                            #   ...redelivery) after it landed: only
+            if( again ):                                                #   ...ack it, it was handed on already
+                self.client.publish( node.topics["acks"], file_name, qos=1 )
+                node.queue.task_done()                                  #   ...
+                continue                                                #   ...
+            entry = self.entry_of( local )                              #   What the image should look like
+            trace = entry.get( "trace" ) or local                       #   ...and its trace
+            self.tracer.mark( trace, "queue" )                          #   ...
+
+            if( self.use_local( local, entry, trace ) ):                #   Skip transfer if we already have it
+                self.image_landed( node, local, entry, trace )          #   ...
+                node.queue.task_done()                                  #   ...
+                continue                                                #   ...
+
+            part = self.part_path( local, entry )                       #   Partial download lives here
+            if( "sha1" not in entry and os.path.isfile(part) ):         #   Without a checksum we cannot tell whose
+                os.remove( part )                                       #   ...partial this is, so start afresh
+
+            for attempt in range( 3 ):                                  #   Retry a couple of times on failure
+                try:
+                    offset = 0                                          #       Resume from the end of the partial
+                    if( os.path.isfile(part) ):                         #       ...
+                        offset = os.path.getsize( part )                #       ...
+                    if( offset > entry.get("size", offset) ):           #       Partial is bigger than the image
+                        os.remove( part )                               #       ...so it cannot be resumed
+                        offset = 0                                      #       ...
+
+                    if( offset < entry.get("size", offset+1) ):         #       Fetch whatever is left
+                        if( session is None ): session = connect(node)  #       (Re)connect if we have no session
+                        expected = None                                 #       Bytes left, if announced
+                        if( "size" in entry ): expected = entry["size"] - offset
+                        fetch( file_name, session, part, offset,        #       Retrieve image
+                               expected, engine )                       #       ...
+                        self.tracer.mark( trace, "transfer" )           #       ...
+
+                    self.complete_file( local, entry, part )            #       Verify it and move it into place
+                    self.tracer.mark( trace, "verify" )                 #       ...
+                    self.image_landed( node, local, entry, trace )      #       Hand it on
+                    break                                               #       ...
+
+                except Exception as e:                                  #   On failure, drop the session and retry
+                    with self.print_lock:                               #       [INFO] ...
+                        print( "Failed to retrieve {} ({})".format(file_name, e) )
+                    try   : session.close()                             #       Close broken session
+                    except: pass                                        #       ...
+                    session = None                                      #       ...
+                    sleep( 0.5 )                                        #       Give the link a moment
+
+            else:                                                       #   Out of retries
+                rounds = node.failures.get( file_name, 0 ) + 1          #   ...
+                node.failures[ file_name ] = rounds                     #   ...
+                if( rounds < 5 ):                                       #   The link may be back shortly and the
+                    node.enqueue( file_name, scan_nodes.PREVIEW         #   ...node holds the frame until we ack
+                                  if preview_tier.is_preview(entry)     #   ...it, so queue it again behind the
+                                  else scan_nodes.FULL )                #   ...frames already waiting
+                else:                                                   #   Left for the re-fetch after EOT
+                    self.tracer.finish( trace, "failed" )               #   ...
+
+            node.queue.task_done()                                      #   Mark image as handled
+
+# ------------------------------------------------------------------------
+
+    def entry_of( self, file_name ):
+        '''
+        Announced description (size, checksum, ...) of an image,
+        by the name it is stored under locally
+        '''
+
+        with self.manifest_lock:
+            return( self.manifest.get( file_name, {"name": file_name} ) )
+
+# ------------------------------------------------------------------------
+
+    def use_local( self, file_name, entry, trace=None ):
+        '''
+        Satisfy an image from disk instead of the network when its
+        checksum is known and either the local file already matches
+        or the image is in the cache
+
+        INPUTS:
+            - file_name: Local name of image
+            - entry    : Its manifest entry
+            - trace    : Trace ID of the image
+
+        OUTPUT:
+            - done: True if the image is now in place
+        '''
+
+        if( "sha1" not in entry ): return( False )                      # Can't trust local copies without a checksum
+
+        localfile = self.local_path( file_name )                        # Image may already be in place
+        if( scan_manifest.verify(localfile, entry) ):                   # ...
+            source = "on disk"                                          # ...
+            if( self.cache is not None ):                               # ...make sure it is cached too
+                self.cache.add( entry["sha1"], localfile )              # ...
+        elif( self.cache is not None and                                # Or linked in from the cache
+              self.cache.fetch(entry["sha1"], localfile) ):             # ...
+            source = "from cache"                                       # ...
+        else:
+            return( False )                                             # Needs to be transferred
+
+        with self.manifest_lock:                                        # Mark as landed
+            self.landed.add( file_name )                                # ...
+            self.landed_at[ file_name ] = time()                        # ...
+        self.tracer.mark( trace, "local" )                              # ...
+        with self.print_lock:                                           # [INFO] ...
+            print( "Skipped {} ({})".format(file_name, source) )        # ...
+        return( True )
+
+# ------------------------------------------------------------------------
+
+    def image_landed( self, node, file_name, entry, trace=None ):
+        '''
+        Ack an image that is in place and hand it on: full frames
+        go to the per-image reconstruction stages, previews to the
+        coverage check (and preview reconstruction)
+
+        INPUTS:
+            - node     : RemoteNode it came from
+            - file_name: Local name of image
+            - entry    : Its manifest entry
+            - trace    : Trace ID of the image
+        '''
+
+        self.client.publish( node.topics[ "acks" ], entry["name"],      # Node may free it now
+                             qos=1 )                                    # ...
+
+        if( not preview_tier.is_preview(entry) ):                       # Full frame
+            self.pipeline.submit( self.local_path(file_name), trace,    # ...
+                                  entry.get("sha1") )                   # ...
+            return
+
+        if( "t" in entry ):                                             # Capture to preview landed
+            self.tracer.observe( "preview", max(0.0, time() - entry["t"]) )
+        self.previews.add( node.name, entry )                           # ...
+
+# ------------------------------------------------------------------------
+
+    def publish_coverage( self, report ):
+        '''
+        Publish the coverage of the landed previews for operators
+        '''
+
+        self.client.publish( self.MQTT_topics[ "preview" ],             # Frequent and superseded quickly,
+                             json.dumps(report), qos=0 )                # ...so fire & forget
+        if( report["complete"] and report["previews"] == report["expected"] ):
+            with self.print_lock:                                       # [INFO] Once, when the last one lands
+                print( "All {} previews in, coverage {}".format(        # ...
+                       report["previews"], report.get("nodes", "n/a")) )
+
+# ------------------------------------------------------------------------
+
+    def finish_previews( self, previews ):
+        '''
+        Wait for a scan's preview reconstruction and time it
+        '''
+
+        seconds = previews.finish()                                     # ...
+        if( seconds is not None ):                                      # ...
+            self.tracer.observe( "preview_reconstruct", seconds )       # ...
+
+# ------------------------------------------------------------------------
+
+    def complete_file( self, file_name, entry, part ):
+        '''
+        Verify a downloaded image against its announced size and
+        checksum, then move it into place and cache it. Raises
+        IOError (and discards the partial) if it does not match.
+
+        INPUTS:
+            - file_name: Local name of image
+            - entry    : Its manifest entry
+            - part     : Path of the downloaded data
+        '''
+
+        if( not scan_manifest.verify( part, entry ) ):                  # Corrupt, resuming would not help
+            os.remove( part )                                           # ...
+            raise IOError( "{} does not match its manifest entry".format(file_name) )
+
+        localfile = self.local_path( file_name )                        # Move into place, replacing any stale
+        if( os.path.exists(localfile) ): os.remove( localfile )         # ...(possibly hard-linked) copy
+        os.rename( part, localfile )                                    # ...
+
+        if( self.cache is not None and "sha1" in entry ):               # Keep a copy for future scans
+            self.cache.add( entry["sha1"], localfile )                  # ...
+
+        with self.manifest_lock:                                        # Mark as landed
+            self.landed.add( file_name )                                # ...
+            self.landed_at[ file_name ] = time()                        # ...
+
+# ------------------------------------------------------------------------
+
+    def local_path( self, file_name ):
+        '''
+        Path an image is stored at on the client
+        '''
+
+        return( os.path.join(self.img_dir, file_name) )
+
+# ------------------------------------------------------------------------
+
+    def part_path( self, file_name, entry ):
+        '''
+        Path an image is downloaded to before it is verified. The
+        checksum is part of the name so partials of different scans
+        reusing the same image name never mix.
+        '''
+
+        if( "sha1" in entry ):
+            return( "{}.{}.part".format(self.local_path(file_name), entry["sha1"][:12]) )
+        return( "{}.part".format(self.local_path(file_name)) )
+
+# ------------------------------------------------------------------------
+
+    def open_part( self, part ):
+        '''
+        Open a partial download for writing without truncating it,
+        so a transfer can resume into it
+        '''
+
+        if( os.path.isfile(part) ): return( open(part, 'r+b') )         # Resume into existing partial
+        else                      : return( open(part, 'w+b') )         # ...or start a new one
+
+# ------------------------------------------------------------------------
+
+    def report( self, file_name, n, offset, engine ):
+        '''
+        Print the size and rate of a finished transfer
+        '''
+
+        resumed = " resumed at {}".format( offset ) if offset else ''   # [INFO] ...
+        with self.print_lock:                                           # ...
+            print( "Retrieved {} ({:.2f} MB at {:.2f} MB/s{})".format(  # ...
+                   file_name, n/1e6, engine.last_rate/1e6, resumed) )   # ...
+
+# ------------------------------------------------------------------------
+
+    def get_file( self, file_name, ftp, part, offset, expected, engine ):
         '''
         Get file from FTP directory
 
         INPUT:
             - file_name: Name of file we want to get
+            - ftp      : FTP session to retrieve file over
+            - part     : Local file to write to
+            - offset   : Byte offset to resume from (FTP REST)
+            - expected : Number of bytes left to fetch (None == unknown)
+            - engine   : Worker's TransferEngine
         '''
 
-        print( "Retrieving {}".format(file_name) ) ,                    # [INFO] ...
-        
-        localfile = r".\imgs\{}".format(file_name)                      # Specify image storage path
-        with open( localfile, 'wb' ) as f:                              # Open file for writing
-            self.ftp.retrbinary( "RETR "+file_name,                     # Retrieve file from FTP directory and copy
-                                 f.write, 2048 )                        # contents to localfile at 2048 bytes chunks
-            
-        print( "...DONE!" )                                             # [INFO] ...
+        with self.open_part( part ) as f:                               # Open partial for writing
+            n = engine.ftp_retr( ftp, file_name, f, offset, expected )  # Retrieve file from FTP directory
+
+        self.report( file_name, n, offset, engine )                     # [INFO] ...
+
+# ------------------------------------------------------------------------
+
+    def get_stream( self, file_name, conn, part, offset, expected, engine ):
+        '''
+        Get file straight from the server's RAM
+
+        INPUT:
+            - file_name: Name of file we want to get
+            - conn     : FrameStreamClient to retrieve file over
+            - part     : Local file to write to
+            - offset   : Byte offset to resume from (HTTP Range)
+            - expected : Number of bytes left to fetch (None == unknown)
+            - engine   : Worker's TransferEngine
+        '''
+
+        with self.open_part( part ) as f:                               # Open partial for writing
+            n = engine.stream_fetch( conn, file_name, f, offset,        # Stream frame into local file
+                                     expected )                         # ...
+
+        self.report( file_name, n, offset, engine )                     # [INFO] ...
+
+# ------------------------------------------------------------------------
+
+    def wait_for_loop( self ):
+        '''
+        Block until the MQTT loop exits. Joins in short slices so
+        Ctrl+C still gets through on Python 2, where an untimed
+        join() cannot be interrupted.
+        '''
+
+        while( self.t_client_loop.is_alive() ):                         # Returns the moment the thread ends
+            self.t_client_loop.join( 1.0 )                              # ...
 
 # ------------------------------------------------------------------------
 
@@ -185,43 +939,72 @@ class FTP_photogrammetery_Client( object ):
         Main thread
         '''
         
-        sleep( 0.5 )                                                    # Sleep for stability
         print( "Client Initialized" )                                   # [INFO] ...
 
-        print( "Waiting for FTP IP address" )                           # [INFO] ...
+        if( self.daemon ):                                              # Sessions start & end as nodes come & go
+            print( "Client Ready, waiting for scans\n" )                #   [INFO] ...
+            self.wait_for_loop()                                        #   Run until stopped
+            return                                                      #   ...
+
+        print( "Waiting for camera nodes" )                             # [INFO] ...
         cntr = 0                                                        # Counter for displaying "waiting" dots
-        while( self.FTP_server_ip is None ):                            # Wait until we get a vlid IP address
-            sleep( 1 )                                                  #   ...
-            print( '.' ) ,                                              #   ...
+        while( not self.node_found.wait(1.0) ):                         # Wait until a node registers, waking
+            print( '.' ) ,                                              #   ...the moment it does
             cntr += 1                                                   #   ...
             if( cntr == 15 ):                                           #   If we already printed 15 dots
                 cntr = 0                                                #       Reset counter
                 print( '' )                                             #       Start a new line
-        if( cntr is not 0 ): print( '' )                                # Start a new line
+        if( cntr != 0 ): print( '' )                                    # Start a new line
 
         print( "Client Ready\n" )                                       # [INFO] ...
-        
-        self.ftp = FTP( self.FTP_server_ip )                            # Connect to host using default port
-        self.ftp.login( FTP_USER, FTP_PASS )                            # Login as a known user (NOT anonymous user)
-
-##        self.ftp.cwd( "/home/pi/FTP/" )                                 # Change current working directory to FTP directory (Raspbian)
-        self.ftp.cwd( "./Pictures/" )                                   # Change current working directory to FTP directory (DietPi)
-##        self.ftp.retrlines( "LIST" )                                    # List contents of FTP directory (make sure things are working)
 
-        while( self.loop ):                                             # While we are still receiving data (images)
-            sleep( 0.1 )                                                #   Stay in loop to waste time
+        self.wait_for_loop()                                            # Receive images until the scan ends
 
+        self.finish_previews( self.previews )                           # Wait for the preview reconstruction
         print( "Running VisualSFM" ) ,                                  # [INFO] ...
-        p = Popen( [r".\main.bat"] )                                    # Call batch file with VisualSFM commands
-        stdout, stderr = p.communicate()                                # ...
+        self.pipeline.finish()                                          # Wait for per-image stages, then call batch
+        self.tracer.close()                                             # Flush trace log
         print( "...DONE!" )                                             # {INFO] ...
         
 # ************************************************************************
 # ===========================> SETUP  PROGRAM <===========================
 # ************************************************************************      
 
-MQTT_IP_ADDRESS     = "192.168.42.1"                                    # IP address for MQTT broker
-##FTP_USER, FTP_PASS  = "pi", "raspberry"                                 # FTP login credentials (Raspbian)
-FTP_USER, FTP_PASS  = "dietpi", "dietpi"                                # FTP login credentials (DietPi)
+if __name__ == "__main__":
+    MQTT_IP_ADDRESS     = "192.168.42.1"                                # IP address for MQTT broker
+##    FTP_USER, FTP_PASS  = "pi", "raspberry"                             # FTP login credentials (Raspbian)
+    FTP_USER, FTP_PASS  = "dietpi", "dietpi"                            # FTP login credentials (DietPi)
+##    FTP_DIR             = "/home/pi/FTP/"                               # FTP directory (Raspbian)
+    FTP_DIR             = "./Pictures/"                                 # FTP directory (DietPi)
+    FTP_WORKERS         = 4                                             # Number of concurrent downloads per node
+    STREAM              = True                                          # Pull from nodes' RAM endpoints when offered
+    IMAGE_CMD           = None                                          # Per-image stage, e.g. [ "VisualSFM", "siftgpu", "{image}" ]
+    RECON_WORKERS       = 2                                             # Concurrent per-image stage processes
+    CACHE_DIR           = r".\cache"                                    # Content-addressed image cache (None == disabled)
+    CACHE_BYTES         = 2*2**30                                       # Image cache size budget (2 GiB)
+    IMG_DIR             = r".\imgs"                                     # Where images are stored locally
+    RECON_CMD           = [ r".\main.bat" ]                             # Batch file with VisualSFM commands
+    NODES               = 1                                             # Number of camera nodes in the rig
+    DAEMON              = False                                         # Keep taking scans, queueing reconstructions
+    TRACE_LOG           = r".\trace.jsonl"                              # Per-frame stage timings (None == off)
+    METRICS_PORT        = 9108                                          # Stage histograms on http://localhost:9108/metrics (None == off)
+    PAIR_CMD            = None                                          # Per-pair matcher, e.g. [ "matcher", "{a}", "{b}", "{out}" ]
+    ARTIFACT_DIR        = r".\artifacts"                                # Feature & match cache (None == disabled)
+    PREVIEW_CMD         = None                                          # Quick reconstruction over previews, e.g. [ r".\preview.bat", "{scan}" ]
+    CLUSTER_SIZE        = None                                          # Reconstruct larger scans in overlapping clusters, e.g. 40
+    CLUSTER_BY          = "order"                                       # ...ordered by "order", "angle" or "similarity"
+
+    prog = FTP_photogrammetery_Client( MQTT_IP_ADDRESS, FTP_USER,       # Start program
+                                       FTP_PASS, FTP_WORKERS,           # ...
+                                       STREAM, IMAGE_CMD,               # ...
+                                       RECON_WORKERS, CACHE_DIR,        # ...
+                                       CACHE_BYTES, IMG_DIR, FTP_DIR,   # ...
+                                       RECON_CMD=RECON_CMD, NODES=NODES,
+                                       DAEMON=DAEMON, TRACE_LOG=TRACE_LOG,
+                                       METRICS_PORT=METRICS_PORT,       # ...
+                                       PREVIEW_CMD=PREVIEW_CMD,         # ...
+                                       PAIR_CMD=PAIR_CMD,               # ...
+                                       ARTIFACT_DIR=ARTIFACT_DIR,       # ...
+                                       CLUSTER_SIZE=CLUSTER_SIZE,       # ...
+                                       CLUSTER_BY=CLUSTER_BY )          # ...
 
-prog = FTP_photogrammetery_Client( MQTT_IP_ADDRESS, FTP_USER, FTP_PASS )# Start program
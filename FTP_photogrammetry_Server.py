@@ -11,9 +11,26 @@
 
 # Import modules
 from    time                        import  sleep, time                 # Add delays and wait times
-from    threading                   import  Thread                      # Use threads to free up main()
-from    picamera                    import  PiCamera                    # Take pictures
-from    commands                    import  getoutput                   # Get output of commands issued in CLI
+from    threading                   import  Thread, Event, Lock         # Use threads to free up main()
+from    camera_backend              import  PiCameraBackend             # Take pictures
+from    capture_scheduler           import  DeadlineScheduler           # Pace captures against absolute deadlines
+from    motor_control               import  MotionController            # Coordinated turntable scans
+from    motor_control               import  HATStepperBackend           # ...
+from    frame_stream                import  FrameStore                  # Keep captured frames in RAM
+from    frame_stream                import  FrameStreamServer           # Serve frames straight from RAM
+from    frame_buffer                import  FrameBuffer                 # Hold frames until the client acks them
+from    io                          import  BytesIO                     # In-memory capture buffers
+from    scan_metrics                import  Tracer, monotonic           # Per-frame stage timings
+import  socket                                                          # Default node name
+import  uuid                                                            # Per-scan stream token
+import  os                                                              # Preview folder
+import  preview_tier                                                    # Low-resolution copies sent ahead
+import  frame_quality                                                   # Drop blurred/badly exposed/duplicate frames
+import  json                                                            # Rejection reports
+import  scan_manifest                                                   # Structured frame announcements
+import  scan_nodes                                                      # Per-node topics
+try:    from commands               import  getoutput                   # Get output of commands issued in CLI (Python 2)
+except: from subprocess             import  getoutput                   # ... (Python 3)
 import  paho.mqtt.client            as      mqtt                        # For general communications
 
 # ************************************************************************
@@ -21,46 +38,134 @@ import  paho.mqtt.client            as      mqtt                        # For ge
 # ************************************************************************ 
 class FTP_photogrammetery_Server( object ):
 
-    def __init__( self, MQTT_broker_ip, IMG_NUM, IMG_INTERVAL ):
+    def __init__( self, MQTT_broker_ip, IMG_NUM, IMG_INTERVAL, CAMERA=None, BURST=False,
+                  STREAM_PORT=None, PERSIST=False, BATCH=1,
+                  IMG_DIR="/mnt/dietpi_userdata/Pictures", MQTT_PORT=1883, IP=None,
+                  TURNTABLE=None, NODE=None, FTP_PORT=21, TRACE_LOG=None, METRICS_PORT=None,
+                  PREVIEW=None, QUALITY=None, RECAPTURE=1, BUFFER_HIGH=None, BUFFER_LOW=None,
+                  BUFFER_TIMEOUT=30.0 ):
         '''
         Initialize class
 
         INPUTS:
              - MQTT_broker_ip: IP address of MQTT broker
              - IMG_NUM       : Number of images we would like to take
-             - IMG_INTERVAL  : Interval at which we want to take imgs
+             - IMG_INTERVAL  : Interval at which we want to take imgs (0 == as fast as possible)
+             - CAMERA        : Camera backend (defaults to PiCameraBackend)
+             - BURST         : Capture continuously, ignoring IMG_INTERVAL
+             - STREAM_PORT   : Capture into RAM and serve frames on this port
+                               instead of through the FTP folder (None == FTP),
+                               on IP only and to clients holding the scan's token
+             - PERSIST       : In streaming mode, also write frames to the
+                               FTP folder in the background. Either way, frames
+                               on disk are kept after the client acks them
+             - BATCH         : Number of frames announced per MQTT message
+             - IMG_DIR       : FTP folder images are written to
+             - MQTT_PORT     : Port of MQTT broker
+             - IP            : Address to advertise to the client (None == from `hostname -I`)
+             - TURNTABLE     : MotionController; if given, IMG_NUM frames are taken at
+                               evenly spaced angles instead of at IMG_INTERVAL
+             - NODE          : Name this camera node registers under (None == hostname)
+             - FTP_PORT      : Port of this node's FTP server, advertised to the client
+             - TRACE_LOG     : JSON-lines file per-frame stage timings are appended to
+             - METRICS_PORT  : Serve stage histograms on http://<IP>:<port>/metrics
+             - PREVIEW       : preview_tier.PreviewSpec; if given, a preview of every
+                               frame is stored and announced ahead of the frame itself
+             - QUALITY       : frame_quality.QualityGate; if given, every frame is checked
+                               off the capture thread and only frames that pass are
+                               stored and announced
+             - RECAPTURE     : Rounds of recapturing frames the gate rejected for blur or
+                               exposure (0 == just drop them); duplicates are always dropped
+             - BUFFER_HIGH   : Bytes of frames the client has not acked yet at which
+                               capture pauses (None == never pause)
+             - BUFFER_LOW    : Bytes capture resumes at (None == half of BUFFER_HIGH)
+             - BUFFER_TIMEOUT: Seconds a pause may last before the unacked frames are
+                               announced again; if that does not help either, capture
+                               resumes regardless until the client acks again
         '''
-        
-        self.MQTT_topics = { "IP_addr": "ftp/IP_addr",                  # For IP address communications
-                             "status" : "ftp/status" ,                  # For handshakes communications
-                             "images" : "ftp/images" ,                  # For image name communications
-                             "general": "ftp/general" }                 # For things that are not in any previous category
-        
+
+        self.t_start = monotonic()                                      # Time to first capture is measured from here
+        if( NODE is None ): NODE = socket.gethostname().split( '.' )[0] # Default to the Pi's hostname
+        self.node = NODE                                                # Name of this camera node
+        self.MQTT_topics = scan_nodes.node_topics( NODE )               # Node's own namespace (info, images,
+                                                                        # ...status, control & general)
+        self.FTP_port = FTP_PORT                                        # Advertised FTP port
+        self.scan_id = "{:.0f}".format( time()*1000 )                   # Unique to this run of the node
+        self.token = uuid.uuid4().hex                                   # Secret the frame endpoint asks for
+        self.ip = IP                                                    # Address advertised to the client;
+        self.address = self.get_IP()                                    # ...the endpoints listen there only
+        self.tracer = Tracer( NODE, TRACE_LOG, METRICS_PORT,            # Stage timings of every frame
+                              host=self.address )                       # ...
         self.imgs_quantity = IMG_NUM                                    # Store how many images we want
         self.imgs_interval = IMG_INTERVAL                               # Store the interval of acquisition
-
-        self.ready = False                                              # Flag indicating whether or not we are ready to take picture
-        self.MQTT_client_setup( MQTT_broker_ip )                        # Setup MQTT client
-        self.get_IP()                                                   # Get FTP IP address and send to client
+        self.scheduler = DeadlineScheduler( IMG_INTERVAL )              # Fires captures at absolute deadlines
+        self.img_dir = IMG_DIR                                          # FTP folder images are written to
+
+        if( CAMERA is None ): CAMERA = PiCameraBackend()                # Default to the real camera
+        self.camera = CAMERA                                            # Camera stays open for the whole scan
+        self.burst = BURST                                              # Whether to use continuous capture
+        self.turntable = TURNTABLE                                      # Turntable for coordinated scans
+
+        self.batch = max( 1, BATCH )                                    # Frames per announcement
+        self.pending = []                                               # Frames captured but not yet announced
+        self.manifest = []                                              # Every frame captured in this scan
+        self.entries = {}                                               # Name -> entry of every frame & preview held
+
+        self.persist = PERSIST                                          # Keep frames on disk once acked
+        self.buffer = FrameBuffer( BUFFER_HIGH, BUFFER_LOW,             # Frames held until the client acks them
+                                   self.evict_frame )                   # ...
+        self.buffer_timeout = BUFFER_TIMEOUT                            # ...but not forever
+        self.stream_port = STREAM_PORT                                  # Port of the in-memory frame endpoint
+        self.store = None                                               # In-memory frames (streaming mode only)
+        if( STREAM_PORT is not None ):                                  # Keep frames in RAM, optionally
+            self.store = FrameStore( self.img_dir if PERSIST else None )#   ...mirroring them to disk
+
+        self.preview = PREVIEW                                          # How previews are made (None == no previews)
+        preview_dir = os.path.join( self.img_dir, preview_tier.PREVIEW_DIR )
+        if( PREVIEW is not None and (self.store is None or PERSIST) and #   Previews on disk go in a sub-folder
+            not os.path.isdir(preview_dir) ):                           #   ...
+            os.makedirs( preview_dir )                                  #   ...
+
+        self.output_lock = Lock()                                       # Frames are handed on from the gate's workers
+        self.rejected = []                                              # (name, angle, reason) of rejected frames
+        self.recapture_rounds = RECAPTURE                               # ...and how often to retake them
+        self.quality = QUALITY                                          # Frame quality gate (None == off)
+        if( QUALITY is not None and not frame_quality.available() ):    # Needs NumPy & Pillow
+            print( "Quality gate needs NumPy and Pillow, frames will not be checked" )
+            self.quality = None                                         # ...
+        if( self.quality is not None ):                                 # ...
+            self.quality.start( self.frame_passed, self.frame_rejected )
+
+        self.soh = Event()                                              # Set once the client is ready for pictures
+        self.connected = Event()                                        # Set once the broker accepts our connection
+        self.t_first = None                                             # Start-up to first capture (seconds)
+        self.t_eot = None                                               # When we told the client we are done
+        self.MQTT_client_setup( MQTT_broker_ip, MQTT_PORT )             # Setup MQTT client
+        self.register()                                                 # Advertise node's address & capabilities
         self.run()                                                      # Run program
         
 # ------------------------------------------------------------------------
 
-    def MQTT_client_setup( self, addr ):
+    def MQTT_client_setup( self, addr, port=1883 ):
         '''
         Setup MQTT client
+
+        INPUTS:
+            - addr: IP address of MQTT broker
+            - port: Port of MQTT broker
         '''
 
         # Error handling in case MQTT communcation setup fails (1/2)
         try:
-            self.client = mqtt.Client( client_id="Server",              # Initialize MQTT client object
+            self.client = mqtt.Client( client_id="Server-" + self.node, # Initialize MQTT client object
                                        clean_session=True )             # ...
             
             self.client.max_inflight_messages_set( 60 )                 # Max number of messages that can be part of network flow at once
-            self.client.max_queued_messages_set( 0 )                    # Size 0 == unlimited
+            self.client.max_queued_messages_set( 0 )                    # Size 0 == unlimited; announcements are
+                                                                        # ...bounded by the frame buffer instead
 
-            self.client.will_set( self.MQTT_topics[ "status" ],         # "Last Will" message. Sent when connection is
-                                  "CONERR_SRVR", qos=1, retain=False )  # ...lost (aka, disconnect was not called)
+            self.client.will_set( self.MQTT_topics[ "info" ],           # "Last Will" message. Sent when connection is
+                                  '', qos=1, retain=True )              # ...lost, clears the node's registration
 
             self.client.reconnect_delay_set( min_delay=1,               # Min/max wait time in case of reconnection
                                              max_delay=2 )              # ...
@@ -68,12 +173,13 @@ class FTP_photogrammetery_Server( object ):
             self.client.on_connect = self.on_connect                    # Assign callback functions
             self.client.on_message = self.on_message                    # ...
             
-            self.client.connect( addr, port=1883, keepalive=60 )        # Connect to MQTT network
+            self.client.connect( addr, port=port, keepalive=60 )        # Connect to MQTT network
             self.t_client_loop=Thread(target=self.client_loop, args=()) # Start threaded MQTT data processing loop()
             self.t_client_loop.deamon = True                            # Allow program to shutdown even if thread is running
             self.t_client_loop.start()                                  # ...
 
-            sleep( 0.5 )                                                # Allow some time for connection to be established
+            if( not self.connected.wait(10.0) ):                        # Wait for the broker to accept us
+                raise IOError( "No CONNACK from {}:{}".format(addr, port) )
 
         # Error handling in case MQTT communcation setup fails (2/2)
         except Exception as e:
@@ -84,9 +190,9 @@ class FTP_photogrammetery_Server( object ):
             quit()                                                      # Shutdown entire program
 
         print( "Clearing retained messages on initial run" ) ,          # [INFO] ...
-        for _, topic in self.MQTT_topics.iteritems():                   # Clear ALL retianed messages in all the sub-topics within
+        for _, topic in self.MQTT_topics.items():                       # Clear ALL retianed messages in all the sub-topics within
             self.client.publish( topic, '', qos=1, retain=True )        # the FTP main topic by sending an empty string
-        print( "...DONE!\n" )                                             # [INFO] ...
+        print( "...DONE!\n" )                                           # [INFO] ...
         
 # ------------------------------------------------------------------------
 
@@ -94,13 +200,15 @@ class FTP_photogrammetery_Server( object ):
         '''
         Callback function for when connection is established/attempted.
         
-        Prints connection status and subscribes to ftp/# topic on
-        successful connection.
+        Prints connection status and subscribes to the node's
+        control topic on successful connection.
         '''
         
         if  ( rc == 0 ):                                                # Upon successful connection
             print(  "MQTT Connection Successful"  )                     #   Subscribe to topic of choice
-            self.client.subscribe( "ftp/#", qos=1 )                     #   ...
+            self.client.subscribe( self.MQTT_topics["control"], qos=1 ) #   ...
+            self.client.subscribe( self.MQTT_topics["acks"], qos=1 )    #   ...
+            self.connected.set()                                        #   Wake MQTT_client_setup()
 
         elif( rc == 1 ):                                                # Otherwise if connection failed
             print( "Connection Refused - Incorrect Protocol Version" )  #   Troubleshoot
@@ -129,18 +237,25 @@ class FTP_photogrammetery_Server( object ):
         Callback function for when a message is received.
         '''
         
-        if( msg.topic == self.MQTT_topics[ "status" ] ):                # If we receive something on the status topic
+        if( msg.topic == self.MQTT_topics[ "control" ] ):               # If we receive something on the control topic
             status = msg.payload.decode( "utf-8" )                      #   Decode it and determine next action
 
-            if  ( status == "SOH" ) : self.ready = True                 #   If we get an SOH, we are ready to proceed
+            if  ( status == "SOH" ) : self.soh.set()                    #   If we get an SOH, we are ready to proceed
             elif( status == "EOT" ) :                                   #   If end of transmission is indicated
+                if( self.store is not None ):                           #       Client is done with the frames
+                    self.stream_server.stop()                           #       ...stop serving them
+                    self.store.flush()                                  #       ...and finish persisting them
+                self.tracer.close()                                     #       Flush trace log
                 print( "Disconnecting MQTT" ) ,                         #       [INFO] ...
-                self.loop = False                                       #       Set loop flag to FALSE
-                sleep( 0.10 )                                           #       Allow time for state of flag to change
-                self.client.disconnect()                                #       Disconnect MQTT client
+                self.client.publish( self.MQTT_topics[ "info" ],        #       Deregister node
+                                     '', qos=1, retain=True )           #       ...
+                self.client.disconnect()                                #       Disconnect MQTT client (ends loop_forever())
                 print( "...DONE!" )                                     #       [INFO] ...
                 
             else                    : pass
+
+        elif( msg.topic == self.MQTT_topics[ "acks" ] ):                # If the client has a frame
+            self.buffer.ack( msg.payload.decode("utf-8") )              #   Evict it
         
         else: pass
 
@@ -148,33 +263,65 @@ class FTP_photogrammetery_Server( object ):
 
     def client_loop( self ):
         '''
-        A simple, basic workaround for the MQTT's library stupid 
-        threaded implementation of loop() that doesn't really work.
+        MQTT network loop. Blocks in select() until there is traffic
+        and returns as soon as disconnect() is called, so neither
+        messages nor shutdown wait on a polling timeout.
         '''
         
-        self.loop = True                                                # Boolean loop flag
-        while( self.loop ):                                             # Loop 43va while loop flag is TRUE
-            self.client.loop( timeout=1.0 )                             #   Pool messages queue for new data
+        self.client.loop_forever( retry_first_connection=False )        # Process messages until we disconnect
+
+        if( self.t_eot is not None ):                                   # [INFO] Time from our EOT until we are down
+            t_down = monotonic() - self.t_eot                           # ...
+            self.tracer.observe( "shutdown", t_down )                   # ...
+            print( "Shutdown took {:.3f}s".format(t_down) )             # ...
 
 # ------------------------------------------------------------------------
 
     def get_IP( self ):
         '''
         Obtain IP address to be used for accessing the FTP server
+
+        OUTPUT:
+            - ip: Address advertised to the client
         '''
 
-        ip = getoutput( "hostname -I" )                                 # Run 'hostname -I'
-        ip = ip.split( ' ' )                                            # Split on a space basis
+        ip = self.ip                                                    # Use the given address if there is one
+        if( ip is None ):                                               # Otherwise look it up
+            ip = getoutput( "hostname -I" )                             #   Run 'hostname -I'
+            ip = ip.split( ' ' )                                        #   Split on a space basis
 
-        for i in range( 0, len(ip) ):                                   # Make sure we are using a valid
-            if( ip[i][0]=='1' and ip[i][1]=='9' and ip[i][2]=='2' ):    # IP address ...
-                ip = ip[i]                                              # ...
-                break                                                   # ...
+            for i in range( 0, len(ip) ):                               #   Make sure we are using a valid
+                if( ip[i][0]=='1' and ip[i][1]=='9' and ip[i][2]=='2' ):#   IP address ...
+                    ip = ip[i]                                          #   ...
+                    break                                               #   ...
            
         print( "Using IP: {}\n".format(ip) )                            # [INFO] ...
+        return( ip )
+
+# ------------------------------------------------------------------------
+
+    def register( self ):
+        '''
+        Publish this node's address and capabilities so the client
+        can start pulling from it
+        '''
 
-        self.client.publish( self.MQTT_topics[ "IP_addr" ],             # Transmit FTP IP address
-                             ip, qos=1, retain=True )                   # over MQTT
+        capabilities = { "camera"   : type(self.camera).__name__,       # What this node can do
+                         "images"   : self.imgs_quantity,               # ...
+                         "interval" : self.imgs_interval,               # ...
+                         "burst"    : self.burst,                       # ...
+                         "turntable": self.turntable is not None,       # ...
+                         "batch"    : self.batch,                       # ...
+                         "preview"  : self.preview.describe() if self.preview else None,
+                         "quality"  : self.quality.describe() if self.quality else None,
+                         "buffer"   : self.buffer.describe() }          # ...
+
+        info = scan_nodes.encode_info( self.node, self.address,         # Transmit node's registration
+                                       self.FTP_port, self.stream_port, # ...
+                                       capabilities, self.scan_id,      # ...
+                                       self.token )                     # ...
+        self.client.publish( self.MQTT_topics[ "info" ],                # ...over MQTT, retained so
+                             info, qos=1, retain=True )                 # ...late clients see it too
 
 # ------------------------------------------------------------------------
 
@@ -187,20 +334,306 @@ class FTP_photogrammetery_Server( object ):
             - img_num: Image number
         '''
 
+        self.throttle()                                                 # Wait if the client is behind
         img_name = "image{}.jpg".format( img_num )                      # Construct image name
-##        img_path = "/home/pi/FTP/{}".format( img_name )                 # Define image's path ( FTP folder on Raspbian )
-        img_path = "/mnt/dietpi_userdata/Pictures/{}".format( img_name )# Define image's path ( FTP folder on DietPi )
+        output = BytesIO()                                              # Capture into RAM first
         
         print( "Sending {}".format(img_name) ) ,                        # [INFO] ...
         
-        with PiCamera() as cam:                                         # Capture image
-            cam.capture( img_path )                                     # ...
-
-        self.client.publish( self.MQTT_topics[ "images" ],              # Publish image's name to MQTT for retrieval
-                             img_name, qos=1 )                          # ...
+        trace = self.tracer.begin( name=img_name )                      # Start timing the frame
+        timestamp = time()                                              # Capture time
+        self.camera.capture( output )                                   # Capture image on the already-open camera
+        self.tracer.mark( trace, "capture" )                            # ...
+        self.output_frame( img_name, output, timestamp, None, trace )   # Store and publish image for retrieval
             
         print( "...DONE!" )                                             # [INFO] ...
 
+# ------------------------------------------------------------------------
+
+    def output_frame( self, img_name, output, timestamp, angle=None, trace=None ):
+        '''
+        Hand a captured image to the quality gate, or straight to
+        finish_output() if there is none. Takes the same arguments
+        as finish_output().
+        '''
+
+        frame = ( img_name, output, timestamp, angle, trace )
+        if( self.quality is None ): self.finish_output( *frame )        # Nothing to check
+        else: self.quality.submit( img_name, output.getvalue(), frame ) # Checked on the gate's workers
+
+# ------------------------------------------------------------------------
+
+    def frame_passed( self, frame ):
+        '''
+        Quality gate callback for a frame that passed
+        '''
+
+        self.tracer.mark( frame[4], "quality" )                         # Wait for & time spent in the gate
+        with self.output_lock:                                          # Store and publish image for retrieval
+            self.finish_output( *frame )                                # ...
+
+# ------------------------------------------------------------------------
+
+    def frame_rejected( self, frame, reason, detail ):
+        '''
+        Quality gate callback for a frame that failed: drop it,
+        report why and remember it for recapture
+        '''
+
+        img_name, _, _, angle, trace = frame
+        self.tracer.mark( trace, "quality" )                            # ...
+        self.tracer.finish( trace, "rejected" )                         # ...
+        print( "Rejected {}: {} ({})".format(img_name, reason, detail) )# [INFO] ...
+        self.client.publish( self.MQTT_topics[ "general" ],             # Let operators know why
+                             json.dumps( {"rejected": img_name, "reason": reason,
+                                          "detail": detail} ), qos=1 )  # ...
+        with self.output_lock:                                          # ...
+            self.rejected.append( (img_name, angle, reason) )           # ...
+
+# ------------------------------------------------------------------------
+
+    def recapture( self ):
+        '''
+        Retake frames the quality gate rejected for blur or
+        exposure, returning the turntable to their angles. Runs
+        after the main capture loop with the camera still open.
+        '''
+
+        if( self.quality is None ): return
+
+        for attempt in range( self.recapture_rounds ):                  # Retake up to RECAPTURE times
+            self.quality.join()                                         #   Wait for verdicts on the last round
+            with self.output_lock:                                      #   ...
+                retake = [ r for r in self.rejected if r[2] != frame_quality.DUPLICATE ]
+                self.rejected = []                                      #   ...
+            if( len(retake) == 0 ): break                               #   ...
+
+            print( "Recapturing {} frame(s)".format(len(retake)) )      #   [INFO] ...
+            for img_name, angle, reason in retake:                      #   ...
+                self.throttle()                                         #   ...
+                trace = self.tracer.begin( name=img_name )              #   ...
+                if( self.turntable is not None and angle is not None ): #   Back to where it was taken
+                    self.turntable.move_to( angle )                     #   ...
+                    self.turntable.wait_settled()                       #   ...
+                    self.tracer.mark( trace, "settle" )                 #   ...
+                output, timestamp = BytesIO(), time()                   #   Capture into RAM
+                self.camera.capture( output )                           #   ...
+                self.tracer.mark( trace, "capture" )                    #   ...
+                self.output_frame( img_name, output, timestamp,         #   Check it again
+                                   angle, trace )                       #   ...
+
+        if( self.turntable is not None ):                               # Return to the origin
+            self.turntable.move_to( 0 )                                 # ...
+        self.quality.join()                                             # Every frame is handed on
+        self.quality.close()                                            # ...
+
+# ------------------------------------------------------------------------
+
+    def finish_output( self, img_name, output, timestamp, angle=None, trace=None ):
+        '''
+        Make a captured image available to the client and announce it
+
+        INPUTS:
+            - img_name : Name of image
+            - output   : RAM buffer the image was captured into
+            - timestamp: Capture time of image
+            - angle    : Turntable angle the image was taken at
+            - trace    : Trace ID of the image
+        '''
+
+        data = output.getvalue()                                        # Captured JPEG
+        if( self.preview is not None ):                                 # Send a preview ahead of the frame
+            self.publish_preview( img_name, data, timestamp, angle )    # ...
+            self.tracer.mark( trace, "preview" )                        # ...
+
+        self.store_frame( img_name, data )                              # Make frame available
+        self.tracer.mark( trace, "store" )                              # ...
+
+        entry = scan_manifest.frame_entry( img_name, data, timestamp,   # Describe frame
+                                           angle, trace )               # ...
+        self.tracer.mark( trace, "checksum" )                           # ...
+        if( len(self.manifest) == 0 ):                                  # [INFO] Time from start-up to first frame
+            self.t_first = monotonic() - self.t_start                   # ...
+            self.tracer.observe( "first_capture", self.t_first )        # ...
+        self.manifest.append( entry )                                   # ...
+        self.entries[ img_name ] = entry                                # ...
+        self.pending.append( entry )                                    # ...
+        if( len(self.pending) >= self.batch ): self.publish_images()    # Announce once a batch is ready
+
+# ------------------------------------------------------------------------
+
+    def store_frame( self, name, data ):
+        '''
+        Serve a frame from RAM in streaming mode, otherwise write it
+        to the FTP folder
+        '''
+
+        if( self.store is not None ):                                   # In streaming mode serve frame from RAM
+            self.store.put( name, data )                                # ...
+        else:                                                           # Otherwise write it to the FTP folder
+            with open( "{}/{}".format(self.img_dir, name), 'wb' ) as f: # ...
+                f.write( data )                                         # ...
+        self.buffer.add( name, len(data) )                              # Held until the client acks it
+
+# ------------------------------------------------------------------------
+
+    def evict_frame( self, name ):
+        '''
+        Free a frame the client has acked
+        '''
+
+        if( self.store is not None ):                                   # Drop it from RAM
+            self.store.discard( name )                                  # ...
+        elif( not self.persist ):                                       # ...or from the FTP folder
+            try   : os.remove( "{}/{}".format(self.img_dir, name) )     # ...
+            except OSError: pass                                        # ...
+
+# ------------------------------------------------------------------------
+
+    def throttle( self ):
+        '''
+        Pause capture while the client is too far behind. Frames
+        still waiting for their batch to fill are announced first,
+        or the client could never ack its way out of the pause.
+        '''
+
+        if( self.buffer.full() ):                                       # About to pause, so let the client
+            with self.output_lock:                                      # ...see every frame we hold
+                self.publish_images()                                   # ...
+        waited, drained = self.buffer.wait_for_room( self.buffer_timeout )
+
+        if( not drained ):                                              # No acks in time: announcements or acks
+            unacked = self.buffer.unacked()                             # ...may have been lost, or the client
+            print( "No acks for {:.0f}s, announcing {} unacked frame(s) again".format(
+                   waited, len(unacked)) )                              # ...gave up on them, so try again
+            self.reannounce( unacked )                                  # ...
+            more, drained = self.buffer.wait_for_room( self.buffer_timeout )
+            waited += more                                              # ...
+
+        if( not drained ):                                              # Client is gone or stuck; don't hang
+            print( "Client still not acking, resuming capture with {:.1f} MB unacked".format(
+                   self.buffer.report()["bytes"] / 1e6) )               # ...the node, carry on unbounded
+            self.buffer.release()                                       # ...until it acks again
+
+        if( waited > 0 ):                                               # [INFO] ...
+            self.tracer.observe( "backpressure", waited )               # ...
+            print( "Client behind, paused capture for {:.2f}s".format(waited) )
+
+# ------------------------------------------------------------------------
+
+    def reannounce( self, names ):
+        '''
+        Announce frames (and previews) the client has not acked again
+        '''
+
+        entries = [ self.entries[n] for n in names if n in self.entries ]
+        for i in range( 0, len(entries), self.batch ):                  # Same batching as the first time
+            self.client.publish( self.MQTT_topics[ "images" ],          # ...
+                                 scan_manifest.encode_batch(entries[i:i+self.batch]),
+                                 qos=1 )                                # ...
+
+# ------------------------------------------------------------------------
+
+    def publish_preview( self, img_name, data, timestamp, angle=None ):
+        '''
+        Make a preview of a captured image, store it and announce
+        it right away instead of with the next batch
+
+        INPUTS:
+            - img_name : Name of the full image
+            - data     : JPEG bytes of the full image
+            - timestamp: Capture time of image
+            - angle    : Turntable angle the image was taken at
+        '''
+
+        preview = self.camera.preview( data, self.preview )             # Downscale & crop
+        if( preview is None ):                                          # Backend can't (e.g. no Pillow),
+            print( "Previews unavailable, sending full frames only" )   # ...carry on without previews
+            self.preview = None                                         # ...
+            return
+
+        name = preview_tier.preview_name( img_name )                    # Store it next to the full frames
+        self.store_frame( name, preview )                               # ...
+        entry = scan_manifest.frame_entry( name, preview, timestamp,    # Announce it on its own
+                                           angle, preview_of=img_name ) # ...
+        self.entries[ name ] = entry                                    # ...
+        self.client.publish( self.MQTT_topics[ "images" ],              # ...
+                             scan_manifest.encode_batch([entry]),       # ...
+                             qos=1 )                                    # ...
+
+# ------------------------------------------------------------------------
+
+    def publish_images( self ):
+        '''
+        Publish the pending frames' descriptions to MQTT for the
+        client to retrieve
+        '''
+
+        if( len(self.pending) == 0 ): return                            # Nothing to announce
+
+        self.client.publish( self.MQTT_topics[ "images" ],              # Publish batch to MQTT for retrieval
+                             scan_manifest.encode_batch(self.pending),  # ...
+                             qos=1 )                                    # ...
+        for entry in self.pending:                                      # Frames are out of this node's hands
+            self.tracer.mark( entry.get("trace"), "announce" )          # ...
+            self.tracer.finish( entry.get("trace") )                    # ...
+        self.pending = []                                               # ...
+
+# ------------------------------------------------------------------------
+
+    def turntable_scan( self ):
+        '''
+        Capture a frame at each of IMG_NUM evenly spaced turntable
+        angles. The next move starts as soon as the shutter closes,
+        so motion overlaps storing and announcing the previous frame.
+        '''
+
+        step = 360.0 / self.imgs_quantity                               # Angle between frames
+        self.turntable.move_to( 0 )                                     # Start at the origin
+        for i in range( self.imgs_quantity ):                           # Visit every position
+            self.throttle()                                             #   Wait if the client is behind
+            img_name = "image{}.jpg".format( i )                        #   Construct image name
+            trace = self.tracer.begin( name=img_name )                  #   Start timing the frame
+            self.turntable.wait_settled()                               #   Wait for the table to stop
+            angle = self.turntable.angle                                #   ...
+            self.tracer.mark( trace, "settle" )                         #   ...
+
+            print( "Sending {} at {:.1f} deg".format(img_name, angle) ) #   [INFO] ...
+            output, timestamp = BytesIO(), time()                       #   Capture into RAM
+            self.camera.capture( output )                               #   ...
+            self.tracer.mark( trace, "capture" )                        #   ...
+
+            if( i+1 < self.imgs_quantity ):                             #   Shutter closed, start the next move
+                self.turntable.move_to( (i+1)*step )                    #   ...
+            self.output_frame( img_name, output, timestamp,             #   ...while this frame is published
+                                angle, trace )                          #   ...
+
+        self.turntable.move_to( 0 )                                     # Return to the origin
+
+# ------------------------------------------------------------------------
+
+    def burst_outputs( self ):
+        '''
+        Generator feeding RAM buffers to the camera's continuous
+        capture. Each frame is published as soon as the camera asks
+        for the next buffer, i.e. once the previous frame is written.
+        '''
+
+        prev = None                                                     # Name, buffer, time, angle & trace of the
+        for i in range( self.imgs_quantity ):                           # ...last frame handed out
+            if( prev is not None ):                                     # Hand out as many buffers as we want images
+                self.tracer.mark( prev[4], "capture" )                  #   Previous frame is done,
+                self.output_frame( *prev )                              #   ...announce it
+            self.throttle()                                             #   Wait if the client is behind
+            img_name = "image{}.jpg".format( i )                        #   Construct image name
+            trace = self.tracer.begin( name=img_name )                  #   ...
+            prev = ( img_name, BytesIO(), time(), None, trace )         #   ...
+            print( "Sending {}".format(img_name) )                      #   [INFO] ...
+            yield( prev[1] )                                            #   ...
+        if( prev is not None ):                                         # Announce the final frame
+            self.tracer.mark( prev[4], "capture" )                      # ...
+            self.output_frame( *prev )                                  # ...
+
 # ------------------------------------------------------------------------
 
     def run( self ):
@@ -208,31 +641,64 @@ class FTP_photogrammetery_Server( object ):
         Main thread
         '''
         
-        sleep( 0.5 )                                                    # Sleep for stability
         print( "FTP Server Initialized" )                               # [INFO] ...
 
         print( "Waiting for client to be ready" )                       # [INFO] ...
         cntr = 0                                                        # Counter for displaying "waiting" dots
-        while( self.ready == False ):                                   # Wait until we are ready
-            sleep( 1 )                                                  #   ...
-            print( '.' ) ,                                              #   ...
+        while( not self.soh.wait(1.0) ):                                # Wait until we are ready, waking the
+            print( '.' ) ,                                              #   ...moment the SOH arrives
             cntr += 1                                                   #   ...
             if( cntr == 15 ):                                           #   If we already printed 15 dots
                 cntr = 0                                                #       Reset counter
                 print( '' )                                             #       Start a new line
         print( '' )                                                     # Start a new line
+
+        if( self.store is not None ):                                   # Serve frames from RAM
+            self.stream_server = FrameStreamServer( self.store,         # ...on the advertised address,
+                                                    self.stream_port,   # ...to clients that hold this
+                                                    self.address,       # ...scan's token
+                                                    self.token )        # ...
+            self.stream_server.start()                                  # ...
         
-        for i in range( self.imgs_quantity ):                           # Take as many images as we specified
-            self.take_image( i )                                        #   ...
-            
-            timer = time()                                              #   Timer to waste time in order to capture at required interval
-            while( time() - timer < self.imgs_interval ): pass          #   ...
+        t_open = monotonic()                                            # Time camera start-up
+        with self.camera:                                               # Open camera once for the whole scan
+            self.tracer.observe( "camera_open", monotonic() - t_open )  #   ...
+            if( self.turntable is not None ):                           #   Capture at turntable positions
+                self.turntable_scan()                                   #   ...
+
+            elif( self.burst ):                                         #   Continuous capture
+                self.camera.capture_sequence( self.burst_outputs() )    #   ...
+
+            else:
+                for i in self.scheduler.frames( self.imgs_quantity ):   #   Take as many images as we specified,
+                    self.take_image( i )                                #   ...sleeping until each one is due
+
+                stats = self.scheduler.report()                         #   [INFO] Timing of the capture loop
+                print( "\nCaptured {} frames in {:.3f}s".format(stats["frames"], stats["elapsed"]) )
+                print( "Mean period {:.4f}s, mean/max jitter {:.4f}s/{:.4f}s, {} overrun(s)".format(
+                       stats["period_mean"], stats["jitter_mean"], stats["jitter_max"], stats["overruns"]) )
+
+            self.recapture()                                            #   Retake frames the gate rejected
+
+        self.publish_images()                                           # Announce any partial batch
+        stats = self.buffer.report()                                    # [INFO] ...
+        print( "Frame buffer peak {:.1f} MB, {} pause(s) for {:.2f}s, {} timed out".format(
+               stats["peak"]/1e6, stats["pauses"], stats["paused"],     # ...
+               stats["stalls"]) )                                       # ...
             
         print( "\nClearing retained messages prior to exit" ) ,         # [INFO] ...
-        for _, topic in self.MQTT_topics.iteritems():                   # Clear ALL retianed messages in all the sub-topics within
-            self.client.publish( topic, '', qos=1, retain=True )        # the FTP main topic by sending an empty string
+        for key, topic in self.MQTT_topics.items():                     # Clear ALL retianed messages in all the sub-topics within
+            if( key == "info" ): continue                               # the node's namespace by sending an empty string
+            self.client.publish( topic, '', qos=1, retain=True )        # (registration stays until the client's EOT)
         print( "...DONE!" )                                             # [INFO] ...
 
+        self.client.publish( self.MQTT_topics[ "images" ],              # Send the final manifest so the client can
+                             scan_manifest.encode_manifest(self.manifest),  # ...check it has every frame intact
+                             qos=1 )                                    # ...
+
+        if( self.t_first is not None ):                                 # [INFO] ...
+            print( "First capture {:.3f}s after start-up".format(self.t_first) )
+        self.t_eot = monotonic()                                        # Shutdown is timed from here
         self.client.publish( self.MQTT_topics[ "status" ],              # Send an EOT to inform client that he can proceed
                              "EOT", qos=1 )                             # into the image processing & 3D reconstruction
         
@@ -240,6 +706,31 @@ class FTP_photogrammetery_Server( object ):
 # ===========================> SETUP  PROGRAM <===========================
 # ************************************************************************      
 
-MQTT_IP_ADDRESS     = "192.168.42.1"                                    # IP address for MQTT broker
-NUMBER, FREQUENCY   = 5, 1                                              # Number & frequency of images           
-prog = FTP_photogrammetery_Server( MQTT_IP_ADDRESS, NUMBER, FREQUENCY ) # Start program
+if __name__ == "__main__":
+    MQTT_IP_ADDRESS     = "192.168.42.1"                                # IP address for MQTT broker
+    NUMBER, FREQUENCY   = 5, 1                                          # Number & frequency of images           
+    BURST               = False                                         # Capture continuously instead of at FREQUENCY
+    STREAM_PORT         = None                                          # Port for RAM streaming (None == FTP folder)
+    PERSIST             = False                                         # Also save streamed frames to the FTP folder
+    BATCH               = 1                                             # Frames announced per MQTT message
+    IMG_DIR             = "/mnt/dietpi_userdata/Pictures"               # FTP folder on DietPi
+##    IMG_DIR             = "/home/pi/FTP"                                # FTP folder on Raspbian
+    CAMERA              = PiCameraBackend( resolution=(2592, 1944) )    # Camera kept open for the whole scan
+    USE_TURNTABLE       = False                                         # Scan on the stepper turntable of the motor HAT
+    TURNTABLE           = None                                          # ...
+    if( USE_TURNTABLE ):                                                # ...
+        TURNTABLE = MotionController( HATStepperBackend() )             # ...
+    NODE                = None                                          # Node name in a multi-camera rig (None == hostname)
+    TRACE_LOG           = None                                          # Per-frame stage timings, e.g. "/mnt/dietpi_userdata/trace.jsonl"
+    METRICS_PORT        = 9108                                          # Stage histograms on http://<pi>:9108/metrics (None == off)
+    PREVIEW             = None                                          # e.g. preview_tier.PreviewSpec( (320, 240), quality=50 )
+    QUALITY             = None                                          # e.g. frame_quality.QualityGate( min_sharpness=100 )
+    BUFFER_HIGH         = 64*2**20                                      # Pause capture with 64 MB of frames not yet acked
+    prog = FTP_photogrammetery_Server( MQTT_IP_ADDRESS, NUMBER,         # Start program
+                                       FREQUENCY, CAMERA, BURST,        # ...
+                                       STREAM_PORT, PERSIST, BATCH,     # ...
+                                       IMG_DIR, TURNTABLE=TURNTABLE,    # ...
+                                       NODE=NODE, TRACE_LOG=TRACE_LOG,  # ...
+                                       METRICS_PORT=METRICS_PORT,       # ...
+                                       PREVIEW=PREVIEW, QUALITY=QUALITY,
+                                       BUFFER_HIGH=BUFFER_HIGH )        # ...
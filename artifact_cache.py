@@ -0,0 +1,62 @@
+'''
+*
+* Reconstruction artifact cache used by the client.
+*
+* Per-image features and per-pair matches are stored under a key
+* made from the content of the image(s) they were computed from
+* and the parameters of the tool that computed them. Re-running a
+* reconstruction over mostly the same frames (a few frames added,
+* dense settings tweaked, ...) then only recomputes the artifacts
+* of new images and new pairs. Storage, size budget and LRU
+* eviction are those of the image cache.
+*
+* Unlike images, artifacts are handed out as private copies: tools
+* update their outputs in place, and a hard link would carry such
+* an update into the cache entry of the content it was made from.
+*
+'''
+
+# Import modules
+from    image_cache                 import  ImageCache, copy_over       # Size-bounded LRU store
+import  hashlib                                                         # Artifact keys
+import  json                                                            # ...
+import  os                                                              # Paths
+
+# ************************************************************************
+# =========================> DEFINE  FUNCTIONS <==========================
+# ************************************************************************
+def artifact_key( kind, params, digests ):
+    '''
+    Key of an artifact
+
+    INPUTS:
+        - kind   : What the artifact is (e.g. ".sift", "pair")
+        - params : JSON-serialisable description of the tool and its
+                   parameters (e.g. the command template)
+        - digests: SHA-1 checksums of the image(s) it was computed from,
+                   in the order the tool was given them
+
+    OUTPUT:
+        - key: Hex digest
+    '''
+
+    blob = json.dumps( [kind, params, list(digests)], sort_keys=True )
+    return( hashlib.sha1( blob.encode("utf-8") ).hexdigest() )
+
+# ************************************************************************
+# ============================> DEFINE CLASS <============================
+# ************************************************************************
+class ArtifactCache( ImageCache ):
+    '''
+    Size-bounded store of reconstruction artifacts, keyed by
+    artifact_key(), with LRU eviction
+    '''
+
+    place = staticmethod( copy_over )                                   # Private copies, never links
+
+    def path( self, key ):
+        '''
+        Location of an artifact in the cache
+        '''
+
+        return( os.path.join(self.root, key[:2], key) )
@@ -0,0 +1,395 @@
+'''
+*
+* End-to-end scan benchmark.
+*
+* Runs FTP_photogrammetery_Server and FTP_photogrammetery_Client
+* against a local MQTT broker, a local FTP server and a fake
+* camera, either in-process (threads) or as local subprocesses,
+* and reports scan wall time, capture-to-landed latency per image
+* (p50/p99), throughput and CPU use. Results are saved as JSON so
+* runs can be compared for regressions:
+*
+*   python bench_scan.py --images 100 --size 2000000 --interval 0
+*   python bench_scan.py --images 100 --compare results/scan-<...>.json
+*
+* --recon runs stub_recon.py as the reconstruction command once the
+* scan has landed, and --cluster partitions it:
+*
+*   python bench_scan.py --images 120 --recon 0.002 --cluster 30 --overlap 6
+*
+'''
+
+# Import modules
+from    threading                   import  Thread                      # Run server & client side by side
+from    subprocess                  import  Popen                       # Subprocess mode
+from    time                        import  time, strftime              # Timing & result names
+import  argparse                                                        # Command line parameters
+import  json                                                            # Save/load results
+import  os                                                              # Paths
+import  shutil                                                          # Clean up scratch directories
+import  socket                                                          # Find free ports
+import  sys                                                             # Interpreter path & import path
+import  tempfile                                                        # Scratch directories
+
+HERE = os.path.dirname( os.path.abspath(__file__) )                     # Benchmarks directory
+sys.path.insert( 0, os.path.dirname(HERE) )                             # Make the programs importable
+
+from    local_mqtt_broker           import  LocalMQTTBroker             # MQTT stand-in
+from    local_ftp_server            import  LocalFTPServer              # FTP stand-in
+from    stub_recon                  import  truth_center                # Reconstruction stand-in
+from    recon_partition             import  read_nvm, align, MODEL_FILE # Check merged models
+
+# ************************************************************************
+# =========================> DEFINE  FUNCTIONS <==========================
+# ************************************************************************
+def cpu_seconds():
+    '''
+    User + system CPU time used by this process so far
+    '''
+
+    t = os.times()
+    return( t[0] + t[1] )
+
+# ------------------------------------------------------------------------
+
+def stage_means( tracer ):
+    '''
+    Mean time spent in each stage traced by a program
+    '''
+
+    with tracer.lock:
+        return( dict( (stage, h.sum/h.count) for stage, h in tracer.hists.items() if h.count ) )
+
+# ------------------------------------------------------------------------
+
+def free_port():
+    '''
+    Pick a free TCP port on the loopback interface
+    '''
+
+    s = socket.socket()
+    s.bind( ("127.0.0.1", 0) )
+    port = s.getsockname()[1]
+    s.close()
+    return( port )
+
+# ------------------------------------------------------------------------
+
+def percentile( values, q ):
+    '''
+    Nearest-rank percentile of a list of values
+    '''
+
+    if( len(values) == 0 ): return( None )
+    values = sorted( values )
+    k = max( 0, min(len(values)-1, int(round(q/100.0*len(values))) - 1) )
+    return( values[k] )
+
+# ------------------------------------------------------------------------
+
+def check_model( path ):
+    '''
+    Compare a stub reconstruction's model with the true camera
+    centres
+
+    OUTPUT:
+        - check: Number of cameras in the model and the RMS distance
+                 between them and the truth, once aligned (None == no model)
+    '''
+
+    if( not os.path.isfile(path) ): return( {"cameras": 0, "rms": None} )
+    cameras, points = read_nvm( path )
+    if( len(cameras) < 3 ): return( {"cameras": len(cameras), "rms": None} )
+    s, q, t, rms = align( [ c[3] for c in cameras ], [ truth_center(c[0]) for c in cameras ] )
+    return( {"cameras": len(cameras), "rms": rms} )
+
+# ------------------------------------------------------------------------
+
+class Quiet( object ):
+    '''
+    Silence the programs' console output while benchmarking
+    '''
+
+    def __enter__( self ):
+        self.stdout, sys.stdout = sys.stdout, open( os.devnull, 'w' )
+
+    def __exit__( self, *args ):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+# ------------------------------------------------------------------------
+
+def run_server( args, ports, scratch, index=0 ):
+    '''
+    Capture a scan with a fake camera as one camera node
+
+    OUTPUT:
+        - result: Node name, final manifest and CPU time of the server
+    '''
+
+    from    FTP_photogrammetry_Server   import  FTP_photogrammetery_Server
+    from    camera_backend              import  FakeCameraBackend
+    from    motor_control               import  MotionController, SimulatedStepperBackend
+    from    preview_tier                import  PreviewSpec
+
+    cam = FakeCameraBackend( img_size=args.size )                       # Synthetic JPEGs
+    table = None                                                        # Optional simulated turntable
+    if( args.turntable is not None ):                                   # ...
+        table = MotionController( SimulatedStepperBackend(time_scale=args.turntable) )
+    preview = None                                                      # Optional preview tier
+    if( args.preview is not None ):                                     # ...
+        preview = PreviewSpec( [int(v) for v in args.preview.split('x')] )
+    node = ports["nodes"][ index ]                                      # This node's name & ports
+    srv = FTP_photogrammetery_Server( "127.0.0.1", args.images, args.interval, cam,
+                                      args.burst, node["stream"], False, args.batch,
+                                      IMG_DIR=os.path.join(scratch, node["name"], "Pictures"),
+                                      MQTT_PORT=ports["mqtt"], IP="127.0.0.1", TURNTABLE=table,
+                                      NODE=node["name"], FTP_PORT=node["ftp"], PREVIEW=preview,
+                                      BUFFER_HIGH=int(args.buffer*1e6) if args.buffer else None )
+    srv.t_client_loop.join( args.timeout )                              # Keep serving until client's EOT
+    return( {"node": srv.node, "manifest": srv.manifest, "stages": stage_means(srv.tracer),
+             "buffer": srv.buffer.report(), "cpu": cpu_seconds()} )
+
+# ------------------------------------------------------------------------
+
+def run_client( args, ports, scratch ):
+    '''
+    Pull a scan into a scratch directory
+
+    OUTPUT:
+        - result: Landing time of every image and CPU time of the client
+    '''
+
+    from    FTP_photogrammetry_Client   import  FTP_photogrammetery_Client
+
+    cache = os.path.join( scratch, "cache" ) if args.cache else None    # Optional image cache
+    recon = None                                                        # Optional stub reconstruction
+    if( args.recon is not None ):                                       # ...
+        recon = [ sys.executable, os.path.join(HERE, "stub_recon.py"),  # ...
+                  "{scan}", "{model}", "--pair-cost", str(args.recon) ] # ...
+    cli = FTP_photogrammetery_Client( "127.0.0.1", "bench", "bench", args.workers,
+                                      args.mode == "stream", None, 2, cache, 2**30,
+                                      IMG_DIR=os.path.join(scratch, "imgs"),
+                                      FTP_DIR="./Pictures/", MQTT_PORT=ports["mqtt"],
+                                      RECON_CMD=recon, NODES=args.nodes,
+                                      CLUSTER_SIZE=args.cluster, OVERLAP=args.overlap,
+                                      CLUSTER_BY=args.cluster_by )
+    result = { "landed_at": cli.landed_at, "stages": stage_means(cli.tracer), "cpu": cpu_seconds() }
+    if( recon is not None ):                                            # How good is the (merged) model
+        result[ "model" ] = check_model( os.path.join(scratch, "imgs", MODEL_FILE) )
+    return( result )
+
+# ------------------------------------------------------------------------
+
+def run_role( args ):
+    '''
+    Entry point of a server/client subprocess
+    '''
+
+    ports = json.loads( args.ports )
+    with Quiet():
+        if( args.role == "server" ): result = run_server( args, ports, args.scratch, args.node )
+        else                      : result = run_client( args, ports, args.scratch )
+    with open( args.out, 'w' ) as f:
+        json.dump( result, f )
+
+# ------------------------------------------------------------------------
+
+def run_scan( args ):
+    '''
+    Run one scan end to end and measure it
+
+    OUTPUT:
+        - metrics: Dictionary of measurements
+    '''
+
+    scratch = tempfile.mkdtemp( prefix="rls-bench-" )                   # Fresh directories for this run
+    os.makedirs( os.path.join(scratch, "imgs") )                        # ...
+    names = [ "cam{}".format(i) for i in range(args.nodes) ]            # One camera node each
+    for name in names:                                                  # ...
+        os.makedirs( os.path.join(scratch, name, "Pictures") )          # ...
+
+    broker = LocalMQTTBroker(); broker.start()                          # Stand-ins, one FTP server per node
+    ftpds = [ LocalFTPServer( os.path.join(scratch, name) ) for name in names ]
+    for ftpd in ftpds: ftpd.start()                                     # ...
+    ports = { "mqtt" : broker.port,                                     # ...
+              "nodes": [ { "name"  : name, "ftp": ftpd.port,            # ...
+                           "stream": free_port() if args.mode == "stream" else None }
+                         for name, ftpd in zip(names, ftpds) ] }
+
+    results = {}                                                        # Role -> result
+    cpu0, t0 = cpu_seconds(), time()                                    # Start measuring
+    roles = [ ("server{}".format(i), "server", i) for i in range(args.nodes) ] + [ ("client", "client", 0) ]
+
+    if( args.subprocess ):                                              # Servers & client as local processes
+        procs = {}
+        for key, role, index in roles:
+            out = os.path.join( scratch, key + ".json" )
+            cmd = [ sys.executable, os.path.abspath(__file__), "--role", role, "--node", str(index),
+                    "--ports", json.dumps(ports), "--scratch", scratch, "--out", out ]
+            cmd += [ a for a in sys.argv[1:] if a != "--subprocess" ]
+            procs[ key ] = ( Popen(cmd), out )
+        for key, (p, out) in procs.items():
+            p.wait()
+            with open( out ) as f: results[ key ] = json.load( f )
+        wall = time() - t0
+        cpu = sum( r["cpu"] for r in results.values() )
+
+    else:                                                               # Servers & client as threads
+        def target( key, role, index ):
+            if( role == "server" ): results[ key ] = run_server( args, ports, scratch, index )
+            else                  : results[ key ] = run_client( args, ports, scratch )
+        threads = [ Thread(target=target, args=r) for r in roles ]
+        with Quiet():
+            for t in threads: t.daemon = True; t.start()
+            threads[-1].join( args.timeout )                            # Scan is done once the client returns
+            wall = time() - t0
+            for t in threads[:-1]: t.join( 5.0 )
+        cpu = cpu_seconds() - cpu0                                      # Includes broker & FTP stand-ins
+
+    broker.stop()
+    for ftpd in ftpds: ftpd.stop()
+    shutil.rmtree( scratch, ignore_errors=True )
+
+    if( len(results) != len(roles) ):                                   # Something hung or crashed
+        raise RuntimeError( "Scan did not complete within {}s".format(args.timeout) )
+
+    manifest = [ dict(e, name="{}_{}".format(r["node"], e["name"]))     # Name frames as the client stores them
+                 for key, r in results.items() if key != "client" for e in r["manifest"] ]
+    landed = results["client"]["landed_at"]
+    latency = [ landed[e["name"]] - e["t"] for e in manifest if e["name"] in landed ]
+    nbytes = sum( e["size"] for e in manifest if e["name"] in landed )
+
+    metrics = { "wall_s"          : wall,
+                "images_landed"   : sum( 1 for e in manifest if e["name"] in landed ),
+                "images_expected" : len(manifest),
+                "bytes"           : nbytes,
+                "throughput_MBps" : nbytes/wall/1e6,
+                "images_per_s"    : sum( 1 for e in manifest if e["name"] in landed )/wall,
+                "latency_p50_s"   : percentile( latency, 50 ),
+                "latency_p99_s"   : percentile( latency, 99 ),
+                "latency_max_s"   : max( latency ) if latency else None,
+                "cpu_s"           : cpu,
+                "cpu_util"        : cpu/wall }
+
+    buffers = [ r["buffer"] for key, r in results.items() if key != "client" ]
+    metrics[ "buffer_peak_MB" ] = max( b["peak"] for b in buffers )/1e6 # Frame buffers on the nodes
+    metrics[ "buffer_pauses" ] = sum( b["pauses"] for b in buffers )    # ...
+    metrics[ "buffer_held" ] = sum( b["held"] for b in buffers )        # ...unacked at the end
+
+    if( args.recon is not None ):                                       # Reconstructed model
+        metrics[ "model_cameras" ] = results["client"]["model"]["cameras"]
+        metrics[ "model_rms" ] = results["client"]["model"]["rms"]      # ...
+
+    stages = {}                                                         # Mean time per traced stage,
+    for key, r in results.items():                                      # ...averaged over the nodes
+        side = "client" if key == "client" else "server"                # ...
+        for stage, seconds in r["stages"].items():                      # ...
+            stages.setdefault( "{}_{}_s".format(side, stage), [] ).append( seconds )
+    for key, values in stages.items():                                  # ...
+        metrics[ key ] = sum( values ) / len( values )                  # ...
+    return( metrics )
+
+# ------------------------------------------------------------------------
+
+def summarize( runs ):
+    '''
+    Median of every metric across repeated runs
+    '''
+
+    summary = {}
+    for key in runs[0]:
+        values = [ r[key] for r in runs if r[key] is not None ]
+        summary[ key ] = percentile( values, 50 )
+    return( summary )
+
+# ------------------------------------------------------------------------
+
+def compare( current, previous ):
+    '''
+    Print current results next to a previous run
+    '''
+
+    print( "\n{:<18}{:>14}{:>14}{:>10}".format("metric", "previous", "current", "change") )
+    for key, value in sorted( current.items() ):
+        old = previous.get( key )
+        if( value is None or old is None ): continue
+        change = "{:+.1f}%".format( 100.0*(value-old)/old ) if old else ''
+        print( "{:<18}{:>14.4g}{:>14.4g}{:>10}".format(key, old, value, change) )
+
+# ------------------------------------------------------------------------
+
+def parse_args():
+    p = argparse.ArgumentParser( description="End-to-end scan benchmark" )
+    p.add_argument( "--images",     type=int,   default=50,             help="Images per scan and node" )
+    p.add_argument( "--nodes",      type=int,   default=1,              help="Number of camera nodes" )
+    p.add_argument( "--size",       type=int,   default=2*10**6,        help="Bytes per image" )
+    p.add_argument( "--interval",   type=float, default=0.0,            help="Capture interval in seconds (0 == as fast as possible)" )
+    p.add_argument( "--burst",      action="store_true",                help="Use burst capture" )
+    p.add_argument( "--turntable",  type=float, default=None,           help="Capture on a simulated turntable, moving at this fraction of real motor time" )
+    p.add_argument( "--preview",    default=None,                       help="Send WxH previews ahead of full frames, e.g. 320x240" )
+    p.add_argument( "--buffer",     type=float, default=None,           help="Pause capture with this many MB of frames not yet acked" )
+    p.add_argument( "--recon",      type=float, default=None,           help="Run the stub reconstruction, simulating this many seconds of matching per image pair" )
+    p.add_argument( "--cluster",    type=int,   default=None,           help="Reconstruct in clusters of this many frames" )
+    p.add_argument( "--overlap",    type=int,   default=8,              help="Frames shared by neighbouring clusters" )
+    p.add_argument( "--cluster-by", choices=("order", "angle", "similarity"), default="order", help="How frames are ordered into clusters" )
+    p.add_argument( "--batch",      type=int,   default=1,              help="Frames per MQTT announcement" )
+    p.add_argument( "--workers",    type=int,   default=4,              help="Client download workers per node" )
+    p.add_argument( "--mode",       choices=("ftp", "stream"), default="ftp", help="Transfer path" )
+    p.add_argument( "--cache",      action="store_true",                help="Enable the client image cache" )
+    p.add_argument( "--subprocess", action="store_true",                help="Run server & client as local subprocesses" )
+    p.add_argument( "--repeat",     type=int,   default=1,              help="Number of runs" )
+    p.add_argument( "--timeout",    type=float, default=600.0,          help="Give up on a run after this many seconds" )
+    p.add_argument( "--results",    default=os.path.join(HERE, "results"), help="Directory results are saved to" )
+    p.add_argument( "--compare",    default=None,                       help="Previous result file to compare against" )
+    p.add_argument( "--role",       choices=("server", "client"),       help=argparse.SUPPRESS )
+    p.add_argument( "--node",       type=int,   default=0,              help=argparse.SUPPRESS )
+    p.add_argument( "--ports",      help=argparse.SUPPRESS )
+    p.add_argument( "--scratch",    help=argparse.SUPPRESS )
+    p.add_argument( "--out",        help=argparse.SUPPRESS )
+    return( p.parse_args() )
+
+# ************************************************************************
+# ===========================> SETUP  PROGRAM <===========================
+# ************************************************************************
+
+if __name__ == "__main__":
+    args = parse_args()
+    if( args.role is not None ):                                        # Running as a server/client subprocess
+        run_role( args )
+        sys.exit( 0 )
+
+    runs = []
+    for i in range( args.repeat ):
+        metrics = run_scan( args )
+        runs.append( metrics )
+        print( "Run {}: {:.2f}s wall, {}/{} images, {:.1f} MB/s, p50/p99 latency {:.3f}/{:.3f}s, {:.0f}% CPU".format(
+               i+1, metrics["wall_s"], metrics["images_landed"], metrics["images_expected"],
+               metrics["throughput_MBps"], metrics["latency_p50_s"] or 0, metrics["latency_p99_s"] or 0,
+               100*metrics["cpu_util"]) )
+        print( "  Frame buffer peak {:.1f} MB, {} pause(s), {} frame(s) never acked".format(
+               metrics["buffer_peak_MB"], metrics["buffer_pauses"], metrics["buffer_held"]) )
+        if( args.recon is not None ):
+            print( "  Model of {} camera(s), {} from the true camera centres".format(
+                   metrics["model_cameras"], "n/a" if metrics["model_rms"] is None
+                   else "RMS {:.2g}".format(metrics["model_rms"])) )
+        print( "  Mean stage times: " + ", ".join( "{} {:.4f}s".format(k[:-2], v)
+               for k, v in sorted(metrics.items()) if k.startswith(("server_", "client_")) ) )
+
+    params = dict( (k, v) for k, v in vars(args).items()
+                   if k not in ("role", "node", "ports", "scratch", "out", "results", "compare") )
+    result = { "timestamp": strftime("%Y-%m-%d %H:%M:%S"), "params": params,
+               "summary": summarize(runs), "runs": runs }
+
+    if( not os.path.isdir(args.results) ): os.makedirs( args.results )
+    path = os.path.join( args.results, "scan-{}.json".format(strftime("%Y%m%d-%H%M%S")) )
+    with open( path, 'w' ) as f:
+        json.dump( result, f, indent=2 )
+    print( "Saved {}".format(path) )
+
+    if( args.compare is not None ):
+        with open( args.compare ) as f:
+            previous = json.load( f )
+        if( previous.get("params") != params ):
+            print( "Warning: parameters differ from the compared run" )
+        compare( result["summary"], previous["summary"] )
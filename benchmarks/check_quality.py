@@ -0,0 +1,113 @@
+'''
+*
+* Check of the frame quality gate on synthetic JPEGs.
+*
+* Builds a textured test scene and derives frames the gate must
+* tell apart: sharp ones, a blurred one, an underexposed and an
+* overexposed one, and a re-encoded duplicate. Every frame goes
+* through a QualityGate exactly as on a camera node, and the
+* verdicts are compared with the expected ones:
+*
+*   python check_quality.py
+*
+* Exits with 1 if any verdict is wrong (needs NumPy and Pillow).
+*
+'''
+
+# Import modules
+from    io                          import  BytesIO                     # Encode frames in RAM
+import  os                                                              # Paths
+import  sys                                                             # Import path & exit code
+
+HERE = os.path.dirname( os.path.abspath(__file__) )                     # Benchmarks directory
+sys.path.insert( 0, os.path.dirname(HERE) )                             # Make the programs importable
+
+import  frame_quality                                                   # Gate under test
+
+# ************************************************************************
+# =========================> DEFINE  FUNCTIONS <==========================
+# ************************************************************************
+def scene( seed, size=(640, 480) ):
+    '''
+    Textured test scene: random blocks of mid-grey levels, like
+    the surface detail photogrammetry needs
+    '''
+
+    np = frame_quality.np
+    rng = np.random.RandomState( seed )
+    w, h = size
+    blocks = rng.randint( 40, 216, size=(h//8, w//8) )                  # 8x8 px blocks
+    return( np.kron( blocks, np.ones((8, 8)) ).astype(np.float64) )     # ...
+
+# ------------------------------------------------------------------------
+
+def jpeg( pixels, quality=90, blur=0 ):
+    '''
+    Encode grey levels as a JPEG, optionally out of focus
+    '''
+
+    from PIL import Image, ImageFilter
+    img = Image.fromarray( frame_quality.np.clip(pixels, 0, 255).astype("uint8"), "L" )
+    if( blur > 0 ): img = img.filter( ImageFilter.GaussianBlur(blur) )
+    out = BytesIO()
+    img.convert( "RGB" ).save( out, "JPEG", quality=quality )
+    return( out.getvalue() )
+
+# ------------------------------------------------------------------------
+
+def frames():
+    '''
+    (name, JPEG, expected reason) of every test frame, in the
+    order they are captured
+    '''
+
+    a, b = scene( 1 ), scene( 2 )
+    return( [ ("sharp.jpg",     jpeg(a),              None                        ),
+              ("blurred.jpg",   jpeg(b, blur=6),      frame_quality.BLURRED       ),
+              ("dark.jpg",      jpeg(a / 8.0),        frame_quality.UNDEREXPOSED  ),
+              ("bright.jpg",    jpeg(a + 160),        frame_quality.OVEREXPOSED   ),
+              ("duplicate.jpg", jpeg(a, quality=75),  frame_quality.DUPLICATE     ),
+              ("other.jpg",     jpeg(b),              None                        ) ] )
+
+# ------------------------------------------------------------------------
+
+def check():
+    '''
+    Run the test frames through a gate
+
+    OUTPUT:
+        - ok: True if every verdict was the expected one
+    '''
+
+    verdicts = {}                                                       # Name -> (reason, detail)
+    gate = frame_quality.QualityGate( workers=1 )                       # One worker: duplicates are judged
+    gate.start( lambda job: verdicts.update({job: (None, None)}),       # ...against the frames before them
+                lambda job, reason, detail: verdicts.update({job: (reason, detail)}) )
+
+    tests = frames()
+    for name, data, expected in tests:                                  # Capture order
+        gate.submit( name, data, name )                                 # ...
+    gate.join()                                                         # ...
+    gate.close()                                                        # ...
+
+    ok = True
+    for name, data, expected in tests:
+        reason, detail = verdicts[ name ]
+        metrics = frame_quality.measure( data )
+        good = ( reason == expected )
+        ok = ok and good
+        print( "{:<14} {:<13} {:<13} sharpness {:8.1f}, mean {:5.1f}  {}".format(
+               name, str(expected), str(reason), metrics["sharpness"], metrics["mean"],
+               "ok" if good else "WRONG ({})".format(detail)) )
+    return( ok )
+
+# ************************************************************************
+# ===========================> SETUP  PROGRAM <===========================
+# ************************************************************************
+
+if __name__ == "__main__":
+    if( not frame_quality.available() ):
+        print( "Needs NumPy and Pillow" )
+        sys.exit( 1 )
+    print( "{:<14} {:<13} {:<13}".format("frame", "expected", "verdict") )
+    sys.exit( 0 if check() else 1 )
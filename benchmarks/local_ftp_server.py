@@ -0,0 +1,147 @@
+'''
+*
+* Minimal in-process, read-only FTP server for benchmarks.
+*
+* Implements the subset of RFC 959 used by ftplib's login(),
+* cwd() and retrbinary() (including REST offsets) in passive
+* mode. Any username/password is accepted.
+*
+'''
+
+# Import modules
+from    threading                   import  Thread                      # One thread per connection
+import  socket                                                          # Listen for clients
+import  os                                                              # Serve files from a directory
+
+# ************************************************************************
+# ============================> DEFINE CLASS <============================
+# ************************************************************************
+class LocalFTPServer( object ):
+
+    def __init__( self, root, host="127.0.0.1", port=0 ):
+        '''
+        Initialize class
+
+        INPUTS:
+            - root: Directory served as "/"
+            - host: Interface to listen on
+            - port: Port to listen on (0 == pick a free port)
+        '''
+
+        self.root = os.path.abspath( root )                             # Served directory
+        self.host = host                                                # ...
+        self.sock = socket.socket( socket.AF_INET, socket.SOCK_STREAM ) # Listening socket
+        self.sock.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
+        self.sock.bind( (host, port) )                                  # ...
+        self.sock.listen( 16 )                                          # ...
+        self.port = self.sock.getsockname()[1]                          # Actual port
+        self.running = False                                            # Accept loop flag
+
+    def start( self ):
+        self.running = True
+        t = Thread( target=self.accept_loop, args=() )
+        t.daemon = True
+        t.start()
+
+    def stop( self ):
+        self.running = False
+        try   : self.sock.close()
+        except: pass
+
+    def accept_loop( self ):
+        while( self.running ):
+            try   : conn, _ = self.sock.accept()
+            except: break
+            t = Thread( target=self.serve, args=(conn,) )
+            t.daemon = True
+            t.start()
+
+    def resolve( self, cwd, path ):
+        '''
+        Map an FTP path onto the served directory, refusing to
+        escape it
+        '''
+
+        rel = path if path.startswith( '/' ) else cwd + path            # Absolute or relative to cwd
+        full = os.path.normpath( os.path.join(self.root, rel.lstrip('/')) )
+        if( full != self.root and not full.startswith(self.root + os.sep) ): return( None )
+        return( full )
+
+    def serve( self, conn ):
+        f = conn.makefile( "rb" )                                       # Read commands line by line
+        reply = lambda text: conn.sendall( (text + "\r\n").encode("utf-8") )
+        cwd, rest, pasv = "/", 0, None                                  # Session state
+
+        try:
+            reply( "220 Local FTP ready" )
+            while( True ):
+                line = f.readline()
+                if( not line ): break
+                line = line.decode( "utf-8" ).rstrip( "\r\n" )
+                cmd, _, arg = line.partition( ' ' )
+                cmd = cmd.upper()
+
+                if  ( cmd == "USER" ): reply( "331 Password required" )
+                elif( cmd == "PASS" ): reply( "230 Logged in" )
+                elif( cmd == "TYPE" ): reply( "200 Type set" )
+                elif( cmd == "NOOP" ): reply( "200 OK" )
+                elif( cmd == "SYST" ): reply( "215 UNIX Type: L8" )
+                elif( cmd == "PWD"  ): reply( '257 "{}"'.format(cwd) )
+                elif( cmd == "QUIT" ):
+                    reply( "221 Bye" )
+                    break
+
+                elif( cmd == "CWD" ):
+                    full = self.resolve( cwd, arg )
+                    if( full is None or not os.path.isdir(full) ):
+                        reply( "550 No such directory" )
+                    else:
+                        rel = os.path.relpath( full, self.root )
+                        cwd = '/' if rel == '.' else '/' + rel.replace( os.sep, '/' ) + '/'
+                        reply( "250 OK" )
+
+                elif( cmd == "SIZE" ):
+                    full = self.resolve( cwd, arg )
+                    if( full is None or not os.path.isfile(full) ): reply( "550 No such file" )
+                    else: reply( "213 {}".format(os.path.getsize(full)) )
+
+                elif( cmd == "REST" ):
+                    rest = int( arg )
+                    reply( "350 Restarting at {}".format(rest) )
+
+                elif( cmd == "PASV" ):
+                    if( pasv is not None ): pasv.close()
+                    pasv = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+                    pasv.bind( (self.host, 0) )
+                    pasv.listen( 1 )
+                    port = pasv.getsockname()[1]
+                    reply( "227 Entering Passive Mode ({},{},{})".format(
+                           self.host.replace('.', ','), port >> 8, port & 0xff) )
+
+                elif( cmd == "RETR" ):
+                    full = self.resolve( cwd, arg )
+                    if( full is None or not os.path.isfile(full) ):
+                        reply( "550 No such file" )
+                    elif( pasv is None ):
+                        reply( "425 Use PASV first" )
+                    else:
+                        reply( "150 Opening data connection" )
+                        data, _ = pasv.accept()
+                        with open( full, 'rb' ) as src:
+                            src.seek( rest )
+                            while( True ):
+                                chunk = src.read( 2**16 )
+                                if( not chunk ): break
+                                data.sendall( chunk )
+                        data.close()
+                        pasv.close()
+                        pasv, rest = None, 0
+                        reply( "226 Transfer complete" )
+
+                else: reply( "502 Command not implemented" )
+
+        except Exception:
+            pass                                                        # Connection dropped
+
+        if( pasv is not None ): pasv.close()
+        conn.close()
@@ -0,0 +1,271 @@
+'''
+*
+* Minimal in-process MQTT 3.1/3.1.1 broker for benchmarks.
+*
+* Supports what the scanner programs use: CONNECT, SUBSCRIBE
+* with + and # wildcards, QoS 0/1 PUBLISH, retained messages,
+* last will, PINGREQ and DISCONNECT. It is not meant to be a
+* production broker; messages are delivered in order over
+* loopback and QoS 1 deliveries are never retransmitted.
+*
+'''
+
+# Import modules
+from    threading                   import  Thread, Lock                # One thread per connection
+import  socket                                                          # Listen for clients
+import  struct                                                          # Pack/unpack packet fields
+
+# ************************************************************************
+# =========================> DEFINE  FUNCTIONS <==========================
+# ************************************************************************
+def topic_matches( pattern, topic ):
+    '''
+    Check whether a topic matches a subscription filter
+
+    INPUTS:
+        - pattern: Subscription filter, may contain + and #
+        - topic  : Topic name
+
+    OUTPUT:
+        - match: True if topic matches
+    '''
+
+    p, t = pattern.split( '/' ), topic.split( '/' )
+    for i, level in enumerate( p ):
+        if( level == '#' ): return( True )                              # Matches everything below
+        if( i >= len(t) ): return( False )                              # Topic is shorter than filter
+        if( level != '+' and level != t[i] ): return( False )           # Level mismatch
+    return( len(p) == len(t) )
+
+# ------------------------------------------------------------------------
+
+def encode_length( n ):
+    '''
+    Encode an MQTT "remaining length" varint
+    '''
+
+    out = bytearray()
+    while( True ):
+        byte, n = n % 128, n // 128
+        out.append( byte | (0x80 if n else 0) )
+        if( not n ): return( bytes(out) )
+
+# ------------------------------------------------------------------------
+
+def encode_string( s ):
+    '''
+    Encode a length-prefixed UTF-8 string
+    '''
+
+    data = s.encode( "utf-8" )
+    return( struct.pack(">H", len(data)) + data )
+
+# ************************************************************************
+# ============================> DEFINE CLASS <============================
+# ************************************************************************
+class LocalMQTTBroker( object ):
+
+    def __init__( self, host="127.0.0.1", port=0 ):
+        '''
+        Initialize class
+
+        INPUTS:
+            - host: Interface to listen on
+            - port: Port to listen on (0 == pick a free port)
+        '''
+
+        self.sock = socket.socket( socket.AF_INET, socket.SOCK_STREAM ) # Listening socket
+        self.sock.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
+        self.sock.bind( (host, port) )                                  # ...
+        self.sock.listen( 16 )                                          # ...
+        self.port = self.sock.getsockname()[1]                          # Actual port
+
+        self.lock = Lock()                                              # Guard the tables below
+        self.sessions = []                                              # Connected sessions
+        self.retained = {}                                              # Topic -> (payload, qos)
+        self.running = False                                            # Accept loop flag
+
+    def start( self ):
+        '''
+        Accept connections on a background thread
+        '''
+
+        self.running = True
+        t = Thread( target=self.accept_loop, args=() )
+        t.daemon = True
+        t.start()
+
+    def stop( self ):
+        self.running = False
+        try   : self.sock.close()
+        except: pass
+        with self.lock:
+            for session in list( self.sessions ): session.close()
+
+    def accept_loop( self ):
+        while( self.running ):
+            try   : conn, _ = self.sock.accept()
+            except: break
+            conn.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+            session = Session( self, conn )
+            with self.lock: self.sessions.append( session )
+            t = Thread( target=session.serve, args=() )
+            t.daemon = True
+            t.start()
+
+    def route( self, topic, payload, qos, retain ):
+        '''
+        Deliver a published message to every matching subscription
+        and update the retained store
+        '''
+
+        with self.lock:
+            if( retain ):                                               # Empty payload clears retained message
+                if( len(payload) == 0 ): self.retained.pop( topic, None )
+                else                   : self.retained[ topic ] = ( payload, qos )
+            targets = []                                                # Collect matching sessions
+            for session in self.sessions:                               # ...
+                granted = session.match( topic )                        # ...
+                if( granted is not None ): targets.append( (session, min(qos, granted)) )
+
+        for session, q in targets:                                      # Deliver outside the lock
+            session.publish( topic, payload, q, False )
+
+    def remove( self, session ):
+        with self.lock:
+            if( session in self.sessions ): self.sessions.remove( session )
+
+# ------------------------------------------------------------------------
+
+class Session( object ):
+    '''
+    One client connection
+    '''
+
+    def __init__( self, broker, conn ):
+        self.broker = broker
+        self.conn = conn
+        self.send_lock = Lock()
+        self.subs = {}                                                  # Filter -> granted QoS
+        self.will = None                                                # (topic, payload, qos, retain)
+        self.next_id = 0                                                # Packet id for QoS 1 deliveries
+
+    def recv_exact( self, n ):
+        buf = b''
+        while( len(buf) < n ):
+            chunk = self.conn.recv( n - len(buf) )
+            if( not chunk ): raise EOFError
+            buf += chunk
+        return( buf )
+
+    def read_packet( self ):
+        header = ord( self.recv_exact(1) )                              # Fixed header
+        length, mult = 0, 1                                             # Remaining length varint
+        while( True ):                                                  # ...
+            byte = ord( self.recv_exact(1) )                            # ...
+            length += (byte & 0x7f) * mult                              # ...
+            mult *= 128                                                 # ...
+            if( not byte & 0x80 ): break                                # ...
+        return( header, self.recv_exact(length) )
+
+    def send( self, data ):
+        with self.send_lock:
+            self.conn.sendall( data )
+
+    def close( self ):
+        try   : self.conn.close()
+        except: pass
+
+    def match( self, topic ):
+        granted = None
+        for pattern, qos in list( self.subs.items() ):
+            if( topic_matches(pattern, topic) ): granted = max( qos, granted or 0 )
+        return( granted )
+
+    def publish( self, topic, payload, qos, retain ):
+        body = encode_string( topic )
+        if( qos > 0 ):
+            self.next_id = self.next_id % 65535 + 1
+            body += struct.pack( ">H", self.next_id )
+        body += payload
+        header = 0x30 | (qos << 1) | (1 if retain else 0)
+        try   : self.send( bytes(bytearray([header])) + encode_length(len(body)) + body )
+        except: pass                                                    # Connection is going away
+
+    def serve( self ):
+        clean = False                                                   # Whether DISCONNECT was received
+        try:
+            while( True ):
+                header, body = self.read_packet()
+                kind = header >> 4
+
+                if( kind == 1 ):                                        # CONNECT
+                    plen = struct.unpack( ">H", body[:2] )[0]           # Skip protocol name
+                    flags = ord( body[ 3+plen:4+plen ] )                # Connect flags
+                    pos = 6 + plen                                      # Skip level, flags, keepalive
+                    fields = []                                         # Client id, will topic/msg, user, pass
+                    while( pos < len(body) ):                           # ...
+                        n = struct.unpack( ">H", body[pos:pos+2] )[0]   # ...
+                        fields.append( body[ pos+2:pos+2+n ] )          # ...
+                        pos += 2 + n                                    # ...
+                    if( flags & 0x04 ):                                 # Will flag
+                        self.will = ( fields[1].decode("utf-8"), fields[2],
+                                      (flags >> 3) & 0x03, bool(flags & 0x20) )
+                    self.send( b"\x20\x02\x00\x00" )                    # CONNACK, accepted
+
+                elif( kind == 3 ):                                      # PUBLISH
+                    qos, retain = (header >> 1) & 0x03, bool(header & 0x01)
+                    n = struct.unpack( ">H", body[:2] )[0]
+                    topic = body[ 2:2+n ].decode( "utf-8" )
+                    pos = 2 + n
+                    if( qos > 0 ):                                      # Acknowledge
+                        pid = body[ pos:pos+2 ]                         # ...
+                        pos += 2                                        # ...
+                        self.send( b"\x40\x02" + pid )                  # ...
+                    self.broker.route( topic, body[pos:], min(qos, 1), retain )
+
+                elif( kind == 8 ):                                      # SUBSCRIBE
+                    pid, pos, granted = body[:2], 2, bytearray()
+                    new = []
+                    while( pos < len(body) ):
+                        n = struct.unpack( ">H", body[pos:pos+2] )[0]
+                        pattern = body[ pos+2:pos+2+n ].decode( "utf-8" )
+                        qos = min( ord(body[pos+2+n:pos+3+n]) & 0x03, 1 )
+                        self.subs[ pattern ] = qos
+                        granted.append( qos )
+                        new.append( (pattern, qos) )
+                        pos += 3 + n
+                    self.send( b"\x90" + encode_length(2+len(granted)) + pid + bytes(granted) )
+
+                    with self.broker.lock:                              # Send matching retained messages
+                        retained = list( self.broker.retained.items() ) # ...
+                    for topic, (payload, q) in retained:                # ...
+                        for pattern, qos in new:                        # ...
+                            if( topic_matches(pattern, topic) ):        # ...
+                                self.publish( topic, payload, min(q, qos), True )
+                                break                                   # ...
+
+                elif( kind == 10 ):                                     # UNSUBSCRIBE
+                    pid, pos = body[:2], 2
+                    while( pos < len(body) ):
+                        n = struct.unpack( ">H", body[pos:pos+2] )[0]
+                        self.subs.pop( body[pos+2:pos+2+n].decode("utf-8"), None )
+                        pos += 2 + n
+                    self.send( b"\xb0\x02" + pid )
+
+                elif( kind == 12 ):                                     # PINGREQ
+                    self.send( b"\xd0\x00" )
+
+                elif( kind == 14 ):                                     # DISCONNECT
+                    clean = True
+                    break
+
+                else: pass                                              # PUBACK etc. need no action
+
+        except Exception:
+            pass                                                        # Connection dropped
+
+        self.broker.remove( self )
+        self.close()
+        if( not clean and self.will is not None ):                      # Send last will
+            self.broker.route( *self.will )
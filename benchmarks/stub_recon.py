@@ -0,0 +1,120 @@
+'''
+*
+* Stub reconstruction command for benchmarks and tests.
+*
+* Stands in for main.bat: takes a folder of images and writes an
+* NVM model of them. Every camera gets a fixed "true" pose derived
+* from its image name (on a ring around the object, like a
+* turntable rig), and every model is written in its own random
+* frame (scale, rotation, translation), as separate VisualSFM runs
+* would be. Matching cost is simulated by sleeping for each pair
+* of images, so run time grows with the square of the number of
+* images like the real pipeline's:
+*
+*   python stub_recon.py <scan> <scan>/model.nvm --pair-cost 0.002
+*
+* truth_center() gives the true centre of a camera, to check how
+* well partial models were merged.
+*
+'''
+
+# Import modules
+from    time                        import  sleep                       # Simulated matching cost
+import  argparse                                                        # Command line parameters
+import  hashlib                                                         # Deterministic poses
+import  math                                                            # ...
+import  os                                                              # Paths
+import  random                                                          # Frame of each model
+import  sys                                                             # Import path
+
+HERE = os.path.dirname( os.path.abspath(__file__) )                     # Benchmarks directory
+sys.path.insert( 0, os.path.dirname(HERE) )                             # Make the programs importable
+
+from    recon_partition             import  write_nvm, qrot, qmul       # Model file & transforms
+
+# ************************************************************************
+# =========================> DEFINE  FUNCTIONS <==========================
+# ************************************************************************
+def unit( name, salt ):
+    '''
+    Deterministic number in [0, 1) from an image name
+    '''
+
+    h = hashlib.sha1( "{}:{}".format(name, salt).encode("utf-8") ).hexdigest()
+    return( int(h[:12], 16) / float(16**12) )
+
+# ------------------------------------------------------------------------
+
+def truth_center( name ):
+    '''
+    True centre of the camera that took an image
+    '''
+
+    theta = 2.0*math.pi*unit( name, "angle" )                           # Ring of radius 2 around the object,
+    return( (2.0*math.cos(theta), 2.0*math.sin(theta),                  # ...at a height of -0.5 to 0.5
+             unit(name, "height") - 0.5) )                              # ...
+
+# ------------------------------------------------------------------------
+
+def truth_rotation( name ):
+    '''
+    True rotation of the camera that took an image: facing the
+    middle of the ring
+    '''
+
+    theta = 2.0*math.pi*unit( name, "angle" ) + math.pi                 # Turn about z to face inwards
+    return( (math.cos(theta/2), 0.0, 0.0, math.sin(theta/2)) )          # ...
+
+# ------------------------------------------------------------------------
+
+def random_frame( seed ):
+    '''
+    Random similarity transform (scale, rotation, translation)
+    '''
+
+    rng = random.Random( seed )
+    q = [ rng.gauss(0, 1) for i in range(4) ]                           # Uniform random rotation
+    n = math.sqrt( sum(v*v for v in q) )                                # ...
+    return( math.exp( rng.uniform(-1, 1) ), tuple(v/n for v in q),
+            tuple( rng.uniform(-10, 10) for i in range(3) ) )
+
+# ------------------------------------------------------------------------
+
+def reconstruct( scan, model, pair_cost=0.0, points=20 ):
+    '''
+    Write a model of the images in a folder
+
+    INPUTS:
+        - scan     : Folder of images
+        - model    : NVM file to write
+        - pair_cost: Seconds of simulated matching per pair of images
+        - points   : Points seen by each camera
+    '''
+
+    names = sorted( n for n in os.listdir(scan) if n.lower().endswith((".jpg", ".jpeg")) )
+    sleep( pair_cost * len(names)*(len(names)-1)/2 )                    # Matching grows quadratically
+
+    s, q, t = random_frame( os.path.abspath(scan) )                     # This run's own frame
+    qc = ( q[0], -q[1], -q[2], -q[3] )                                  # ...
+    move = lambda p: tuple( s*v + t[i] for i, v in enumerate(qrot(q, p)) )
+
+    cameras, pts = [], []
+    for i, name in enumerate( names ):
+        cameras.append( [name, 1000.0, qmul(truth_rotation(name), qc), move(truth_center(name)), 0.0] )
+        for k in range( points ):                                       # Points on the object, each seen by this camera only
+            xyz = tuple( unit(name, "p{}{}".format(k, a)) - 0.5 for a in "xyz" )
+            pts.append( [move(xyz), (128, 128, 128), [[i, k, 0.0, 0.0]]] )
+    write_nvm( model, cameras, pts )
+
+# ************************************************************************
+# ===========================> SETUP  PROGRAM <===========================
+# ************************************************************************
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser( description="Stub reconstruction command" )
+    p.add_argument( "scan",                                             help="Folder of images" )
+    p.add_argument( "model",                                            help="NVM model to write" )
+    p.add_argument( "--pair-cost",  type=float, default=0.0,            help="Seconds of simulated matching per pair of images" )
+    p.add_argument( "--points",     type=int,   default=20,             help="Points seen by each camera" )
+    args = p.parse_args()
+    reconstruct( args.scan, args.model, args.pair_cost, args.points )
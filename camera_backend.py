@@ -0,0 +1,217 @@
+'''
+*
+* Camera backends used by the FTP server to capture images.
+*
+* A backend is opened once per scan and kept warm between
+* frames so the sensor init and auto-exposure settling cost
+* is paid only once. The fake backend produces synthetic JPEGs
+* so the capture path can be exercised off-Pi.
+*
+'''
+
+# Import modules
+from    time                        import  sleep, time                 # Add delays and wait times
+import  struct                                                          # Pack JPEG segment lengths
+
+# ************************************************************************
+# ==========================> DEFINE  CLASSES <===========================
+# ************************************************************************
+class CameraBackend( object ):
+    '''
+    Base class for camera backends. Subclasses implement open(),
+    close() and capture(); capture_sequence() falls back to
+    capturing frame by frame.
+    '''
+
+    def __init__( self, resolution=None, framerate=30 ):
+        '''
+        Initialize class
+
+        INPUTS:
+             - resolution: (width, height) of captured images
+             - framerate : Frame rate used for burst captures
+        '''
+
+        self.resolution = resolution                                    # Capture resolution (None == sensor default)
+        self.framerate  = framerate                                     # Frame rate for continuous capture
+        self.is_open    = False                                         # Whether the camera is currently opened
+
+    def __enter__( self ):
+        self.open()
+        return( self )
+
+    def __exit__( self, *args ):
+        self.close()
+
+    def open( self ):
+        self.is_open = True
+
+    def close( self ):
+        self.is_open = False
+
+    def capture( self, output ):
+        '''
+        Capture a single JPEG
+
+        INPUT:
+            - output: Path or writable file-like object
+        '''
+        raise NotImplementedError
+
+    def capture_sequence( self, outputs ):
+        '''
+        Capture JPEGs back to back as fast as the backend allows
+
+        INPUT:
+            - outputs: Iterable of paths or writable file-like objects
+        '''
+        for output in outputs:                                          # Capture each frame in turn
+            self.capture( output )                                      # ...
+
+    def preview( self, data, spec ):
+        '''
+        Make a preview of a captured JPEG
+
+        INPUTS:
+            - data: JPEG bytes of the full frame
+            - spec: preview_tier.PreviewSpec
+
+        OUTPUT:
+            - preview: JPEG bytes of the preview (None == cannot make one)
+        '''
+        return( spec.make(data) )
+
+# ------------------------------------------------------------------------
+
+class PiCameraBackend( CameraBackend ):
+    '''
+    Long-lived PiCamera session with exposure and white balance
+    locked after an initial settling period.
+    '''
+
+    def __init__( self, resolution=None, framerate=30, settle_time=2.0 ):
+        '''
+        Initialize class
+
+        INPUTS:
+             - resolution : (width, height) of captured images
+             - framerate  : Frame rate used for burst captures
+             - settle_time: Seconds given to auto-exposure/AWB before locking
+        '''
+
+        CameraBackend.__init__( self, resolution, framerate )
+        self.settle_time = settle_time                                  # Time to let the sensor settle
+        self.cam = None                                                 # PiCamera object placeholder
+
+    def open( self ):
+        '''
+        Open the camera, let gains settle, then fix exposure and
+        white balance for the remainder of the scan
+        '''
+
+        if( self.is_open ): return                                      # Nothing to do if already open
+
+        from picamera import PiCamera                                   # Only available on the Pi
+
+        self.cam = PiCamera()                                           # Open camera once for the whole scan
+        if( self.resolution is not None ):                              # Apply requested resolution
+            self.cam.resolution = self.resolution                       # ...
+        self.cam.framerate = self.framerate                             # ...
+
+        sleep( self.settle_time )                                       # Let auto-exposure & AWB settle
+
+        self.cam.shutter_speed = self.cam.exposure_speed                # Lock exposure at settled value
+        self.cam.exposure_mode = "off"                                  # ...
+        gains = self.cam.awb_gains                                      # Lock white balance at settled value
+        self.cam.awb_mode = "off"                                       # ...
+        self.cam.awb_gains = gains                                      # ...
+
+        self.is_open = True
+
+    def close( self ):
+        if( self.cam is not None ):                                     # Release camera
+            self.cam.close()                                            # ...
+            self.cam = None                                             # ...
+        self.is_open = False
+
+    def capture( self, output ):
+        self.cam.capture( output, format="jpeg" )                       # Still capture through the still port
+
+    def capture_sequence( self, outputs ):
+        self.cam.capture_sequence( outputs, format="jpeg",              # Continuous capture through the video
+                                   use_video_port=True )                # port for high frame rates
+
+# ------------------------------------------------------------------------
+
+class FakeCameraBackend( CameraBackend ):
+    '''
+    Camera stand-in that writes small, valid JPEGs padded with
+    COM segments up to a requested size. Useful for testing and
+    benchmarking the capture path without a Pi.
+    '''
+
+    # 1x1 grayscale baseline JPEG (all coefficients zero)
+    JPEG_HEAD = ( b"\xff\xd8"                                           # SOI
+                  b"\xff\xdb\x00\x43\x00" + b"\x01"*64 +                # DQT
+                  b"\xff\xc0\x00\x0b\x08\x00\x01\x00\x01\x01\x01\x11\x00" )   # SOF0
+    JPEG_TAIL = ( b"\xff\xc4\x00\x14\x00\x01" + b"\x00"*15 + b"\x00" +  # DHT (DC)
+                  b"\xff\xc4\x00\x14\x10\x01" + b"\x00"*15 + b"\x00" +  # DHT (AC)
+                  b"\xff\xda\x00\x08\x01\x01\x00\x00\x3f\x00" +         # SOS
+                  b"\x3f"                                               # Scan data
+                  b"\xff\xd9" )                                         # EOI
+
+    def __init__( self, resolution=None, framerate=30, img_size=2**20,
+                  capture_time=0.0 ):
+        '''
+        Initialize class
+
+        INPUTS:
+             - resolution  : Unused, kept for interface compatibility
+             - framerate   : Unused, kept for interface compatibility
+             - img_size    : Approximate size in bytes of each JPEG
+             - capture_time: Seconds each capture should take
+        '''
+
+        CameraBackend.__init__( self, resolution, framerate )
+        self.img_size     = img_size                                    # Target size of synthetic images
+        self.capture_time = capture_time                                # Simulated exposure/readout time
+        self.frame        = 0                                           # Number of frames captured so far
+
+    def make_jpeg( self, size=None ):
+        '''
+        Build a synthetic JPEG unique to the current frame
+
+        INPUT:
+            - size: Approximate size in bytes (None == img_size)
+
+        OUTPUT:
+            - data: JPEG bytes
+        '''
+
+        if( size is None ): size = self.img_size                        # ...
+        tag = "frame {} {:.6f} ".format( self.frame, time() )           # Make every frame's content unique
+        pad = max( 0, size - len(self.JPEG_HEAD) - len(self.JPEG_TAIL) )
+        body = ( tag.encode("ascii") * (pad//len(tag) + 1) )[:pad]      # Filler carried in COM segments
+
+        segments = []                                                   # Split filler into COM segments
+        for i in range( 0, len(body), 65000 ):                          # (max payload is 65533 bytes)
+            chunk = body[ i:i+65000 ]                                   # ...
+            segments.append( b"\xff\xfe" +                              # ...
+                             struct.pack( ">H", len(chunk)+2 ) + chunk )# ...
+
+        return( self.JPEG_HEAD[:2] + b"".join(segments) +               # COM segments go right after SOI
+                self.JPEG_HEAD[2:] + self.JPEG_TAIL )                   # ...
+
+    def capture( self, output ):
+        if( self.capture_time > 0 ): sleep( self.capture_time )         # Simulate sensor readout time
+        data = self.make_jpeg()                                         # Generate image
+        self.frame += 1                                                 # ...
+
+        if( hasattr(output, "write") ): output.write( data )            # Write to file-like object
+        else:                                                           # or to path
+            with open( output, 'wb' ) as f:                             # ...
+                f.write( data )                                         # ...
+
+    def preview( self, data, spec ):
+        w, h = spec.resolution                                          # Synthetic preview, sized like a real
+        return( self.make_jpeg( w*h*spec.quality//400 ) )               # ...one (~10 kB at 320x240, q50)
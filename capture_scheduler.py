@@ -0,0 +1,113 @@
+'''
+*
+* Deadline scheduler used by the FTP server to pace captures.
+*
+* Frames are fired against absolute deadlines on a monotonic
+* clock so the time spent capturing and publishing does not
+* accumulate into the period. The thread sleeps between
+* deadlines instead of spinning.
+*
+'''
+
+# Import modules
+from    threading                   import  Event                       # Interruptible sleeps
+
+try:    from time                   import  monotonic                   # Monotonic clock (Python 3)
+except: from time                   import  time as monotonic           # Fallback clock  (Python 2)
+
+# ************************************************************************
+# ============================> DEFINE CLASS <============================
+# ************************************************************************
+class DeadlineScheduler( object ):
+    '''
+    Fire frames at t0, t0+T, t0+2T, ... where T is the interval.
+
+    A frame whose work runs past the next deadline is counted as
+    an overrun; the next frame then fires immediately and any slots
+    missed entirely are dropped, so the schedule stays on the
+    original grid rather than drifting.
+    An interval of 0 (or None) runs frames as fast as possible.
+    '''
+
+    def __init__( self, interval=None ):
+        '''
+        Initialize class
+
+        INPUT:
+            - interval: Seconds between frames, 0/None == as fast as possible
+        '''
+
+        self.interval = interval if interval else 0                     # Target period
+        self.stop_event = Event()                                       # Set to abort a running schedule
+        self.reset()                                                    # Clear statistics
+
+    def reset( self ):
+        '''
+        Clear recorded statistics
+        '''
+
+        self.t0         = None                                          # Time of the first deadline
+        self.starts     = []                                            # Actual start time of each frame
+        self.jitter     = []                                            # Start time minus deadline for each frame
+        self.overruns   = 0                                             # Frames whose work ran past the next deadline
+
+    def stop( self ):
+        '''
+        Abort the schedule; the frames() generator returns at the
+        next deadline
+        '''
+
+        self.stop_event.set()
+
+    def frames( self, count ):
+        '''
+        Generator yielding frame indices at their deadlines
+
+        INPUT:
+            - count: Number of frames to schedule
+
+        OUTPUT:
+            - i: Index of the frame that is due
+        '''
+
+        self.reset()                                                    # Start with clean statistics
+        self.stop_event.clear()                                         # ...
+        self.t0 = monotonic()                                           # Anchor the schedule
+        slot = 0                                                        # Slot on the grid for the next frame
+
+        for i in range( count ):                                        # Schedule as many frames as requested
+            deadline = self.t0 + slot*self.interval                     #   Absolute deadline for this frame
+            delay = deadline - monotonic()                              #   Sleep until it is due
+            if( delay > 0 and self.stop_event.wait( delay ) ): return   #   ...unless we are told to stop
+            if( self.stop_event.is_set() ): return                      #   ...
+
+            now = monotonic()                                           #   Record when we actually started
+            self.starts.append( now )                                   #   ...
+            self.jitter.append( now - deadline )                        #   ...
+
+            yield( i )                                                  #   Hand control to the caller for the capture
+
+            slot += 1                                                   #   Advance to the next slot on the grid
+            if( self.interval > 0 ):                                    #   If the frame ran past the next deadline
+                now_slot = int( (monotonic() - self.t0)/self.interval ) #       Slot we are currently in
+                if( now_slot >= slot ):                                 #       ...
+                    self.overruns += 1                                  #       Count the overrun
+                    slot = now_slot                                     #       Drop slots that were missed entirely
+
+    def report( self ):
+        '''
+        Summarize the timing of the last schedule
+
+        OUTPUT:
+            - stats: Dictionary of timing statistics (seconds)
+        '''
+
+        n = len( self.starts )                                          # Number of frames fired
+        periods = [ b - a for a, b in zip(self.starts, self.starts[1:]) ]
+        stats = { "frames"          : n,
+                  "overruns"        : self.overruns,
+                  "jitter_mean"     : sum(self.jitter)/n if n else 0.0,
+                  "jitter_max"      : max(self.jitter) if n else 0.0,
+                  "period_mean"     : sum(periods)/len(periods) if periods else 0.0,
+                  "elapsed"         : self.starts[-1] - self.t0 if n else 0.0 }
+        return( stats )
@@ -0,0 +1,157 @@
+'''
+*
+* Bounded frame buffer used by the FTP server.
+*
+* Every stored frame (in RAM or in the FTP folder) is held until
+* the client acks it on the node's acks topic, then evicted at
+* once. Capture checks the buffer before every frame: once the
+* unacked frames reach the high watermark it pauses until the
+* client has caught up to the low watermark, so a slow client or
+* link bounds memory and storage on the Pi instead of growing it.
+*
+* A pause is bounded: if no acks drain the buffer in time, the
+* caller can re-announce the unacked frames and, failing that,
+* release the buffer so capture carries on (unbounded) until the
+* client acks again, rather than hang the node.
+*
+'''
+
+# Import modules
+from    threading                   import  Condition                   # Wake capture when frames are acked
+from    collections                 import  OrderedDict                 # Unacked frames, oldest first
+
+try:    from time                   import  monotonic                   # Monotonic clock (Python 3)
+except: from time                   import  time as monotonic           # Fallback clock  (Python 2)
+
+# ************************************************************************
+# ============================> DEFINE CLASS <============================
+# ************************************************************************
+class FrameBuffer( object ):
+    '''
+    Unacked frames held by a node, with high/low watermarks on
+    their total size
+    '''
+
+    def __init__( self, high=None, low=None, evict=None ):
+        '''
+        Initialize class
+
+        INPUTS:
+            - high : Bytes of unacked frames at which capture pauses (None == never)
+            - low  : Bytes capture resumes at (None == half of high)
+            - evict: Called with the name of every acked frame to free it
+        '''
+
+        self.high = high                                                # Watermarks
+        self.low = low if low is not None or high is None else high//2  # ...
+        self.evict = evict                                              # ...
+
+        self.cond = Condition()                                         # Guard everything below
+        self.frames = OrderedDict()                                     # Name -> size of unacked frames
+        self.total = 0                                                  # Bytes of unacked frames
+        self.peak = 0                                                   # Most bytes ever held
+        self.acked = 0                                                  # Number of frames acked
+        self.pauses, self.paused = 0, 0.0                               # Number & length of capture pauses
+        self.released = False                                           # Set by release(), cleared by the next ack
+        self.stalls = 0                                                 # Number of pauses that timed out
+
+    def describe( self ):
+        '''
+        Watermarks as a dictionary (advertised in a node's capabilities)
+        '''
+
+        return( {"high": self.high, "low": self.low} )
+
+    def add( self, name, size ):
+        '''
+        Hold a stored frame until it is acked
+        '''
+
+        with self.cond:
+            self.total += size - self.frames.pop( name, 0 )             # Recaptures replace the old frame
+            self.frames[ name ] = size                                  # ...
+            self.peak = max( self.peak, self.total )                    # ...
+
+    def ack( self, name ):
+        '''
+        Client has the frame: evict it and wake a paused capture
+
+        OUTPUT:
+            - ok: False if the frame was not held (e.g. acked twice)
+        '''
+
+        with self.cond:
+            size = self.frames.pop( name, None )
+            if( size is None ): return( False )
+            self.total -= size
+            self.acked += 1
+            self.released = False                                       # Client is back, bound the buffer again
+            self.cond.notify_all()
+
+        if( self.evict is not None ): self.evict( name )                # Free it outside the lock
+        return( True )
+
+    def full( self ):
+        '''
+        True if capture would pause now
+        '''
+
+        with self.cond:
+            return( self.high is not None and not self.released and self.total >= self.high )
+
+    def wait_for_room( self, timeout=None ):
+        '''
+        Block while the buffer is full: from the moment it reaches
+        the high watermark until it drains to the low watermark
+
+        INPUT:
+            - timeout: Max seconds to wait (None == until it drains)
+
+        OUTPUTS:
+            - waited : Seconds spent waiting (0 == buffer was not full)
+            - drained: False if the wait timed out with the buffer still full
+        '''
+
+        with self.cond:
+            if( self.high is None or self.released or self.total < self.high ):
+                return( 0.0, True )
+
+            start = monotonic()                                         # Client fell behind
+            deadline = None if timeout is None else start + timeout     # ...
+            self.pauses += 1                                            # ...
+            while( self.total > self.low and not self.released ):       # ...let it catch up
+                left = 1.0 if deadline is None else deadline - monotonic()
+                if( left <= 0 ): break                                  # ...but not forever
+                self.cond.wait( min(left, 1.0) )                        # ...(timed so Ctrl+C gets through)
+            waited = monotonic() - start                                # ...
+            self.paused += waited                                       # ...
+            drained = self.total <= self.low or self.released           # ...
+            if( not drained ): self.stalls += 1                         # ...
+            return( waited, drained )
+
+    def unacked( self ):
+        '''
+        Names of the frames held, oldest first
+        '''
+
+        with self.cond:
+            return( list(self.frames) )
+
+    def release( self ):
+        '''
+        Stop pausing capture until the client acks a frame again
+        '''
+
+        with self.cond:
+            self.released = True
+            self.cond.notify_all()
+
+    def report( self ):
+        '''
+        Buffer statistics of the scan
+        '''
+
+        with self.cond:
+            return( { "held"  : len(self.frames), "bytes": self.total, "peak": self.peak,
+                      "acked" : self.acked, "pauses": self.pauses, "paused": self.paused,
+                      "stalls": self.stalls } )
@@ -0,0 +1,224 @@
+'''
+*
+* Frame quality gate used by the FTP server.
+*
+* Every captured frame is decoded at a reduced size and checked
+* before it is stored and announced:
+*
+*   - sharpness: variance of the Laplacian (low == motion blur or
+*                out of focus)
+*   - exposure : share of clipped dark/bright pixels and mean level
+*                from the luminance histogram
+*   - duplicate: difference hash (dHash) within a few bits of a
+*                recently accepted frame
+*
+* All three are vectorised NumPy operations on one grayscale
+* array. Checks run on a small pool of worker threads so the
+* capture loop never waits for them; frames that fail are
+* reported with the reason and never reach the client.
+*
+* NumPy and Pillow are optional; without them the gate reports
+* itself unavailable and frames pass straight through.
+*
+'''
+
+# Import modules
+from    threading                   import  Thread, Lock                # Check frames off the capture thread
+from    collections                 import  deque                       # Recently accepted frame hashes
+from    io                          import  BytesIO                     # Decode frames from RAM
+
+try:    import numpy as np                                              # Vectorised checks (optional)
+except ImportError: np = None                                           # ...
+
+try:    from PIL                    import  Image                       # JPEG decoding (optional)
+except ImportError: Image = None                                        # ...
+
+try:    from Queue                  import  Queue                       # Frames awaiting a check (Python 2)
+except: from queue                  import  Queue                       # ... (Python 3)
+
+BLURRED, UNDEREXPOSED, OVEREXPOSED, DUPLICATE = ( "blurred", "underexposed", "overexposed", "duplicate" )
+
+# ************************************************************************
+# =========================> DEFINE  FUNCTIONS <==========================
+# ************************************************************************
+def available():
+    '''
+    True if NumPy and Pillow are installed
+    '''
+
+    return( np is not None and Image is not None )
+
+# ------------------------------------------------------------------------
+
+def measure( data, size=(640, 480) ):
+    '''
+    Measure the quality of a JPEG
+
+    INPUTS:
+        - data: JPEG bytes
+        - size: Max (width, height) the frame is analysed at
+
+    OUTPUT:
+        - metrics: Dictionary of "sharpness", "dark", "bright", "mean"
+                   and "hash" (None if the frame is too small to judge)
+    '''
+
+    img = Image.open( BytesIO(data) )                                   # Let libjpeg decode straight to a
+    img.draft( "L", size )                                              # ...reduced-size grayscale image
+    img = img.convert( "L" )                                            # ...
+    img.thumbnail( size )                                               # ...
+    g = np.asarray( img, dtype=np.float32 )                             # ...
+    if( g.shape[0] < 8 or g.shape[1] < 9 ): return( None )              # Nothing meaningful to measure
+
+    lap = ( g[1:-1, :-2] + g[1:-1, 2:] + g[:-2, 1:-1] + g[2:, 1:-1]     # 4-neighbour Laplacian
+            - 4.0*g[1:-1, 1:-1] )                                       # ...
+
+    hist = np.bincount( np.asarray(img, dtype=np.uint8).ravel(),        # Luminance histogram
+                        minlength=256 ).astype( np.float64 )            # ...
+    hist /= hist.sum()                                                  # ...
+
+    h, w = g.shape[0]//8*8, g.shape[1]//9*9                             # dHash: 9x8 block means, then
+    small = g[:h, :w].reshape( 8, h//8, 9, w//9 ).mean( axis=(1, 3) )   # ...whether each block is brighter
+    bits = small[:, 1:] > small[:, :-1]                                 # ...than its left neighbour
+
+    return( { "sharpness": float( lap.var() ),
+              "dark"     : float( hist[:8].sum() ),
+              "bright"   : float( hist[248:].sum() ),
+              "mean"     : float( np.dot(hist, np.arange(256)) ),
+              "hash"     : bits.ravel() } )
+
+# ************************************************************************
+# ============================> DEFINE CLASS <============================
+# ************************************************************************
+class QualityGate( object ):
+    '''
+    Pool of worker threads checking captured frames, calling back
+    with every frame that passes and every frame that fails
+    '''
+
+    def __init__( self, min_sharpness=100.0, max_clipped=0.25, exposure=(25, 230),
+                  max_distance=4, window=4, size=(640, 480), workers=2 ):
+        '''
+        Initialize class
+
+        INPUTS:
+            - min_sharpness: Min variance of the Laplacian (at the analysis size)
+            - max_clipped  : Max share of pixels clipped to black or to white
+            - exposure     : (min, max) mean luminance, 0-255
+            - max_distance : Frames whose hash is at most this many bits
+                             (of 64) from a recent frame are duplicates
+            - window       : Number of recently accepted frames checked for duplicates
+            - size         : Max (width, height) frames are analysed at
+            - workers      : Number of worker threads
+        '''
+
+        self.min_sharpness = min_sharpness                              # Thresholds
+        self.max_clipped = max_clipped                                  # ...
+        self.exposure = exposure                                        # ...
+        self.max_distance = max_distance                                # ...
+        self.size = size                                                # ...
+        self.workers = max( 1, workers )                                # ...
+
+        self.queue = Queue()                                            # Frames waiting to be checked
+        self.lock = Lock()                                              # Guard recent
+        self.recent = deque( maxlen=max(1, window) )                    # (name, hash) of recently accepted frames
+        self.on_pass = self.on_reject = None                            # Set by start()
+
+    def describe( self ):
+        '''
+        Thresholds as a dictionary (advertised in a node's capabilities)
+        '''
+
+        return( { "min_sharpness": self.min_sharpness,
+                  "max_clipped"  : self.max_clipped,
+                  "exposure"     : list(self.exposure),
+                  "max_distance" : self.max_distance } )
+
+    def start( self, on_pass, on_reject ):
+        '''
+        Start the workers
+
+        INPUTS:
+            - on_pass  : Called with the job of every frame that passes
+            - on_reject: Called with the job, reason and description of every
+                         frame that fails
+        '''
+
+        self.on_pass, self.on_reject = on_pass, on_reject
+        for i in range( self.workers ):                                 # Start pool of checkers
+            t = Thread( target=self.worker, args=() )                   # ...
+            t.daemon = True                                             # ...
+            t.start()                                                   # ...
+
+    def submit( self, name, data, job ):
+        '''
+        Queue a frame for checking; returns at once
+
+        INPUTS:
+            - name: Name of the frame
+            - data: JPEG bytes of the frame
+            - job : Anything the callbacks need to carry on with the frame
+        '''
+
+        self.queue.put( (name, data, job) )
+
+    def judge( self, name, metrics ):
+        '''
+        Decide on a frame from its metrics. Exposure is judged
+        before sharpness, which low contrast also drags down.
+
+        OUTPUTS:
+            - reason: None if the frame passes, otherwise why it failed
+            - detail: Human-readable description of the failure
+        '''
+
+        if( metrics["dark"] > self.max_clipped or metrics["mean"] < self.exposure[0] ):
+            return( UNDEREXPOSED, "{:.0%} black, mean {:.0f}".format(metrics["dark"], metrics["mean"]) )
+        if( metrics["bright"] > self.max_clipped or metrics["mean"] > self.exposure[1] ):
+            return( OVEREXPOSED, "{:.0%} white, mean {:.0f}".format(metrics["bright"], metrics["mean"]) )
+        if( metrics["sharpness"] < self.min_sharpness ):                # Scales with contrast squared, so only
+            return( BLURRED, "sharpness {:.1f} < {:.1f}".format(        # ...judged on well exposed frames
+                    metrics["sharpness"], self.min_sharpness) )         # ...
+
+        with self.lock:                                                 # Compare against recent frames and
+            for other, bits in self.recent:                             # ...remember this one if it is new
+                distance = int( np.count_nonzero(bits != metrics["hash"]) )
+                if( distance <= self.max_distance ):                    # ...
+                    return( DUPLICATE, "{} bit(s) from {}".format(distance, other) )
+            self.recent.append( (name, metrics["hash"]) )               # ...
+        return( None, None )
+
+    def worker( self ):
+        '''
+        Check queued frames and hand them to the callbacks
+        '''
+
+        while( True ):
+            item = self.queue.get()                                     # Block until a frame is captured
+            if( item is None ):                                         # Gate closed
+                self.queue.task_done()                                  # ...
+                return                                                  # ...
+            name, data, job = item                                      # ...
+
+            try:
+                metrics = measure( data, self.size )                    # Vectorised checks
+                reason, detail = ( None, None ) if metrics is None else self.judge( name, metrics )
+            except Exception as e:                                      # Undecodable frame
+                reason, detail = "unreadable", str( e )                 # ...
+
+            try:
+                if( reason is None ): self.on_pass( job )               # Carry on with the frame
+                else                : self.on_reject( job, reason, detail )
+            finally:
+                self.queue.task_done()                                  # ...
+
+    def join( self ):
+        '''
+        Block until every queued frame has been checked and handed on
+        '''
+
+        self.queue.join()
+
+    def close( self ):
+        for i in range( self.workers ):                                 # One stop marker per worker
+            self.queue.put( None )                                      # ...
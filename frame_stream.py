@@ -0,0 +1,282 @@
+'''
+*
+* Direct in-memory frame streaming between server and client.
+*
+* Frames captured into RAM are kept in a FrameStore and served
+* over a small threaded HTTP/1.1 endpoint that supports
+* keep-alive and byte ranges. The client side fetches frames
+* with FrameStreamClient as an alternative to FTP. Writing
+* frames to local disk is an optional background stage.
+*
+* The server listens on one interface (the address the node
+* advertises), and with a token it answers only requests that
+* carry it in an X-Scan-Token header; anything else gets a 403.
+*
+'''
+
+# Import modules
+from    threading                   import  Thread, Lock                # Persist frames in the background
+from    transfer_engine             import  open_socket                 # Sockets with a tuned receive buffer
+from    http_endpoint               import  BackgroundHTTPServer        # Threaded endpoint
+import  socket                                                          # ...
+import  hmac                                                            # Compare tokens in constant time
+import  os                                                              # Build paths for persisted frames
+import  re                                                              # Parse Range headers
+
+try:                                                                    # Python 2
+    from BaseHTTPServer             import  BaseHTTPRequestHandler
+    from httplib                    import  HTTPConnection
+    from Queue                      import  Queue
+except ImportError:                                                     # Python 3
+    from http.server                import  BaseHTTPRequestHandler
+    from http.client                import  HTTPConnection
+    from queue                      import  Queue
+
+STREAM_PORT = 8021                                                      # Default port of the frame endpoint
+TOKEN_HEADER = "X-Scan-Token"                                           # Header carrying the scan's token
+
+# ************************************************************************
+# ==========================> DEFINE  CLASSES <===========================
+# ************************************************************************
+class FrameStore( object ):
+    '''
+    Thread-safe in-memory store of captured frames, optionally
+    mirrored to disk by a background writer thread.
+    '''
+
+    def __init__( self, persist_dir=None ):
+        '''
+        Initialize class
+
+        INPUT:
+            - persist_dir: Directory to also write frames to (None == RAM only)
+        '''
+
+        self.frames = {}                                                # Frame name -> JPEG bytes
+        self.lock = Lock()                                              # Guard frames dictionary
+        self.persist_dir = persist_dir                                  # Where to persist frames, if anywhere
+
+        if( persist_dir is not None ):                                  # Start background disk writer
+            self.write_queue = Queue()                                  # ...
+            self.t_writer = Thread( target=self.disk_writer, args=() )  # ...
+            self.t_writer.daemon = True                                 # ...
+            self.t_writer.start()                                       # ...
+
+    def put( self, name, data ):
+        with self.lock:                                                 # Store frame
+            self.frames[ name ] = data                                  # ...
+        if( self.persist_dir is not None ):                             # Queue frame for the disk writer
+            self.write_queue.put( (name, data) )                        # ...(even if evicted from RAM before
+                                                                        # ...it is written)
+
+    def get( self, name ):
+        with self.lock:
+            return( self.frames.get(name) )
+
+    def discard( self, name ):
+        with self.lock:
+            self.frames.pop( name, None )
+
+    def names( self ):
+        with self.lock:
+            return( list(self.frames.keys()) )
+
+    def disk_writer( self ):
+        '''
+        Write queued frames to persist_dir, off the capture path
+        '''
+
+        while( True ):
+            name, data = self.write_queue.get()                         # Block until a frame is queued
+            with open( os.path.join(self.persist_dir, name), 'wb' ) as f:
+                f.write( data )                                         # ...
+            self.write_queue.task_done()                                # ...
+
+    def flush( self ):
+        '''
+        Block until every queued frame has been persisted
+        '''
+
+        if( self.persist_dir is not None ):
+            self.write_queue.join()
+
+# ------------------------------------------------------------------------
+
+class FrameRequestHandler( BaseHTTPRequestHandler ):
+    '''
+    Serve GET /<frame name> from the server's FrameStore with
+    optional "Range: bytes=start-[end]" support, to clients that
+    hold the server's token.
+    '''
+
+    protocol_version = "HTTP/1.1"                                       # Keep connections alive between frames
+
+    def do_GET( self ):
+        token = self.server.token                                       # Only clients of this scan
+        given = self.headers.get( TOKEN_HEADER ) or ''                  # ...
+        if( token is not None and not hmac.compare_digest(given.encode("utf-8"), token.encode("utf-8")) ):
+            self.send_response( 403 )                                   # ...
+            self.send_header( "Content-Length", "0" )                   # ...
+            self.end_headers()                                          # ...
+            return
+
+        name = self.path.lstrip( '/' )                                  # Frame name is the request path
+        data = self.server.store.get( name )                            # Look it up in RAM
+        if( data is None ):                                             # Unknown frame
+            self.send_response( 404 )                                   # ...
+            self.send_header( "Content-Length", "0" )                   # ...
+            self.end_headers()                                          # ...
+            return
+
+        start, end = 0, len(data) - 1                                   # Whole frame by default
+        rng = re.match( r"bytes=(\d+)-(\d*)",                           # Honour a single byte range
+                        self.headers.get("Range") or '' )               # ...
+        if( rng ):                                                      # ...
+            start = int( rng.group(1) )                                 # ...
+            if( rng.group(2) ): end = min( end, int(rng.group(2)) )     # ...
+            if( start > end ):                                          # Unsatisfiable range
+                self.send_response( 416 )                               # ...
+                self.send_header( "Content-Range", "bytes */{}".format(len(data)) )
+                self.send_header( "Content-Length", "0" )               # ...
+                self.end_headers()                                      # ...
+                return
+            self.send_response( 206 )                                   # Partial content
+            self.send_header( "Content-Range",                          # ...
+                              "bytes {}-{}/{}".format(start, end, len(data)) )
+        else:
+            self.send_response( 200 )                                   # Whole frame
+
+        self.send_header( "Content-Type", "image/jpeg" )
+        self.send_header( "Content-Length", str(end - start + 1) )
+        self.end_headers()
+        self.wfile.write( data[ start:end+1 ] )                         # Serve straight from RAM
+
+    def log_message( self, *args ):
+        pass                                                            # Keep the console quiet
+
+# ------------------------------------------------------------------------
+
+class FrameStreamServer( BackgroundHTTPServer ):
+    '''
+    Threaded HTTP endpoint serving frames held in a FrameStore
+    '''
+
+    def __init__( self, store, port=STREAM_PORT, host='', token=None ):
+        '''
+        Initialize class
+
+        INPUTS:
+            - store: FrameStore to serve frames from
+            - port : TCP port to listen on
+            - host : Interface to bind to ('' == all)
+            - token: Secret every request must carry (None == no check)
+        '''
+
+        BackgroundHTTPServer.__init__( self, (host, port), FrameRequestHandler )
+        self.store = store                                              # Frames to be served
+        self.token = token                                              # ...and to whom
+
+# ------------------------------------------------------------------------
+
+class StreamConnection( HTTPConnection ):
+    '''
+    HTTPConnection whose socket gets its receive buffer before it
+    connects, while the TCP window scale can still follow it
+    '''
+
+    rcvbuf = None                                                       # Receive buffer to request (None == OS default)
+    opened = 0                                                          # Receive buffer of the open socket
+
+    def connect( self ):
+        self.sock = open_socket( (self.host, self.port), self.timeout, self.rcvbuf )
+        try:
+            self.sock.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+            self.opened = self.sock.getsockopt( socket.SOL_SOCKET, socket.SO_RCVBUF )
+        except socket.error:
+            pass
+
+# ------------------------------------------------------------------------
+
+class FrameStreamClient( object ):
+    '''
+    Persistent connection to a FrameStreamServer used to fetch
+    frames directly into local files.
+    '''
+
+    def __init__( self, host, port=STREAM_PORT, timeout=30, rcvbuf=None, token=None ):
+        '''
+        Initialize class
+
+        INPUTS:
+            - host   : Address of the frame server
+            - port   : Port of the frame server
+            - timeout: Socket timeout in seconds
+            - rcvbuf : Receive buffer to request (None == OS default)
+            - token  : Secret the server requires (None == none)
+        '''
+
+        self.conn = StreamConnection( host, port, timeout=timeout )     # Connection is reused between frames
+        self.conn.rcvbuf = rcvbuf                                       # ...
+        self.token = token                                              # Sent with every request
+
+    def retune( self, rcvbuf ):
+        '''
+        Request a new receive buffer size. The open connection is
+        dropped if the new size is well past the one it has, and
+        reopened with it by the next request.
+        '''
+
+        if( rcvbuf is None ): return
+        self.conn.rcvbuf = rcvbuf
+        if( self.conn.sock is not None and rcvbuf > 2*self.conn.opened ):
+            self.conn.close()
+
+    def request( self, name, offset=0 ):
+        '''
+        Request a frame and return the response positioned at its body
+
+        INPUTS:
+            - name  : Name of frame to fetch
+            - offset: Byte offset to start from (resume)
+
+        OUTPUT:
+            - resp: HTTP response (status 200 or 206)
+        '''
+
+        headers = {}                                                    # Ask for a range when resuming
+        if( offset > 0 ): headers[ "Range" ] = "bytes={}-".format( offset )
+        if( self.token is not None ): headers[ TOKEN_HEADER ] = self.token
+
+        self.conn.request( "GET", '/' + name, headers=headers )         # Request frame
+        resp = self.conn.getresponse()                                  # ...
+        if( resp.status not in (200, 206) ):                            # Frame unavailable
+            resp.read()                                                 # ...drain body to keep connection usable
+            raise IOError( "Fetching {} failed with HTTP {}".format(name, resp.status) )
+        return( resp )
+
+    def fetch( self, name, f, offset=0, blocksize=2**16 ):
+        '''
+        Fetch a frame and write it to an open file
+
+        INPUTS:
+            - name     : Name of frame to fetch
+            - f        : Writable binary file object
+            - offset   : Byte offset to start from (resume)
+            - blocksize: Size of each read from the socket
+
+        OUTPUT:
+            - n: Number of bytes written
+        '''
+
+        resp = self.request( name, offset )                             # Request frame
+
+        n = 0                                                           # Copy body to file
+        while( True ):                                                  # ...
+            chunk = resp.read( blocksize )                              # ...
+            if( not chunk ): break                                      # ...
+            f.write( chunk )                                            # ...
+            n += len( chunk )                                           # ...
+        return( n )
+
+    def close( self ):
+        self.conn.close()
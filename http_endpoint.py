@@ -0,0 +1,45 @@
+'''
+*
+* Small threaded HTTP endpoint shared by the frame stream and the
+* metrics page.
+*
+* Requests are handled on daemon threads so open keep-alive
+* connections never block shutdown, and the server polls for a
+* stop request every 50 ms so stop() returns quickly.
+*
+'''
+
+# Import modules
+from    threading                   import  Thread                      # Serve requests in the background
+
+try:                                                                    # Python 2
+    from BaseHTTPServer             import  HTTPServer
+    from SocketServer               import  ThreadingMixIn
+except ImportError:                                                     # Python 3
+    from http.server                import  HTTPServer
+    from socketserver               import  ThreadingMixIn
+
+# ************************************************************************
+# ============================> DEFINE CLASS <============================
+# ************************************************************************
+class BackgroundHTTPServer( ThreadingMixIn, HTTPServer ):
+    '''
+    Threaded HTTP server run on a background thread
+    '''
+
+    daemon_threads = True                                               # Don't block shutdown on open connections
+    allow_reuse_address = True                                          # Allow quick restarts between scans
+
+    def start( self ):
+        '''
+        Serve requests on a background thread
+        '''
+
+        self.t_serve = Thread( target=self.serve_forever,               # ...
+                               args=(0.05,) )                           # ...poll every 50 ms so stop() is quick
+        self.t_serve.daemon = True                                      # ...
+        self.t_serve.start()                                            # ...
+
+    def stop( self ):
+        self.shutdown()                                                 # Stop serve_forever()
+        self.server_close()                                             # Release the socket
@@ -0,0 +1,153 @@
+'''
+*
+* Content-addressed image cache used by the client.
+*
+* Images are stored under their SHA-1 checksum so a frame that
+* was already downloaded, in this scan or a previous one, can be
+* linked into place instead of transferred again. The cache is
+* kept under a size budget by evicting the least recently used
+* images.
+*
+'''
+
+# Import modules
+from    threading                   import  Lock                        # Cache is shared by the download workers
+import  os                                                              # File system operations
+import  shutil                                                          # Copy when hard links are unavailable
+
+# ************************************************************************
+# =========================> DEFINE  FUNCTIONS <==========================
+# ************************************************************************
+def link_or_copy( src, dst ):
+    '''
+    Hard-link src to dst, copying instead when the file system (or
+    platform) does not support hard links. dst is replaced if it
+    already exists so a link is never written through.
+
+    INPUTS:
+        - src: Existing file
+        - dst: Path to create
+    '''
+
+    if( os.path.exists(dst) ): os.remove( dst )                         # Never overwrite a (possibly linked) file in place
+    try:
+        os.link( src, dst )                                             # Hard link
+    except( AttributeError, OSError ):                                  # No os.link (Python 2 on Windows) or cross-device
+        shutil.copyfile( src, dst )                                     # ...
+
+# ------------------------------------------------------------------------
+
+def copy_over( src, dst ):
+    '''
+    Copy src to dst as a file of its own. dst is replaced rather
+    than written through, in case it is a link to something else.
+
+    INPUTS:
+        - src: Existing file
+        - dst: Path to create
+    '''
+
+    if( os.path.exists(dst) ): os.remove( dst )                         # Never overwrite a (possibly linked) file in place
+    shutil.copyfile( src, dst )                                         # ...
+
+# ************************************************************************
+# ============================> DEFINE CLASS <============================
+# ************************************************************************
+class ImageCache( object ):
+    '''
+    Size-bounded, content-addressed store of images with LRU
+    eviction. Access times are tracked through file mtimes so
+    the order survives restarts.
+    '''
+
+    place = staticmethod( link_or_copy )                                # How cached files are placed at dst
+
+    def __init__( self, root, max_bytes=2*2**30 ):
+        '''
+        Initialize class
+
+        INPUTS:
+            - root     : Directory holding cached images
+            - max_bytes: Size budget of the cache
+        '''
+
+        self.root = root                                                # Cache location
+        self.max_bytes = max_bytes                                      # Size budget
+        self.lock = Lock()                                              # Guard bookkeeping
+
+        if( not os.path.isdir(root) ): os.makedirs( root )              # Create cache if needed
+        self.total = sum( os.path.getsize(p) for p in self.entries() )  # Current size of cache
+
+    def path( self, digest ):
+        '''
+        Location of an image in the cache
+        '''
+
+        return( os.path.join(self.root, digest[:2], digest + ".jpg") )
+
+    def entries( self ):
+        '''
+        Paths of every cached image
+        '''
+
+        for sub in os.listdir( self.root ):                             # Images are sharded by first two hex digits
+            d = os.path.join( self.root, sub )                          # ...
+            if( os.path.isdir(d) ):                                     # ...
+                for name in os.listdir( d ):                            # ...
+                    yield( os.path.join(d, name) )                      # ...
+
+    def fetch( self, digest, dst ):
+        '''
+        Place a cached image at dst
+
+        INPUTS:
+            - digest: SHA-1 of the wanted image
+            - dst   : Where to place it
+
+        OUTPUT:
+            - hit: True if the image was in the cache
+        '''
+
+        src = self.path( digest )
+        with self.lock:
+            if( not os.path.isfile(src) ): return( False )              # Cache miss
+            os.utime( src, None )                                       # Mark as recently used
+            self.place( src, dst )                                      # Link into place
+            return( True )
+
+    def add( self, digest, src ):
+        '''
+        Add an image to the cache and evict old ones if the cache
+        is over budget
+
+        INPUTS:
+            - digest: SHA-1 of the image
+            - src   : Path of the image
+        '''
+
+        dst = self.path( digest )
+        with self.lock:
+            if( os.path.isfile(dst) ):                                  # Already cached
+                os.utime( dst, None )                                   # ...mark as recently used
+                return                                                  # ...
+
+            if( not os.path.isdir(os.path.dirname(dst)) ):              # Create shard directory
+                os.makedirs( os.path.dirname(dst) )                     # ...
+            link_or_copy( src, dst )                                    # Store image
+            os.utime( dst, None )                                       # ...as the most recently used
+            self.total += os.path.getsize( dst )                        # ...
+            self.evict()                                                # Stay within budget
+
+    def evict( self ):
+        '''
+        Remove least recently used images until the cache fits its
+        budget. Must be called with the lock held.
+        '''
+
+        if( self.total <= self.max_bytes ): return                      # Within budget
+
+        lru = sorted( self.entries(), key=os.path.getmtime )            # Oldest first
+        for p in lru:                                                   # Evict until within budget
+            if( self.total <= self.max_bytes ): break                   # ...
+            self.total -= os.path.getsize( p )                          # ...
+            os.remove( p )                                              # ...
@@ -1,26 +1,185 @@
 #!/usr/bin/python
-#import Adafruit_MotorHAT, Adafruit_DCMotor, Adafruit_Stepper
-from Adafruit_MotorHAT import Adafruit_MotorHAT, Adafruit_DCMotor, Adafruit_StepperMotor
+'''
+*
+* Turntable motion control.
+*
+* MotionController drives a stepper on its own thread and exposes
+* "move to angle N" and "wait until settled" operations so the
+* capture loop can start the next move as soon as the shutter
+* closes. The hardware backend wraps Adafruit_MotorHAT; the
+* simulated backend lets the scan mode run without a HAT.
+*
+* Run directly to swing the stepper back and forth as before.
+*
+'''
 
-import time
-import atexit
+# Import modules
+from    threading                   import  Thread, Event, Lock         # Motion runs on its own thread
+import  time                                                            # Step timing & settling delays
+import  atexit                                                          # Release motors on exit
 
-# create a default object, no changes to I2C address or frequency
-mh = Adafruit_MotorHAT()
+try:    from Queue                  import  Queue                       # Queue of move targets (Python 2)
+except: from queue                  import  Queue                       # ... (Python 3)
 
-# recommended for auto-disabling motors on shutdown!
-def turnOffMotors():
-    mh.getMotor(1).run(Adafruit_MotorHAT.RELEASE)
-    mh.getMotor(2).run(Adafruit_MotorHAT.RELEASE)
-    mh.getMotor(3).run(Adafruit_MotorHAT.RELEASE)
-    mh.getMotor(4).run(Adafruit_MotorHAT.RELEASE)
+# ************************************************************************
+# ==========================> DEFINE  CLASSES <===========================
+# ************************************************************************
+class HATStepperBackend( object ):
+    '''
+    Stepper on an Adafruit Motor HAT
+    '''
 
-atexit.register(turnOffMotors)
+    def __init__( self, steps_per_rev=200, port=1, rpm=30 ):
+        '''
+        Initialize class
 
-myStepper = mh.getStepper(200, 1)  # 200 steps/rev, motor port #1
-myStepper.setSpeed(30)             # 30 RPM
+        INPUTS:
+            - steps_per_rev: Full steps per revolution of the motor
+            - port         : Stepper port on the HAT (1 or 2)
+            - rpm          : Stepping speed
+        '''
 
-while (True):
-    print("Interleaved coil steps")
-    myStepper.step( 1000, Adafruit_MotorHAT.FORWARD,  Adafruit_MotorHAT.INTERLEAVE )
-    myStepper.step( 1000, Adafruit_MotorHAT.BACKWARD, Adafruit_MotorHAT.INTERLEAVE )
+        from Adafruit_MotorHAT import Adafruit_MotorHAT                 # Only available on the Pi
+
+        self.HAT = Adafruit_MotorHAT                                    # Constants (FORWARD, INTERLEAVE, ...)
+        self.mh = Adafruit_MotorHAT()                                   # Default I2C address & frequency
+        self.stepper = self.mh.getStepper( steps_per_rev, port )        # ...
+        self.stepper.setSpeed( rpm )                                    # ...
+        self.steps_per_rev = 2 * steps_per_rev                          # Interleaved half steps per revolution
+        atexit.register( self.release )                                 # Auto-disable motors on shutdown
+
+    def step( self, n, forward ):
+        '''
+        Move n interleaved half steps (blocking)
+        '''
+
+        direction = self.HAT.FORWARD if forward else self.HAT.BACKWARD
+        self.stepper.step( n, direction, self.HAT.INTERLEAVE )
+
+    def release( self ):
+        for i in range( 1, 5 ):                                         # Release all motors
+            self.mh.getMotor( i ).run( self.HAT.RELEASE )               # ...
+
+# ------------------------------------------------------------------------
+
+class SimulatedStepperBackend( object ):
+    '''
+    Stepper stand-in that takes as long to move as the real motor
+    would, for testing the scan mode without a HAT
+    '''
+
+    def __init__( self, steps_per_rev=200, rpm=30, time_scale=1.0 ):
+        '''
+        Initialize class
+
+        INPUTS:
+            - steps_per_rev: Full steps per revolution of the motor
+            - rpm          : Stepping speed
+            - time_scale   : Multiplier on simulated move times (0 == instant)
+        '''
+
+        self.steps_per_rev = 2 * steps_per_rev                          # Interleaved half steps per revolution
+        self.step_time = 60.0 / (rpm * steps_per_rev) / 2 * time_scale  # Seconds per half step
+        self.position = 0                                               # Net half steps moved
+        self.moves = []                                                 # Log of (steps, forward) moves
+
+    def step( self, n, forward ):
+        time.sleep( n * self.step_time )                                # Take as long as the motor would
+        self.position += n if forward else -n                           # ...
+        self.moves.append( (n, forward) )                               # ...
+
+    def release( self ):
+        pass
+
+# ************************************************************************
+# ============================> DEFINE CLASS <============================
+# ************************************************************************
+class MotionController( object ):
+    '''
+    Runs moves on a background thread. Angles are absolute, in
+    degrees, relative to where the turntable was when the
+    controller was created.
+    '''
+
+    def __init__( self, backend, settle_time=0.2 ):
+        '''
+        Initialize class
+
+        INPUTS:
+            - backend    : HATStepperBackend or SimulatedStepperBackend
+            - settle_time: Seconds to let vibrations die out after a move
+        '''
+
+        self.backend = backend                                          # Stepper driver
+        self.settle_time = settle_time                                  # Post-move settling delay
+        self.step_pos = 0                                               # Current position in half steps
+        self.lock = Lock()                                              # Guard position
+        self.move_lock = Lock()                                         # Keep queue & settled flag consistent
+        self.targets = Queue()                                          # Pending move targets (in half steps)
+        self.settled = Event()                                          # Set while no move is pending/running
+        self.settled.set()                                              # ...
+
+        self.t_motion = Thread( target=self.motion_loop, args=() )      # Start motion thread
+        self.t_motion.daemon = True                                     # ...
+        self.t_motion.start()                                           # ...
+
+    @property
+    def angle( self ):
+        with self.lock:
+            return( 360.0 * self.step_pos / self.backend.steps_per_rev )
+
+    def move_to( self, angle ):
+        '''
+        Start moving to an absolute angle and return immediately
+
+        INPUT:
+            - angle: Target angle in degrees
+        '''
+
+        target = int( round(angle / 360.0 * self.backend.steps_per_rev) )
+        with self.move_lock:                                            # Hand over to the motion thread
+            self.targets.put( target )                                  # ...
+            self.settled.clear()                                        # Moving from now on
+
+    def wait_settled( self, timeout=None ):
+        '''
+        Block until every requested move has finished and settled
+
+        INPUT:
+            - timeout: Max seconds to wait (None == forever)
+
+        OUTPUT:
+            - settled: False if the timeout expired first
+        '''
+
+        return( self.settled.wait(timeout) )
+
+    def motion_loop( self ):
+        while( True ):
+            target = self.targets.get()                                 # Block until a move is requested
+            with self.lock:                                             # Steps to get there
+                delta = target - self.step_pos                          # ...
+            if( delta != 0 ):                                           # Move
+                self.backend.step( abs(delta), delta > 0 )              # ...
+                with self.lock:                                         # ...
+                    self.step_pos = target                              # ...
+                time.sleep( self.settle_time )                          # Let the table settle
+            with self.move_lock:                                        # Settled once nothing else is queued
+                self.targets.task_done()                                # ...
+                if( self.targets.unfinished_tasks == 0 ):               # ...
+                    self.settled.set()                                  # ...
+
+    def release( self ):
+        self.backend.release()
+
+# ************************************************************************
+# ===========================> SETUP  PROGRAM <===========================
+# ************************************************************************
+
+if __name__ == "__main__":
+    backend = HATStepperBackend( 200, 1, 30 )                           # 200 steps/rev, motor port #1, 30 RPM
+
+    while (True):
+        print("Interleaved coil steps")
+        backend.step( 1000, True  )
+        backend.step( 1000, False )
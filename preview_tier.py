@@ -0,0 +1,239 @@
+'''
+*
+* Preview tier of a scan: small, low-quality copies of every frame
+* that reach the client ahead of the full-resolution frames.
+*
+* The server derives a preview from each captured JPEG (optionally
+* cropped to a region of interest), stores it under "preview/" next
+* to the full frame and announces it right away, marked with the
+* frame it belongs to:
+*
+*   { "name": "preview/image0.jpg", ..., "preview_of": "image0.jpg" }
+*
+* The client downloads previews ahead of any queued full frame,
+* keeps a running check of how much of the object they cover, and
+* can run a quick low-resolution reconstruction over them while
+* the full frames are still streaming in.
+*
+'''
+
+# Import modules
+from    threading                   import  Lock                        # Guard coverage state
+from    subprocess                  import  Popen                       # Run preview reconstruction
+from    io                          import  BytesIO                     # Encode previews in RAM
+from    time                        import  time                        # Time preview reconstruction
+import  posixpath                                                       # Preview names ('/' on every OS)
+
+try:    from PIL                    import  Image                       # Downscale previews (optional)
+except ImportError: Image = None                                        # ...
+
+PREVIEW_DIR = "preview"                                                 # Sub-folder previews are stored in
+
+# ************************************************************************
+# =========================> DEFINE  FUNCTIONS <==========================
+# ************************************************************************
+def preview_name( name ):
+    '''
+    Name the preview of a frame is stored and announced under
+    '''
+
+    return( posixpath.join(PREVIEW_DIR, name) )
+
+# ------------------------------------------------------------------------
+
+def is_preview( entry ):
+    '''
+    True if a frame entry announces a preview
+    '''
+
+    return( "preview_of" in entry )
+
+# ------------------------------------------------------------------------
+
+def coverage( angles, sectors=36 ):
+    '''
+    How well a set of turntable angles covers a full turn
+
+    INPUTS:
+        - angles : Angles (degrees) frames were taken at
+        - sectors: Number of equal sectors the turn is split into
+
+    OUTPUTS:
+        - covered: Number of sectors holding at least one frame
+        - max_gap: Largest angle (degrees) between neighbouring frames
+    '''
+
+    if( len(angles) == 0 ): return( 0, 360.0 )
+
+    angles = sorted( a % 360.0 for a in angles )                        # Neighbouring frames, wrapping around
+    gaps = [ b - a for a, b in zip(angles, angles[1:]) ]                # ...
+    gaps.append( angles[0] + 360.0 - angles[-1] )                       # ...
+    covered = len( set(int(a * sectors / 360.0) for a in angles) )      # ...
+    return( covered, max(gaps) )
+
+# ************************************************************************
+# ==========================> DEFINE  CLASSES <===========================
+# ************************************************************************
+class PreviewSpec( object ):
+    '''
+    How previews are made from full frames
+    '''
+
+    def __init__( self, resolution=(320, 240), quality=50, roi=None ):
+        '''
+        Initialize class
+
+        INPUTS:
+            - resolution: Max (width, height) of a preview; aspect ratio is kept
+            - quality   : JPEG quality of a preview (1-95)
+            - roi       : (x, y, width, height) crop, as fractions of the frame
+                          like PiCamera's zoom (None == whole frame)
+        '''
+
+        self.resolution = tuple( resolution )                           # ...
+        self.quality = quality                                          # ...
+        self.roi = tuple( roi ) if roi is not None else None            # ...
+
+    def describe( self ):
+        '''
+        Spec as a dictionary (advertised in a node's capabilities)
+        '''
+
+        return( { "resolution": list(self.resolution),
+                  "quality"   : self.quality,
+                  "roi"       : list(self.roi) if self.roi else None } )
+
+    def make( self, data ):
+        '''
+        Downscale a full JPEG into a preview. The JPEG is decoded
+        in draft mode, which lets libjpeg scale it down by up to 8x
+        while decoding, so most of the full frame is never expanded.
+
+        INPUT:
+            - data: JPEG bytes of the full frame
+
+        OUTPUT:
+            - preview: JPEG bytes of the preview (None == Pillow not installed)
+        '''
+
+        if( Image is None ): return( None )
+
+        img = Image.open( BytesIO(data) )                               # Header only, nothing decoded yet
+        fx, fy, fw, fh = self.roi or ( 0.0, 0.0, 1.0, 1.0 )             # Decode just big enough that the
+        img.draft( "RGB", (int(self.resolution[0] / fw),                # ...cropped region still fills
+                           int(self.resolution[1] / fh)) )              # ...the preview
+        if( self.roi is not None ):                                     # Crop to region of interest
+            w, h = img.size                                             # ...
+            img = img.crop( (int(fx*w), int(fy*h),                      # ...
+                             int((fx+fw)*w), int((fy+fh)*h)) )          # ...
+        img.thumbnail( self.resolution )                                # Final downscale, keeping aspect
+
+        out = BytesIO()                                                 # Re-encode
+        img.convert( "RGB" ).save( out, "JPEG", quality=self.quality )  # ...
+        return( out.getvalue() )
+
+# ------------------------------------------------------------------------
+
+class PreviewMonitor( object ):
+    '''
+    Client-side tracker of a scan's landed previews: reports
+    coverage as they arrive and runs a preview reconstruction
+    once every expected preview is in
+    '''
+
+    def __init__( self, preview_dir, cmd=None, on_report=None, sectors=36 ):
+        '''
+        Initialize class
+
+        INPUTS:
+            - preview_dir: Folder the scan's previews land in
+            - cmd        : Preview reconstruction command, "{scan}" is replaced
+                           by preview_dir (None == coverage check only)
+            - on_report  : Called with a coverage report for every landed preview
+            - sectors    : Number of sectors a turntable turn is split into
+        '''
+
+        self.preview_dir = preview_dir                                  # ...
+        self.cmd = cmd                                                  # ...
+        self.on_report = on_report                                      # ...
+        self.sectors = sectors                                          # ...
+
+        self.lock = Lock()                                              # Guard everything below
+        self.expected = {}                                              # Node -> number of frames it will take
+        self.landed = {}                                                # Node -> number of previews landed
+        self.seen = set()                                               # (node, name) of every preview counted
+        self.angles = {}                                                # Node -> turntable angles landed
+        self.process = None                                             # Preview reconstruction, once started
+        self.started = None                                             # ...
+
+    def expect( self, node, count ):
+        '''
+        Tell the monitor how many frames a node will take
+        '''
+
+        with self.lock:
+            self.expected[ node ] = count
+            self.landed.setdefault( node, 0 )
+
+    def add( self, node, entry ):
+        '''
+        Record a landed preview and report coverage; a preview
+        that lands again (announced twice) is only counted once
+
+        INPUTS:
+            - node : Name of the node it came from
+            - entry: Its frame entry
+
+        OUTPUT:
+            - report: Coverage report
+        '''
+
+        with self.lock:
+            if( (node, entry["name"]) in self.seen ):                   # Counted already
+                return( self.report_locked() )                          # ...
+            self.seen.add( (node, entry["name"]) )                      # ...
+            self.landed[ node ] = self.landed.get( node, 0 ) + 1
+            if( "angle" in entry ):
+                self.angles.setdefault( node, [] ).append( entry["angle"] )
+            report = self.report_locked()
+            if( report["complete"] ): self.start_locked()               # Every preview is in
+
+        if( self.on_report is not None ): self.on_report( report )
+        return( report )
+
+    def report_locked( self ):
+        landed = sum( self.landed.values() )
+        expected = sum( self.expected.get(n, 0) for n in self.landed )
+        report = { "previews": landed, "expected": expected,
+                   "complete": expected > 0 and landed >= expected }
+
+        if( len(self.angles) > 0 ):                                     # Turntable scans: angular coverage
+            report[ "nodes" ] = {}                                      # ...of each camera
+            for node, angles in self.angles.items():                    # ...
+                covered, max_gap = coverage( angles, self.sectors )     # ...
+                report[ "nodes" ][ node ] = { "sectors": covered, "of": self.sectors,
+                                              "max_gap": round(max_gap, 1) }
+        return( report )
+
+    def start_locked( self ):
+        if( self.cmd is None or self.process is not None ): return
+        cmd = [ arg.replace("{scan}", self.preview_dir) for arg in self.cmd ]
+        try   : self.process = Popen( cmd )                             # Runs alongside the full-frame transfers
+        except OSError: return                                          # ...
+        self.started = time()                                           # ...
+
+    def finish( self ):
+        '''
+        Start the preview reconstruction if it never started (e.g.
+        a node's frame count was unknown) and wait for it
+
+        OUTPUT:
+            - seconds: How long it ran (None == it did not run)
+        '''
+
+        with self.lock:
+            if( sum(self.landed.values()) > 0 ): self.start_locked()    # Only if any previews landed
+            process = self.process
+        if( process is None ): return( None )
+        process.wait()
+        return( time() - self.started )
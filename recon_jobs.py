@@ -0,0 +1,250 @@
+'''
+*
+* Reconstruction job queue used by the client in daemon mode.
+*
+* Every completed scan becomes a job running the global
+* reconstruction command as its own process. Jobs wait in a
+* bounded priority queue (highest priority first, then oldest)
+* and only a fixed number run at once, so new scans keep landing
+* while earlier ones reconstruct. Queued jobs can be
+* reprioritized, queued or running jobs can be cancelled, and
+* every status change is reported through a callback.
+*
+* Each job runs in a process group of its own, and cancelling it
+* kills the whole tree (e.g. the cluster reconstructions started
+* by a partitioned job), on Windows as well as on POSIX.
+*
+'''
+
+# Import modules
+from    threading                   import  Thread, Condition           # Job runners & queue signalling
+from    subprocess                  import  Popen, call                 # Run reconstruction commands
+from    time                        import  time                        # Job timestamps
+import  heapq                                                           # Priority queue
+import  itertools                                                       # Submission order tie-breaker
+import  os                                                              # Process groups
+import  signal                                                          # ...
+
+try:    from Queue                  import  Full                        # Raised when the queue is full (Python 2)
+except: from queue                  import  Full                        # ... (Python 3)
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = ( "queued", "running", "done", "failed", "cancelled" )
+
+# ************************************************************************
+# =========================> DEFINE  FUNCTIONS <==========================
+# ************************************************************************
+def start_group( cmd, cwd=None ):
+    '''
+    Start a command as the leader of a new process group, so it
+    can be killed along with everything it starts
+    '''
+
+    if( os.name == "nt" ):                                              # Windows
+        return( Popen( cmd, cwd=cwd, creationflags=0x00000200 ) )       # ...CREATE_NEW_PROCESS_GROUP
+    return( Popen( cmd, cwd=cwd, preexec_fn=os.setsid ) )               # POSIX: new session & group
+
+# ------------------------------------------------------------------------
+
+def kill_tree( process ):
+    '''
+    Kill a process started by start_group() and its descendants.
+    On Windows terminate() only ends the process itself, leaving
+    its children running, so the tree is taken down by taskkill.
+    '''
+
+    if( os.name == "nt" ):                                              # Whole tree, forcibly
+        with open( os.devnull, 'w' ) as null:                           # ...
+            call( ["taskkill", "/PID", str(process.pid), "/T", "/F"],   # ...
+                  stdout=null, stderr=null )                            # ...
+    else:                                                               # Whole group
+        try   : os.killpg( process.pid, signal.SIGTERM )                # ...(its leader's PID is the group's ID)
+        except OSError: pass                                            # ...already gone
+
+# ************************************************************************
+# ==========================> DEFINE  CLASSES <===========================
+# ************************************************************************
+class ReconJob( object ):
+    '''
+    One scan waiting for, or going through, reconstruction
+    '''
+
+    def __init__( self, job_id, cmd, priority=0, cwd=None ):
+        '''
+        Initialize class
+
+        INPUTS:
+            - job_id  : Unique name of the job (e.g. the scan name)
+            - cmd     : Command to run, as a list of arguments
+            - priority: Higher runs first
+            - cwd     : Working directory of the command (None == ours)
+        '''
+
+        self.id = job_id                                                # Job identity & command
+        self.cmd, self.cwd = cmd, cwd                                   # ...
+        self.priority = priority                                        # ...
+        self.status = QUEUED                                            # Current state
+        self.rc = None                                                  # Return code once finished
+        self.process = None                                             # Popen object while running
+        self.submitted, self.started, self.finished = time(), None, None
+
+    def describe( self ):
+        '''
+        Status of the job as a dictionary (published over MQTT)
+        '''
+
+        return( { "id"       : self.id,
+                  "status"   : self.status,
+                  "priority" : self.priority,
+                  "rc"       : self.rc,
+                  "submitted": self.submitted,
+                  "started"  : self.started,
+                  "finished" : self.finished } )
+
+# ------------------------------------------------------------------------
+
+class ReconJobQueue( object ):
+    '''
+    Bounded priority queue of ReconJobs run by a fixed pool of
+    workers, each running one job's process at a time
+    '''
+
+    def __init__( self, workers=1, max_jobs=8, on_status=None ):
+        '''
+        Initialize class
+
+        INPUTS:
+            - workers  : Max number of jobs running at once
+            - max_jobs : Max number of jobs waiting to run
+            - on_status: Called with ReconJob.describe() on every status change
+        '''
+
+        self.max_jobs = max( 1, max_jobs )                              # Queue bound
+        self.on_status = on_status                                      # Status callback
+        self.jobs = {}                                                  # Job id -> queued/running ReconJob
+        self.heap = []                                                  # (-priority, order, job id)
+        self.order = itertools.count()                                  # FIFO among equal priorities
+        self.waiting = 0                                                # Number of queued jobs
+        self.cond = Condition()                                         # Guard all of the above
+
+        for i in range( max(1, workers) ):                              # Start bounded pool of job runners
+            t = Thread( target=self.worker, args=() )                   # ...
+            t.daemon = True                                             # ...
+            t.start()                                                   # ...
+
+    def report( self, job ):
+        if( self.on_status is not None ): self.on_status( job.describe() )
+
+    def submit( self, job_id, cmd, priority=0, cwd=None, block=True, timeout=None ):
+        '''
+        Queue a job, waiting for room if the queue is full
+
+        INPUTS:
+            - job_id  : Unique name of the job
+            - cmd     : Command to run, as a list of arguments
+            - priority: Higher runs first
+            - cwd     : Working directory of the command
+            - block   : Wait for room instead of raising Full at once
+            - timeout : Max seconds to wait for room (None == forever)
+
+        OUTPUT:
+            - job: The queued ReconJob
+        '''
+
+        with self.cond:
+            deadline = None if timeout is None else time() + timeout    # Wait for room
+            while( self.waiting >= self.max_jobs ):                     # ...
+                left = None if deadline is None else deadline - time()  # ...
+                if( not block or (left is not None and left <= 0) ):    # ...
+                    raise Full                                          # ...
+                self.cond.wait( left )                                  # ...
+
+            job = ReconJob( job_id, cmd, priority, cwd )                # Queue job
+            self.jobs[ job_id ] = job                                   # ...
+            heapq.heappush( self.heap, (-priority, next(self.order), job_id) )
+            self.waiting += 1                                           # ...
+            self.cond.notify_all()                                      # Wake a runner
+
+        self.report( job )                                              # Queued
+        return( job )
+
+    def prioritize( self, job_id, priority ):
+        '''
+        Change the priority of a queued job
+
+        OUTPUT:
+            - ok: False if the job is not waiting in the queue
+        '''
+
+        with self.cond:
+            job = self.jobs.get( job_id )
+            if( job is None or job.status != QUEUED ): return( False )
+            job.priority = priority                                     # Old heap entry goes stale
+            heapq.heappush( self.heap, (-priority, next(self.order), job_id) )
+
+        self.report( job )
+        return( True )
+
+    def cancel( self, job_id ):
+        '''
+        Cancel a queued job, or terminate a running one
+
+        OUTPUT:
+            - ok: False if there is no such queued/running job
+        '''
+
+        with self.cond:
+            job = self.jobs.get( job_id )
+            if( job is None ): return( False )
+            queued = ( job.status == QUEUED )                           # ...
+            job.status = CANCELLED                                      # ...
+
+            if( queued ):                                               # Never started, drop it now
+                self.waiting -= 1                                       # ...
+                job.finished = time()                                   # ...
+                del self.jobs[ job_id ]                                 # ...
+                self.cond.notify_all()                                  # Room for another job
+            elif( job.process is not None ):                            # Running, kill its process tree; the
+                kill_tree( job.process )                                # ...runner reports it once it exits
+
+        if( queued ): self.report( job )
+        return( True )
+
+    def next_job( self ):
+        '''
+        Pop the highest priority queued job (call with cond held)
+        '''
+
+        while( len(self.heap) > 0 ):
+            neg, _, job_id = heapq.heappop( self.heap )
+            job = self.jobs.get( job_id )
+            if( job is not None and job.status == QUEUED and -neg == job.priority ):
+                return( job )                                           # Skip cancelled/reprioritized entries
+        return( None )
+
+    def worker( self ):
+        '''
+        Run queued jobs one process at a time
+        '''
+
+        while( True ):
+            with self.cond:
+                job = self.next_job()                                   # Block until a job is queued
+                while( job is None ):                                   # ...
+                    self.cond.wait()                                    # ...
+                    job = self.next_job()                               # ...
+
+                self.waiting -= 1                                       # Job leaves the queue
+                job.status, job.started = RUNNING, time()               # ...
+                try   : job.process = start_group( job.cmd, job.cwd )   # Start it while holding the lock so a
+                except OSError: job.process = None                      # ...cancel always sees the process
+                self.cond.notify_all()                                  # Room for another job
+
+            self.report( job )                                          # Running
+            rc = job.process.wait() if job.process is not None else -1  # Wait for it to finish
+
+            with self.cond:                                             # Record outcome
+                job.rc, job.finished, job.process = rc, time(), None    # ...
+                if( job.status == RUNNING ):                            # ...unless it was cancelled
+                    job.status = DONE if rc == 0 else FAILED            # ...
+                del self.jobs[ job.id ]                                 # ...
+            self.report( job )                                          # Done/failed/cancelled
@@ -0,0 +1,643 @@
+'''
+*
+* Partitioned reconstruction of large scans.
+*
+* Pairwise matching grows with the square of the number of images,
+* so a large scan is split into overlapping clusters of frames
+* that are next to each other, ordered by one of:
+*
+*   - "order"     : capture time
+*   - "angle"     : turntable angle (the last cluster wraps around
+*                   to overlap the first)
+*   - "similarity": difference hash of each frame's preview (or the
+*                   frame itself), chaining every frame to its most
+*                   similar successor
+*
+* Each cluster gets its own folder of hard-linked frames, with
+* private copies of the per-image artifacts next to them and of the
+* match files of pairs within the cluster (all the pair stage
+* matches when it plans clusters the same way); clusters run side
+* by side and share overlap frames, so anything the tool may update
+* in place must not share an inode. The reconstruction command
+* runs on each cluster as its own process, as many at once as there
+* are cores. Every cluster writes a partial model in VisualSFM's NVM
+* format; the partial models are merged by the cameras they share:
+* the similarity transform (scale, rotation, translation) that best
+* maps a cluster's shared camera centres onto the merged model's
+* (Horn's closed-form solution) brings the whole cluster into the
+* merged model's frame.
+*
+* Points seen by the overlap frames appear once per cluster in the
+* merged model; a later bundle adjustment or the dense stage fuses
+* them.
+*
+* Runs standalone on a scan folder, which is how the client runs
+* it in place of the monolithic reconstruction command:
+*
+*   python recon_partition.py <scan> --size 40 --overlap 8 --by angle -- main.bat {scan} {model}
+*
+* The clusters run in the driver's process group, so cancelling a
+* job through ReconJobQueue kills them with it on every platform;
+* terminating the driver alone (SIGTERM, or Ctrl+Break on Windows)
+* stops them too.
+*
+'''
+
+# Import modules
+from    threading                   import  Thread, Lock                # Run clusters side by side
+from    subprocess                  import  Popen                       # Reconstruct each cluster
+from    time                        import  time                        # Time clusters
+from    image_cache                 import  link_or_copy, copy_over     # Populate cluster folders
+from    recon_pipeline              import  MATCH_DIR                   # ...with the pair stage's matches
+import  scan_manifest                                                   # Frames of a landed scan
+import  preview_tier                                                    # Where each frame's preview is
+import  frame_quality                                                   # Frame hashes for similarity order
+import  multiprocessing                                                 # Number of cores
+import  argparse                                                        # Command line parameters
+import  signal                                                          # Stop clusters when cancelled
+import  shutil                                                          # Clear out old clusters
+import  math                                                            # Alignment
+import  os                                                              # Paths
+import  sys                                                             # Interpreter path & exit code
+
+try:    from Queue                  import  Queue, Empty                # Clusters waiting to run (Python 2)
+except: from queue                  import  Queue, Empty                # ... (Python 3)
+
+ORDER, ANGLE, SIMILARITY = ( "order", "angle", "similarity" )           # Ways of ordering frames into clusters
+MODEL_FILE = "model.nvm"                                                # Model each reconstruction writes
+CLUSTER_DIR = "clusters"                                                # Sub-folder of a scan holding its clusters
+MIN_SHARED = 3                                                          # Shared cameras needed to align a cluster
+
+# ************************************************************************
+# =========================> DEFINE  FUNCTIONS <==========================
+# ************************************************************************
+def order_frames( frames, by=ORDER, scan_dir=None ):
+    '''
+    Put a scan's frames in the order clusters are cut from
+
+    INPUTS:
+        - frames  : Frame entries ("name", and "t"/"angle" when known)
+        - by      : ORDER, ANGLE or SIMILARITY
+        - scan_dir: Folder holding the frames and their previews (SIMILARITY only)
+
+    OUTPUTS:
+        - names: Frame names in order
+        - wrap : True if the last frame neighbours the first (full turn)
+    '''
+
+    frames = sorted( frames, key=lambda e: (e.get("t", 0.0), e["name"]) )
+
+    if( by == ANGLE and len(frames) > 0 and all("angle" in e for e in frames) ):
+        frames.sort( key=lambda e: e["angle"] % 360.0 )                 # Stable, so capture order breaks ties
+        return( [ e["name"] for e in frames ], True )
+
+    if( by == SIMILARITY and scan_dir is not None and frame_quality.available() ):
+        return( similarity_order([ e["name"] for e in frames ], scan_dir), False )
+
+    return( [ e["name"] for e in frames ], False )                      # Capture order (also the fallback)
+
+# ------------------------------------------------------------------------
+
+def similarity_order( names, scan_dir ):
+    '''
+    Chain frames by similarity: start from the first frame taken,
+    then repeatedly step to the most similar frame not yet in the
+    chain (ties go to the earliest). Frames that cannot be hashed
+    keep their place at the end, in capture order.
+    '''
+
+    np = frame_quality.np
+    hashed, hashes, rest = [], [], []
+    for name in names:
+        path = os.path.join( scan_dir, preview_tier.preview_name(name) )# Previews are small and decode fast
+        if( not os.path.isfile(path) ): path = os.path.join( scan_dir, name )
+        try:
+            with open( path, 'rb' ) as f:
+                metrics = frame_quality.measure( f.read(), (160, 120) )
+        except( IOError, OSError, ValueError ):                         # Missing or undecodable
+            metrics = None                                              # ...
+        if( metrics is None ): rest.append( name )
+        else                 : hashed.append( name ); hashes.append( metrics["hash"] )
+
+    if( len(hashed) == 0 ): return( rest )
+
+    bits = np.array( hashes )                                           # One row of 64 bits per frame
+    left = np.ones( len(hashed), dtype=bool )                           # Frames not yet in the chain
+    chain, i = [], 0                                                    # ...
+    while( True ):
+        chain.append( hashed[i] )                                       # ...
+        left[ i ] = False                                               # ...
+        if( not left.any() ): break                                     # ...
+        dist = np.count_nonzero( bits != bits[i], axis=1 )              # Distance to every frame at once
+        dist[ ~left ] = bits.shape[1] + 1                               # ...never step back
+        i = int( np.argmin(dist) )                                      # ...
+    return( chain + rest )
+
+# ------------------------------------------------------------------------
+
+def partition( names, size, overlap, wrap=False ):
+    '''
+    Cut ordered frames into clusters of (up to) size frames, each
+    sharing overlap frames with the next
+
+    INPUTS:
+        - names  : Frame names, neighbours next to each other
+        - size   : Frames per cluster
+        - overlap: Frames shared by neighbouring clusters (< size)
+        - wrap   : Also overlap the last cluster with the first
+
+    OUTPUT:
+        - clusters: List of lists of frame names
+    '''
+
+    if( overlap < 0 or overlap >= size ):
+        raise ValueError( "Overlap must be at least 0 and less than the cluster size" )
+
+    n, step = len( names ), size - overlap
+    if( n <= size ): return( [ list(names) ] )                          # Small enough to run as is
+
+    if( wrap ):                                                         # Round the turn and back to the start
+        count = int( math.ceil( float(n) / step ) )                     # ...in evenly spaced clusters
+        starts = [ int( round(i * float(n) / count) ) for i in range(count) ]
+        return( [ [ names[(s + j) % n] for j in range(size) ] for s in starts ] )
+
+    count = int( math.ceil( float(n - overlap) / step ) )               # Evenly spaced, from the first frame
+    starts = [ int( round(i * float(n - size) / (count - 1)) ) for i in range(count) ]
+    return( [ names[s:s+size] for s in starts ] )                       # ...to the last
+
+# ------------------------------------------------------------------------
+
+def read_nvm( path ):
+    '''
+    Read the first model of an NVM file
+
+    OUTPUTS:
+        - cameras: List of [name, focal, quaternion (w, x, y, z), centre, radial]
+        - points : List of [xyz, rgb, measurements], each measurement being
+                   [camera index, feature index, x, y]
+    '''
+
+    with open( path ) as f:
+        lines = [ line.strip() for line in f ]
+    lines = [ line for line in lines[1:] if line and not line.startswith('#') ]
+
+    ncams = int( lines[0] )                                             # One camera per line; names may hold
+    cameras = []                                                        # ...spaces, so parse from the right
+    for line in lines[1:ncams+1]:                                       # ...
+        tokens = line.split()                                           # ...
+        values = [ float(v) for v in tokens[-10:] ]                     # ...
+        cameras.append( [ " ".join(tokens[:-10]), values[0], tuple(values[1:5]),
+                          tuple(values[5:8]), values[8] ] )
+
+    tokens = " ".join( lines[ncams+1:] ).split()                        # Points may wrap, read as tokens
+    npoints = int( tokens[0] ) if len(tokens) > 0 else 0                # ...
+    points, k = [], 1                                                   # ...
+    for i in range( npoints ):                                          # ...
+        xyz = tuple( float(v) for v in tokens[k:k+3] )                  # ...
+        rgb = tuple( int(v) for v in tokens[k+3:k+6] )                  # ...
+        nmeas, k = int( tokens[k+6] ), k + 7                            # ...
+        meas = [ [int(tokens[j]), int(tokens[j+1]), float(tokens[j+2]), float(tokens[j+3])]
+                 for j in range(k, k + 4*nmeas, 4) ]                    # ...
+        k += 4*nmeas                                                    # ...
+        points.append( [xyz, rgb, meas] )                               # ...
+    return( cameras, points )
+
+# ------------------------------------------------------------------------
+
+def write_nvm( path, cameras, points ):
+    '''
+    Write a model as an NVM file (see read_nvm() for the layout)
+    '''
+
+    with open( path, 'w' ) as f:
+        f.write( "NVM_V3\n\n{}\n".format(len(cameras)) )
+        for name, focal, q, c, radial in cameras:
+            f.write( "{} {!r} {!r} {!r} {!r} {!r} {!r} {!r} {!r} {!r} 0\n".format(
+                     name, focal, q[0], q[1], q[2], q[3], c[0], c[1], c[2], radial) )
+        f.write( "\n{}\n".format(len(points)) )
+        for xyz, rgb, meas in points:
+            f.write( "{!r} {!r} {!r} {} {} {} {}".format(xyz[0], xyz[1], xyz[2],
+                                                         rgb[0], rgb[1], rgb[2], len(meas)) )
+            for cam, feature, x, y in meas:
+                f.write( " {} {} {!r} {!r}".format(cam, feature, x, y) )
+            f.write( "\n" )
+        f.write( "\n0\n" )                                              # No further models
+
+# ------------------------------------------------------------------------
+
+def qmul( a, b ):
+    '''
+    Product of two quaternions (w, x, y, z)
+    '''
+
+    return( ( a[0]*b[0] - a[1]*b[1] - a[2]*b[2] - a[3]*b[3],
+              a[0]*b[1] + a[1]*b[0] + a[2]*b[3] - a[3]*b[2],
+              a[0]*b[2] - a[1]*b[3] + a[2]*b[0] + a[3]*b[1],
+              a[0]*b[3] + a[1]*b[2] - a[2]*b[1] + a[3]*b[0] ) )
+
+# ------------------------------------------------------------------------
+
+def qrot( q, v ):
+    '''
+    Rotate a vector by a unit quaternion (w, x, y, z)
+    '''
+
+    w, x, y, z = q
+    return( ( (1 - 2*(y*y + z*z))*v[0] + 2*(x*y - w*z)*v[1] + 2*(x*z + w*y)*v[2],
+              2*(x*y + w*z)*v[0] + (1 - 2*(x*x + z*z))*v[1] + 2*(y*z - w*x)*v[2],
+              2*(x*z - w*y)*v[0] + 2*(y*z + w*x)*v[1] + (1 - 2*(x*x + y*y))*v[2] ) )
+
+# ------------------------------------------------------------------------
+
+def max_eigenvector( a ):
+    '''
+    Eigenvector of the largest eigenvalue of a small symmetric
+    matrix, by cyclic Jacobi rotations
+    '''
+
+    n = len( a )
+    a = [ list(row) for row in a ]                                      # Work on a copy
+    v = [ [ float(i == j) for j in range(n) ] for i in range(n) ]       # Accumulated rotations
+
+    for sweep in range( 50 ):
+        off = sum( a[p][q]**2 for p in range(n) for q in range(p+1, n) )
+        if( off < 1e-24 * (1.0 + sum(a[i][i]**2 for i in range(n))) ): break
+
+        for p in range( n ):
+            for q in range( p+1, n ):
+                if( a[p][q] == 0.0 ): continue
+                theta = ( a[q][q] - a[p][p] ) / ( 2.0*a[p][q] )         # Rotation zeroing a[p][q]
+                t = ( 1.0 if theta >= 0 else -1.0 ) / ( abs(theta) + math.sqrt(theta*theta + 1.0) )
+                c = 1.0 / math.sqrt( t*t + 1.0 ); s = t*c               # ...
+                for k in range( n ):                                    # A <- A J
+                    akp, akq = a[k][p], a[k][q]                         # ...
+                    a[k][p], a[k][q] = c*akp - s*akq, s*akp + c*akq     # ...
+                for k in range( n ):                                    # A <- J^T A
+                    apk, aqk = a[p][k], a[q][k]                         # ...
+                    a[p][k], a[q][k] = c*apk - s*aqk, s*apk + c*aqk     # ...
+                for k in range( n ):                                    # V <- V J
+                    vkp, vkq = v[k][p], v[k][q]                         # ...
+                    v[k][p], v[k][q] = c*vkp - s*vkq, s*vkp + c*vkq     # ...
+
+    i = max( range(n), key=lambda i: a[i][i] )
+    return( [ v[k][i] for k in range(n) ] )
+
+# ------------------------------------------------------------------------
+
+def align( src, dst ):
+    '''
+    Similarity transform best mapping one set of points onto
+    another in the least-squares sense (Horn, 1987)
+
+    INPUTS:
+        - src: List of (x, y, z)
+        - dst: List of (x, y, z), same length and order (at least 3)
+
+    OUTPUTS:
+        - s  : Scale
+        - q  : Rotation as a unit quaternion (w, x, y, z)
+        - t  : Translation; a point p maps to s*qrot(q, p) + t
+        - rms: Root mean square distance left between the mapped src and dst
+    '''
+
+    n = float( len(src) )
+    ca = [ sum(p[i] for p in src) / n for i in range(3) ]               # Centroids
+    cb = [ sum(p[i] for p in dst) / n for i in range(3) ]               # ...
+    a = [ [p[i] - ca[i] for i in range(3)] for p in src ]               # Centred points
+    b = [ [p[i] - cb[i] for i in range(3)] for p in dst ]               # ...
+
+    S = [ [ sum(u[i]*w[j] for u, w in zip(a, b)) for j in range(3) ] for i in range(3) ]
+    (sxx, sxy, sxz), (syx, syy, syz), (szx, szy, szz) = S
+    N = [ [ sxx + syy + szz, syz - szy,        szx - sxz,        sxy - syx       ],
+          [ syz - szy,       sxx - syy - szz,  sxy + syx,        szx + sxz       ],
+          [ szx - sxz,       sxy + syx,       -sxx + syy - szz,  syz + szy       ],
+          [ sxy - syx,       szx + sxz,        syz + szy,       -sxx - syy + szz ] ]
+    q = max_eigenvector( N )                                            # Optimal rotation
+    norm = math.sqrt( sum(v*v for v in q) )                             # ...
+    q = tuple( v / norm for v in q )                                    # ...
+
+    spread_a = sum( v*v for p in a for v in p )                         # Scale from the spread of each set
+    spread_b = sum( v*v for p in b for v in p )                         # ...
+    s = math.sqrt( spread_b / spread_a ) if spread_a > 0 else 1.0       # ...
+    r = qrot( q, ca )                                                   # ...
+    t = tuple( cb[i] - s*r[i] for i in range(3) )                       # ...
+
+    err = 0.0
+    for p, d in zip( src, dst ):
+        m = qrot( q, p )
+        err += sum( (s*m[i] + t[i] - d[i])**2 for i in range(3) )
+    return( s, q, t, math.sqrt(err / n) )
+
+# ------------------------------------------------------------------------
+
+def transform_model( cameras, points, s, q, t ):
+    '''
+    Move a model into another frame: points and camera centres map
+    to s*R*p + t, and each camera's rotation is composed with R^T
+    '''
+
+    qc = ( q[0], -q[1], -q[2], -q[3] )                                  # R^T
+    move = lambda p: tuple( s*v + t[i] for i, v in enumerate(qrot(q, p)) )
+    cameras = [ [name, focal, qmul(qcam, qc), move(c), radial]
+                for name, focal, qcam, c, radial in cameras ]
+    points = [ [move(xyz), rgb, meas] for xyz, rgb, meas in points ]
+    return( cameras, points )
+
+# ------------------------------------------------------------------------
+
+def merge_models( models ):
+    '''
+    Merge partial models by the cameras they share. The first model
+    sets the frame; every other model is aligned on the cameras it
+    shares with what has been merged so far, as soon as it shares
+    at least MIN_SHARED of them.
+
+    INPUT:
+        - models: List of (cameras, points) as returned by read_nvm();
+                  cameras are matched by the base name of their image
+
+    OUTPUTS:
+        - cameras: Merged cameras, named by image base name
+        - points : Merged points
+        - report : Per model: None if it could not be aligned, otherwise
+                   { "shared": N, "scale": s, "rms": error }
+    '''
+
+    report = [ None ] * len( models )
+    if( len(models) == 0 ): return( [], [], report )
+
+    cameras, points, index = [], [], {}                                 # Merged model, image -> camera index
+    pending = list( range(len(models)) )                                # ...
+
+    while( len(pending) > 0 ):
+        progress = False
+        for m in list( pending ):
+            cams, pts = models[ m ]
+            names = [ os.path.basename(c[0].replace('\\', '/')) for c in cams ]
+            shared = [ i for i, name in enumerate(names) if name in index ]
+
+            if( len(cameras) == 0 ):                                    # First model sets the frame
+                report[ m ] = { "shared": 0, "scale": 1.0, "rms": 0.0 } # ...
+            elif( len(shared) >= MIN_SHARED ):                          # Align on the shared centres
+                s, q, t, rms = align( [ cams[i][3] for i in shared ],   # ...
+                                      [ cameras[index[names[i]]][3] for i in shared ] )
+                cams, pts = transform_model( cams, pts, s, q, t )       # ...
+                report[ m ] = { "shared": len(shared), "scale": s, "rms": rms }
+            else:
+                continue                                                # Try again once more is merged
+
+            remap = {}                                                  # Cluster camera -> merged camera
+            for i, name in enumerate( names ):                          # Shared cameras keep the pose
+                if( name not in index ):                                # ...already merged
+                    index[ name ] = len( cameras )                      # ...
+                    cameras.append( [name] + list(cams[i][1:]) )        # ...
+                remap[ i ] = index[ name ]                              # ...
+            for xyz, rgb, meas in pts:                                  # Points, re-indexed
+                points.append( [xyz, rgb, [ [remap[c], f, x, y] for c, f, x, y in meas ]] )
+
+            pending.remove( m )
+            progress = True
+        if( not progress ): break                                       # Left over models share too little
+
+    return( cameras, points, report )
+
+# ------------------------------------------------------------------------
+
+def partition_command( cmd, scan_dir, size, overlap=8, by=ORDER, workers=None, model=MODEL_FILE ):
+    '''
+    Command running a reconstruction command partitioned over a
+    scan, in place of running it on the whole scan
+
+    INPUTS:
+        - cmd     : Reconstruction command template; "{scan}" is replaced by
+                    each cluster's folder and "{model}" by the model it writes
+        - scan_dir: Folder of the scan
+        - size    : Frames per cluster
+        - overlap : Frames shared by neighbouring clusters
+        - by      : ORDER, ANGLE or SIMILARITY
+        - workers : Max clusters reconstructing at once (None == one per core)
+        - model   : File name of the model each cluster (and the merge) writes
+
+    OUTPUT:
+        - cmd: Command, as a list of arguments
+    '''
+
+    here = os.path.abspath( __file__ )                                  # Run this module's __main__
+    if( here.endswith((".pyc", ".pyo")) ): here = here[:-1]             # ...not its byte code
+    out = [ sys.executable, here, scan_dir, "--size", str(size), "--overlap", str(overlap),
+            "--by", by, "--model", model ]
+    if( workers is not None ): out += [ "--workers", str(workers) ]
+    return( out + [ "--" ] + list(cmd) )
+
+# ************************************************************************
+# ============================> DEFINE CLASS <============================
+# ************************************************************************
+class PartitionedRecon( object ):
+    '''
+    Reconstructs a scan cluster by cluster, one process per
+    cluster, and merges the partial models
+    '''
+
+    def __init__( self, cmd, size=40, overlap=8, by=ORDER, workers=None, model=MODEL_FILE ):
+        '''
+        Initialize class
+
+        INPUTS:
+            - cmd    : Reconstruction command template; "{scan}" is replaced by
+                       a cluster's folder and "{model}" by the model it writes
+            - size   : Frames per cluster
+            - overlap: Frames shared by neighbouring clusters; at least
+                       MIN_SHARED of them must be reconstructed for a
+                       cluster to be merged
+            - by     : ORDER, ANGLE or SIMILARITY
+            - workers: Max clusters reconstructing at once (None == one per core)
+            - model  : File name of the model each cluster (and the merge) writes
+        '''
+
+        if( overlap < MIN_SHARED ):
+            raise ValueError( "Clusters must overlap by at least {} frames".format(MIN_SHARED) )
+
+        self.cmd = cmd                                                  # ...
+        self.size, self.overlap, self.by = size, overlap, by            # ...
+        self.workers = workers or multiprocessing.cpu_count()           # ...
+        self.model = model                                              # ...
+
+        self.lock = Lock()                                              # Guard everything below
+        self.processes = set()                                          # Running cluster reconstructions
+        self.stopped = False                                            # Set by stop()
+
+    def frames( self, scan_dir ):
+        '''
+        Frames of a scan: from the frame record the client writes
+        when there is one, otherwise every image in the folder, in
+        name order
+        '''
+
+        path = os.path.join( scan_dir, scan_manifest.FRAMES_FILE )
+        if( os.path.isfile(path) ):
+            return( [ e for e in scan_manifest.load_frames(path)        # ...
+                      if os.path.isfile(os.path.join(scan_dir, e["name"])) ] )
+        return( [ {"name": name} for name in sorted(os.listdir(scan_dir))
+                  if name.lower().endswith((".jpg", ".jpeg", ".png")) ] )
+
+    def plan( self, scan_dir ):
+        '''
+        Clusters a scan is reconstructed in
+
+        OUTPUT:
+            - clusters: Lists of frame names (a single cluster of every
+                        frame for scans too small to partition)
+        '''
+
+        names, wrap = order_frames( self.frames(scan_dir), self.by, scan_dir )
+        return( partition(names, self.size, self.overlap, wrap) )
+
+    def fill( self, cluster_dir ):
+        return( [ arg.replace("{scan}", cluster_dir).replace("{model}", os.path.join(cluster_dir, self.model))
+                  for arg in self.cmd ] )
+
+    def populate( self, scan_dir, cluster_dir, names ):
+        '''
+        Link a cluster's frames into its folder, and copy every file
+        sharing their stem (features written by the per-image stage,
+        ...) and the match files of pairs of them: the tool may update
+        those in place, which through a link would reach the scan
+        folder and every other cluster holding the frame
+        '''
+
+        if( not os.path.isdir(cluster_dir) ): os.makedirs( cluster_dir )
+        stems = set( os.path.splitext(name)[0] for name in names )
+        frames = set( names )                                           # Read-only, safe to link
+        for name in os.listdir( scan_dir ):
+            src = os.path.join( scan_dir, name )
+            if( os.path.splitext(name)[0] in stems and os.path.isfile(src) ):
+                place = link_or_copy if name in frames else copy_over   # ...
+                place( src, os.path.join(cluster_dir, name) )           # ...
+
+        matches = os.path.join( scan_dir, MATCH_DIR )                   # Match files are named "<a>__<b>.txt"
+        if( not os.path.isdir(matches) ): return                        # ...
+        found = set( os.listdir(matches) )                              # ...
+        wanted = [ "{}__{}.txt".format(a, b) for a in stems for b in stems if a != b ]
+        wanted = [ name for name in wanted if name in found ]           # ...
+        if( len(wanted) > 0 ): os.makedirs( os.path.join(cluster_dir, MATCH_DIR) )
+        for name in wanted:                                             # ...
+            copy_over( os.path.join(matches, name), os.path.join(cluster_dir, MATCH_DIR, name) )
+
+    def worker( self, todo, results ):
+        '''
+        Reconstruct queued clusters, one process at a time
+        '''
+
+        while( True ):
+            try   : i, cluster_dir = todo.get_nowait()                  # Next cluster, until none are left
+            except Empty: return                                        # ...
+
+            start = time()
+            with self.lock:                                             # Start it while holding the lock so a
+                if( self.stopped ): return                              # ...stop() always sees the process
+                try   : p = Popen( self.fill(cluster_dir) )             # ...
+                except OSError: p = None                                # ...
+                if( p is not None ): self.processes.add( p )            # ...
+            rc = p.wait() if p is not None else -1                      # ...
+            with self.lock:                                             # ...
+                self.processes.discard( p )                             # ...
+            results[ i ] = ( rc, time() - start )
+
+    def run( self, scan_dir ):
+        '''
+        Reconstruct a scan
+
+        INPUT:
+            - scan_dir: Folder of the scan; the merged model is written to it
+
+        OUTPUT:
+            - rc: 0 if every cluster was reconstructed and merged
+        '''
+
+        clusters = self.plan( scan_dir )
+        names = set( name for cluster in clusters for name in cluster )
+        if( len(clusters) == 1 ):                                       # Small scan, reconstruct as a whole
+            print( "Reconstructing {} frames in one piece".format(len(names)) )
+            todo, results = Queue(), {}                                 # ...
+            todo.put( (0, scan_dir) )                                   # ...
+            self.worker( todo, results )                                # ...
+            return( results.get(0, (-1, 0.0))[0] )                      # ...
+
+        print( "Reconstructing {} frames as {} clusters of {} ({} shared, by {}) on {} workers".format(
+               len(names), len(clusters), self.size, self.overlap, self.by, self.workers) )
+
+        shutil.rmtree( os.path.join(scan_dir, CLUSTER_DIR),             # Clusters of an earlier run are stale
+                       ignore_errors=True )                             # ...
+        todo, results, dirs = Queue(), {}, []                           # Lay clusters out side by side
+        for i, cluster in enumerate( clusters ):                        # ...
+            cluster_dir = os.path.join( scan_dir, CLUSTER_DIR, "c{:03d}".format(i) )
+            self.populate( scan_dir, cluster_dir, cluster )             # ...
+            dirs.append( cluster_dir )                                  # ...
+            todo.put( (i, cluster_dir) )                                # ...
+
+        start = time()                                                  # Bounded pool, one process per cluster
+        runners = [ Thread(target=self.worker, args=(todo, results))    # ...
+                    for i in range( min(self.workers, len(clusters)) ) ]
+        for t in runners: t.start()                                     # ...
+        for t in runners: t.join()                                      # ...
+        print( "Clusters reconstructed in {:.1f}s ({:.1f}s of work)".format(
+               time() - start, sum(r[1] for r in results.values())) )
+
+        models, which = [], []                                          # Partial models that came out
+        for i, cluster_dir in enumerate( dirs ):                        # ...
+            path = os.path.join( cluster_dir, self.model )              # ...
+            rc = results.get( i, (-1, 0.0) )[0]                         # ...
+            try:                                                        # ...
+                if( rc == 0 ): models.append( read_nvm(path) ); which.append( i )
+            except( IOError, OSError, ValueError, IndexError ):         # Missing or malformed
+                rc = -1                                                 # ...
+            if( rc != 0 ): print( "  Cluster {} failed".format(i) )     # ...
+
+        cameras, points, report = merge_models( models )                # ...
+        write_nvm( os.path.join(scan_dir, self.model), cameras, points )# ...
+        for i, r in zip( which, report ):                               # [INFO] ...
+            if( r is None ): print( "  Cluster {} shares too few cameras to merge".format(i) )
+            else           : print( "  Cluster {}: {} shared cameras, scale {:.3g}, rms {:.3g}".format(
+                                    i, r["shared"], r["scale"], r["rms"]) )
+        print( "Merged model: {} cameras, {} points".format(len(cameras), len(points)) )
+
+        merged = sum( 1 for r in report if r is not None )
+        return( 0 if merged == len(clusters) else 1 )
+
+    def stop( self ):
+        '''
+        Start no more clusters and terminate the running ones
+        '''
+
+        with self.lock:
+            self.stopped = True
+            for p in self.processes:
+                try   : p.terminate()
+                except OSError: pass
+
+# ************************************************************************
+# ===========================> SETUP  PROGRAM <===========================
+# ************************************************************************
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser( description="Partitioned reconstruction of a scan",
+                                 usage="%(prog)s [options] scan -- CMD ..." )
+    p.add_argument( "scan",                                             help="Folder of the scan" )
+    p.add_argument( "--size",       type=int,   default=40,             help="Frames per cluster" )
+    p.add_argument( "--overlap",    type=int,   default=8,              help="Frames shared by neighbouring clusters" )
+    p.add_argument( "--by",         choices=(ORDER, ANGLE, SIMILARITY), default=ORDER, help="How frames are ordered into clusters" )
+    p.add_argument( "--workers",    type=int,   default=None,           help="Clusters reconstructing at once (default: one per core)" )
+    p.add_argument( "--model",      default=MODEL_FILE,                 help="File name of the model each cluster writes" )
+    argv = sys.argv[1:]                                                 # Reconstruction command follows "--",
+    split = argv.index( "--" ) if "--" in argv else len( argv )         # ...with "{scan}" and "{model}" in it
+    args, cmd = p.parse_args( argv[:split] ), argv[split+1:]            # ...
+    if( len(cmd) == 0 ): p.error( "No reconstruction command given" )   # ...
+
+    recon = PartitionedRecon( cmd, args.size, args.overlap, args.by, args.workers, args.model )
+    def terminate( signum, frame ):                                     # Driver stopped: take the clusters down too
+        recon.stop()                                                    # ...
+        sys.exit( 1 )                                                   # ...
+    signal.signal( signal.SIGTERM, terminate )                          # ...
+    if( hasattr(signal, "SIGBREAK") ):                                  # ...Windows: Ctrl+Break
+        signal.signal( signal.SIGBREAK, terminate )                     # ...
+    sys.exit( recon.run(os.path.abspath(args.scan)) )
@@ -0,0 +1,302 @@
+'''
+*
+* Incremental reconstruction pipeline used by the client.
+*
+* Per-image stages (decode, feature extraction, ...) run as an
+* external command on each image the moment it lands, bounded
+* to a fixed number of concurrent processes. Only the global
+* stages (matching, bundle adjustment, dense reconstruction)
+* wait for the end of the scan.
+*
+* With an ArtifactCache, the files the per-image command writes
+* next to each image (e.g. VisualSFM's .sift) are cached by image
+* content and command, and restored instead of recomputed. An
+* optional per-pair command matching two images at a time runs
+* over every pair before the global stages, cached the same way,
+* so only new pairs are matched. When the scan is reconstructed in
+* clusters, only pairs of images sharing a cluster are matched.
+*
+'''
+
+# Import modules
+from    threading                   import  Thread, Lock                # Launch stage processes off the caller's thread
+from    subprocess                  import  Popen                       # Run external stage commands
+from    time                        import  time                        # Time each stage
+from    artifact_cache              import  artifact_key                # Key cached features & matches
+from    scan_manifest               import  file_digest                 # Content of images without a checksum
+import  os                                                              # Artifact paths
+
+try:    from Queue                  import  Queue, Empty                # Queue of images awaiting processing (Python 2)
+except: from queue                  import  Queue, Empty                # ... (Python 3)
+
+MATCH_DIR = "matches"                                                   # Sub-folder of the images holding match files
+
+# ************************************************************************
+# ============================> DEFINE CLASS <============================
+# ************************************************************************
+class ReconPipeline( object ):
+    '''
+    Two-stage reconstruction pipeline.
+
+    The per-image command is a list of arguments in which "{image}"
+    is replaced by the image's path, e.g.
+        [ "VisualSFM", "siftgpu", "{image}" ]
+    The final command runs once all per-image stages are done.
+
+    The per-pair command has "{a}", "{b}" and "{out}" replaced by
+    the two images and the match file it should write, e.g.
+        [ "matcher", "{a}", "{b}", "{out}" ]
+    '''
+
+    def __init__( self, image_cmd=None, final_cmd=None, workers=2, tracer=None,
+                  cache=None, artifacts=(".sift",), pair_cmd=None, params=None,
+                  clusters=None ):
+        '''
+        Initialize class
+
+        INPUTS:
+            - image_cmd: Per-image command template (None == no per-image stage)
+            - final_cmd: Command running the global stages
+            - workers  : Max number of per-image processes running at once
+            - tracer   : scan_metrics.Tracer timing each image's stages (None == off)
+            - cache    : ArtifactCache for features & matches (None == no caching)
+            - artifacts: Extensions of the files image_cmd writes next to each image
+            - pair_cmd : Per-pair match command template (None == no pair stage)
+            - params   : Anything else the artifacts depend on (tool version,
+                         settings files, ...), as part of the cache key
+            - clusters : Called before the pair stage for the clusters the scan is
+                         reconstructed in, as lists of image names; only pairs
+                         within a cluster are matched (None == every pair)
+        '''
+
+        self.image_cmd = image_cmd                                      # Per-image stage
+        self.final_cmd = final_cmd                                      # Global stages
+        self.queue = Queue()                                            # Images waiting for the per-image stage
+        self.lock = Lock()                                              # Guard results
+        self.done, self.failed = [], []                                 # Images processed / failed
+        self.stage_time = 0.0                                           # Total time spent in per-image stages
+        self.workers = max( 1, workers ) if image_cmd else 0            # Number of stage runners
+        self.pair_workers = max( 1, workers )                           # Number of pair matchers
+        self.tracer = tracer                                            # Per-image stage timings
+        self.cache = cache                                              # Cached features & matches
+        self.artifacts = artifacts                                      # ...
+        self.pair_cmd = pair_cmd                                        # Pair stage
+        self.params = params                                            # ...
+        self.clusters = clusters                                        # ...
+        self.images = []                                                # (path, SHA-1) of every submitted image
+        self.submitted = set()                                          # ...their paths
+        self.cached = 0                                                 # Images whose features were restored
+
+        if( image_cmd is not None ):                                    # Start bounded pool of stage runners
+            for i in range( self.workers ):                             # ...
+                t = Thread( target=self.image_worker, args=() )         # ...
+                t.daemon = True                                         # ...
+                t.start()                                               # ...
+
+    def submit( self, image, trace=None, digest=None ):
+        '''
+        Queue a freshly landed image for its per-image stages; an
+        image submitted before is ignored
+
+        INPUTS:
+            - image : Path to the image
+            - trace : Trace ID of the image, finished once its stages are done
+            - digest: SHA-1 of the image (None == computed when needed)
+        '''
+
+        with self.lock:                                                 # Landed twice (announced again)
+            if( image in self.submitted ): return                       # ...
+            self.submitted.add( image )                                 # ...
+
+        if( digest is None and (self.cache is not None or self.pair_cmd is not None) ):
+            digest = file_digest( image )                               # Needed for cache keys & pair order
+        with self.lock:                                                 # ...
+            self.images.append( (image, digest) )                       # ...
+
+        if( self.image_cmd is not None ):
+            self.queue.put( (image, trace, digest) )
+        elif( self.tracer is not None ):                                # Nothing left to do for this image
+            self.tracer.finish( trace )                                 # ...
+
+    def image_worker( self ):
+        '''
+        Run the per-image command on queued images, one process
+        at a time per worker
+        '''
+
+        while( True ):
+            item = self.queue.get()                                     # Block until an image lands
+            if( item is None ):                                         # Pipeline closed
+                self.queue.task_done()                                  # ...
+                return                                                  # ...
+            image, trace, digest = item                                 # ...
+            if( self.tracer is not None ): self.tracer.mark( trace, "recon_wait" )
+            start = time()                                              # ...
+            if( self.restore_features(image, digest) ):                 # Computed before, by an earlier scan
+                rc = 0                                                  # ...
+            else:
+                for path, key in self.feature_paths( image, digest ):   # Outputs of an earlier image of this
+                    if( os.path.exists(path) ): os.remove( path )       # ...name may be linked into the cache
+                cmd = [ arg.replace("{image}", image) for arg in self.image_cmd ]
+                try   : rc = Popen( cmd ).wait()                        # Run stage and wait for it
+                except OSError: rc = -1                                 # Command could not be started
+                if( rc == 0 ): self.store_features( image, digest )     # Keep for later runs
+
+            with self.lock:                                             # Record outcome
+                self.stage_time += time() - start                       # ...
+                if( rc == 0 ): self.done.append( image )                # ...
+                else         : self.failed.append( image )              # ...
+            if( self.tracer is not None ):                              # ...
+                self.tracer.mark( trace, "recon" )                      # ...
+                self.tracer.finish( trace, "ok" if rc == 0 else "failed" )
+            self.queue.task_done()                                      # ...
+
+    def feature_paths( self, image, digest ):
+        '''
+        (path, cache key) of every per-image artifact of an image
+        '''
+
+        stem = os.path.splitext( image )[0]
+        return( [ (stem + ext, artifact_key(ext, [self.image_cmd, self.params], [digest]))
+                  for ext in self.artifacts ] )
+
+    def restore_features( self, image, digest ):
+        '''
+        Place an image's cached artifacts next to it
+
+        OUTPUT:
+            - hit: True if every artifact was in the cache
+        '''
+
+        if( self.cache is None or len(self.artifacts) == 0 ): return( False )
+        paths = self.feature_paths( image, digest )
+        if( not all(os.path.isfile(self.cache.path(key)) for _, key in paths) ):
+            return( False )                                             # Missing one, recompute them all
+        for path, key in paths:                                         # ...
+            if( not self.cache.fetch(key, path) ): return( False )      # Evicted meanwhile
+        with self.lock:                                                 # ...
+            self.cached += 1                                            # ...
+        return( True )
+
+    def store_features( self, image, digest ):
+        if( self.cache is None ): return
+        for path, key in self.feature_paths( image, digest ):           # Cache whatever the command wrote
+            if( os.path.isfile(path) ): self.cache.add( key, path )     # ...
+
+    def pairs( self ):
+        '''
+        Every pair of submitted images that share a cluster, each
+        ordered by checksum so a pair's match file does not depend
+        on landing order
+
+        OUTPUT:
+            - pairs: List of ((path, SHA-1), (path, SHA-1))
+        '''
+
+        with self.lock:
+            images = sorted( self.images, key=lambda i: i[1] )
+        pairs = [ (a, b) for i, a in enumerate(images) for b in images[i+1:] ]
+        if( self.clusters is None ): return( pairs )
+
+        member = {}                                                     # Image name -> clusters it is in
+        for i, cluster in enumerate( self.clusters() ):                 # ...
+            for name in cluster: member.setdefault( name, set() ).add( i )
+        shared = lambda a, b: member.get( os.path.basename(a), set() ) & member.get( os.path.basename(b), set() )
+        return( [ (a, b) for a, b in pairs if shared(a[0], b[0]) ] )
+
+    def match_path( self, a, b ):
+        '''
+        Where the match file of a pair of images is written
+        '''
+
+        name = "{}__{}.txt".format( os.path.splitext(os.path.basename(a))[0],
+                                    os.path.splitext(os.path.basename(b))[0] )
+        return( os.path.join(os.path.dirname(a), MATCH_DIR, name) )
+
+    def pair_worker( self, todo, stats ):
+        '''
+        Match queued pairs, restoring cached matches where possible
+        '''
+
+        while( True ):
+            try   : (a, da), (b, db) = todo.get_nowait()                # Next pair, until none are left
+            except Empty: return                                        # ...
+
+            out = self.match_path( a, b )                               # ...
+            key = artifact_key( "pair", [self.pair_cmd, self.params], [da, db] )
+            if( self.cache is not None and self.cache.fetch(key, out) ):#   Matched in an earlier run
+                outcome = "cached"                                      #   ...
+            else:
+                if( os.path.exists(out) ): os.remove( out )             #   Never write through a cached match
+                cmd = [ arg.replace("{a}", a).replace("{b}", b).replace("{out}", out)
+                        for arg in self.pair_cmd ]                      #   ...
+                try   : rc = Popen( cmd ).wait()                        #   Match this pair
+                except OSError: rc = -1                                 #   ...
+                outcome = "matched" if rc == 0 else "failed"            #   ...
+                if( rc == 0 and self.cache is not None and os.path.isfile(out) ):
+                    self.cache.add( key, out )                          #   Keep for later runs
+
+            with self.lock:                                             # ...
+                stats[ outcome ] += 1                                   # ...
+
+    def match_pairs( self ):
+        '''
+        Run the pair stage over every pair of images (within each
+        cluster), with as many processes at once as the per-image stage
+        '''
+
+        if( self.pair_cmd is None ): return
+
+        pairs = self.pairs()                                            # ...
+        if( len(pairs) > 0 ):                                           # Match files go in a sub-folder
+            folder = os.path.dirname( self.match_path(pairs[0][0][0], pairs[0][1][0]) )
+            if( not os.path.isdir(folder) ): os.makedirs( folder )      # ...
+
+        todo = Queue()                                                  # ...
+        for pair in pairs: todo.put( pair )                             # ...
+        stats = { "matched": 0, "cached": 0, "failed": 0 }              # ...
+        start = time()                                                  # ...
+        runners = [ Thread(target=self.pair_worker, args=(todo, stats)) # Bounded pool of matchers
+                    for i in range( self.pair_workers ) ]               # ...
+        for t in runners: t.start()                                     # ...
+        for t in runners: t.join()                                      # ...
+
+        if( self.tracer is not None ):                                  # ...
+            self.tracer.observe( "match", time() - start )              # ...
+        print( "Pair stage: {} pairs, {} matched, {} from cache, {} failed, {:.1f}s".format(
+               len(pairs), stats["matched"], stats["cached"], stats["failed"], time() - start) )
+
+    def finish( self ):
+        '''
+        Wait for the per-image stages to drain, match new pairs,
+        then run the global stages
+
+        OUTPUT:
+            - rc: Return code of the final command (None if there is none)
+        '''
+
+        self.queue.join()                                               # Wait for outstanding per-image stages
+        if( self.image_cmd is not None ):                               # [INFO] ...
+            print( "Per-image stages: {} done ({} from cache), {} failed, {:.1f}s of work".format(
+                   len(self.done), self.cached, len(self.failed), self.stage_time) )
+            for image in self.failed:                                   # ...
+                print( "  Failed: {}".format(image) )                   # ...
+
+        self.match_pairs()                                              # Only new pairs are matched
+
+        if( self.final_cmd is None ): return( None )                    # Nothing left to do
+        start = time()                                                  # ...
+        p = Popen( self.final_cmd )                                     # Run global stages
+        p.communicate()                                                 # ...
+        if( self.tracer is not None ):                                  # ...
+            self.tracer.observe( "reconstruct", time() - start )        # ...
+        return( p.returncode )
+
+    def close( self ):
+        '''
+        Stop the stage runners once the queue has drained, for
+        pipelines that only live as long as one scan
+        '''
+
+        for i in range( self.workers ):                                 # One stop marker per runner
+            self.queue.put( None )                                      # ...
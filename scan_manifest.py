@@ -0,0 +1,182 @@
+'''
+*
+* Scan manifest protocol shared by the FTP server and client.
+*
+* Frames are announced on the images topic as JSON carrying the
+* name, size, SHA-1 checksum and capture timestamp of each frame,
+* optionally batched several frames per message:
+*
+*   { "frames": [ { "name": "image0.jpg", "size": 123456,
+*                   "sha1": "9f...", "t": 1534262400.123,
+*                   "trace": "5c0e..." }, ... ] }
+*
+* "trace" ties the frame's stage timings on the server and client
+* together (see scan_metrics).
+*
+* Turntable scans also carry the "angle" (degrees) of each frame,
+* and previews the name of the frame they were made from as
+* "preview_of" (see preview_tier).
+*
+* A final manifest listing every frame of the scan is sent just
+* before EOT:
+*
+*   { "manifest": true, "count": N, "frames": [ ... ] }
+*
+* Bare image names (the original protocol) are still understood.
+*
+* Once a scan has landed, the client records the entries of its
+* frames, by the names they are stored under, in frames.json next
+* to them, for the reconstruction to order them by (see
+* recon_partition).
+*
+'''
+
+# Import modules
+import  hashlib                                                         # Frame checksums
+import  json                                                            # Message encoding
+import  os                                                              # File sizes
+
+FRAMES_FILE = "frames.json"                                             # Record of a landed scan's frames
+
+# ************************************************************************
+# =========================> DEFINE  FUNCTIONS <==========================
+# ************************************************************************
+def frame_entry( name, data, timestamp, angle=None, trace=None, preview_of=None ):
+    '''
+    Describe a captured frame
+
+    INPUTS:
+        - name      : Name of the frame
+        - data      : JPEG bytes of the frame
+        - timestamp : Capture time (seconds since epoch)
+        - angle     : Turntable angle in degrees, if captured on one
+        - trace     : Trace ID of the frame
+        - preview_of: Name of the full frame, if this is its preview
+
+    OUTPUT:
+        - entry: Dictionary describing the frame
+    '''
+
+    entry = { "name": name,
+              "size": len(data),
+              "sha1": hashlib.sha1(data).hexdigest(),
+              "t"   : timestamp }
+    if( angle is not None ): entry[ "angle" ] = angle                   # Only present for turntable scans
+    if( trace is not None ): entry[ "trace" ] = trace                   # ...and when tracing
+    if( preview_of is not None ): entry[ "preview_of" ] = preview_of    # ...and for previews
+    return( entry )
+
+# ------------------------------------------------------------------------
+
+def encode_batch( entries ):
+    '''
+    Encode a batch of frame announcements
+
+    INPUT:
+        - entries: List of frame entries
+
+    OUTPUT:
+        - payload: JSON string
+    '''
+
+    return( json.dumps( {"frames": entries} ) )
+
+# ------------------------------------------------------------------------
+
+def encode_manifest( entries ):
+    '''
+    Encode the final manifest of a scan
+
+    INPUT:
+        - entries: List of every frame entry in the scan
+
+    OUTPUT:
+        - payload: JSON string
+    '''
+
+    return( json.dumps( {"manifest": True, "count": len(entries), "frames": entries} ) )
+
+# ------------------------------------------------------------------------
+
+def decode( payload ):
+    '''
+    Decode a message received on the images topic
+
+    INPUT:
+        - payload: Decoded (unicode) message payload
+
+    OUTPUTS:
+        - entries : List of frame entries (bare names carry only "name")
+        - manifest: True if this is the final manifest of the scan
+    '''
+
+    if( not payload.startswith('{') ):                                  # Original protocol: bare image name
+        return( [ {"name": payload} ], False )                          # ...
+
+    msg = json.loads( payload )                                         # Structured announcement
+    return( msg.get("frames", []), bool(msg.get("manifest", False)) )   # ...
+
+# ------------------------------------------------------------------------
+
+def file_digest( path, blocksize=2**20 ):
+    '''
+    Compute the SHA-1 checksum of a file
+
+    INPUTS:
+        - path     : Path of file
+        - blocksize: Size of each read
+
+    OUTPUT:
+        - digest: Hex digest of file contents
+    '''
+
+    h = hashlib.sha1()                                                  # Hash file in blocks
+    with open( path, 'rb' ) as f:                                       # ...
+        for block in iter( lambda: f.read(blocksize), b'' ):            # ...
+            h.update( block )                                           # ...
+    return( h.hexdigest() )
+
+# ------------------------------------------------------------------------
+
+def verify( path, entry ):
+    '''
+    Check a downloaded frame against its announcement
+
+    INPUTS:
+        - path : Path of downloaded frame
+        - entry: Frame entry it was announced with
+
+    OUTPUT:
+        - ok: True if size and checksum match (or were not announced)
+    '''
+
+    if( not os.path.isfile(path) ): return( False )                     # Frame never landed
+    if( "size" in entry and os.path.getsize(path) != entry["size"] ):   # Truncated or stale
+        return( False )                                                 # ...
+    if( "sha1" in entry and file_digest(path) != entry["sha1"] ):       # Corrupt
+        return( False )                                                 # ...
+    return( True )
+
+# ------------------------------------------------------------------------
+
+def save_frames( path, entries ):
+    '''
+    Record the frames of a landed scan
+
+    INPUTS:
+        - path   : File to write (normally FRAMES_FILE in the scan's folder)
+        - entries: Frame entries, named as stored locally
+    '''
+
+    with open( path, 'w' ) as f:
+        json.dump( {"frames": entries}, f )
+
+# ------------------------------------------------------------------------
+
+def load_frames( path ):
+    '''
+    Read the frame entries recorded by save_frames()
+    '''
+
+    with open( path ) as f:
+        return( json.load( f ).get( "frames", [] ) )
@@ -0,0 +1,253 @@
+'''
+*
+* Per-frame stage tracing and metrics shared by the FTP server
+* and client.
+*
+* Every frame carries a trace ID from capture on the server,
+* through its MQTT announcement, to its transfer and per-image
+* reconstruction on the client. Each side marks the stages it
+* sees with monotonic timestamps; the time between consecutive
+* marks is added to a per-stage histogram. Finished traces can be
+* appended to a JSON-lines log, and the histograms are served in
+* the Prometheus text format on /metrics:
+*
+*   rls_stage_seconds_bucket{node="cam0",stage="capture",le="0.1"} 42
+*
+* Monotonic clocks are not comparable between hosts, so the only
+* cross-host stage ("delivery": capture to announcement received)
+* is measured on the wall clock.
+*
+'''
+
+# Import modules
+from    threading                   import  Lock                        # Tracer is shared by every stage
+from    http_endpoint               import  BackgroundHTTPServer        # Serve metrics in the background
+from    collections                 import  OrderedDict                 # Open traces, oldest first
+from    time                        import  time                        # Wall-clock time of each trace
+import  json                                                            # Trace log lines
+import  uuid                                                            # Trace IDs
+
+try:    from time                   import  monotonic                   # Monotonic clock (Python 3)
+except: from time                   import  time as monotonic           # Fallback clock  (Python 2)
+
+try:    from BaseHTTPServer         import  BaseHTTPRequestHandler      # Metrics page (Python 2)
+except: from http.server            import  BaseHTTPRequestHandler      # ... (Python 3)
+
+BUCKETS = ( 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,         # Histogram bucket bounds (seconds)
+            0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0 )               # ...
+METRICS_PORT = 9108                                                     # Default port of the metrics endpoint
+
+# ************************************************************************
+# =========================> DEFINE  FUNCTIONS <==========================
+# ************************************************************************
+def new_trace_id():
+    '''
+    Random, compact trace ID
+    '''
+
+    return( uuid.uuid4().hex[:16] )
+
+# ************************************************************************
+# ==========================> DEFINE  CLASSES <===========================
+# ************************************************************************
+class Histogram( object ):
+    '''
+    Fixed-bucket histogram of durations (not thread-safe on its own)
+    '''
+
+    def __init__( self, buckets=BUCKETS ):
+        self.bounds = buckets                                           # Upper bound of each bucket
+        self.counts = [ 0 ] * ( len(buckets) + 1 )                      # Last bucket is +Inf
+        self.sum, self.count = 0.0, 0                                   # ...
+
+    def observe( self, value ):
+        i = 0                                                           # Find bucket
+        while( i < len(self.bounds) and value > self.bounds[i] ):       # ...
+            i += 1                                                      # ...
+        self.counts[ i ] += 1                                           # ...
+        self.sum += value                                               # ...
+        self.count += 1                                                 # ...
+
+    def cumulative( self ):
+        '''
+        (upper bound, observations <= bound) pairs, ending with +Inf
+        '''
+
+        out, total = [], 0
+        for bound, n in zip( list(self.bounds) + ["+Inf"], self.counts ):
+            total += n
+            out.append( (bound, total) )
+        return( out )
+
+# ------------------------------------------------------------------------
+
+class Tracer( object ):
+    '''
+    Records stage timestamps of in-flight frames and aggregates
+    stage durations into histograms
+    '''
+
+    def __init__( self, node, log_path=None, port=None, max_open=4096, host='' ):
+        '''
+        Initialize class
+
+        INPUTS:
+            - node    : Name of this node, used as a metrics label
+            - log_path: JSON-lines file finished traces are appended to (None == no log)
+            - port    : Port of the /metrics endpoint (None == no endpoint)
+            - max_open: Max traces kept open; the oldest are dropped beyond it
+            - host    : Interface the endpoint binds to ('' == all)
+        '''
+
+        self.node = node                                                # Metrics label
+        self.max_open = max_open                                        # Bound on unfinished traces
+        self.lock = Lock()                                              # Guard everything below
+        self.open = OrderedDict()                                       # Trace ID -> record
+        self.hists = OrderedDict()                                      # Stage -> Histogram
+        self.frames = {}                                                # Outcome -> number of finished traces
+
+        self.log = None                                                 # Trace log
+        if( log_path is not None ):                                     # ...
+            self.log = open( log_path, 'a' )                            # ...
+
+        self.server = None                                              # Metrics endpoint
+        if( port is not None ):                                         # ...
+            self.server = MetricsServer( self, port, host )             # ...
+            self.server.start()                                         # ...
+
+    def observe( self, stage, seconds ):
+        '''
+        Add a duration to a stage's histogram directly
+        '''
+
+        with self.lock:
+            self.observe_locked( stage, seconds )
+
+    def observe_locked( self, stage, seconds ):
+        if( stage not in self.hists ): self.hists[ stage ] = Histogram()
+        self.hists[ stage ].observe( seconds )
+
+    def begin( self, trace=None, **fields ):
+        '''
+        Open a trace
+
+        INPUTS:
+            - trace   : ID of trace (None == new ID)
+            - **fields: Extra fields written to the trace log (e.g. name)
+
+        OUTPUT:
+            - trace: ID of trace
+        '''
+
+        if( trace is None ): trace = new_trace_id()
+        record = { "trace": trace, "node": self.node, "t": time(),
+                   "stages": [ ("start", monotonic()) ] }
+        record.update( fields )
+
+        with self.lock:
+            self.open[ trace ] = record                                 # ...
+            while( len(self.open) > self.max_open ):                    # Drop traces that never finished
+                self.open.popitem( last=False )                         # ...
+        return( trace )
+
+    def mark( self, trace, stage ):
+        '''
+        Record that a trace reached the end of a stage; the time
+        since the previous mark goes into the stage's histogram
+        '''
+
+        now = monotonic()
+        with self.lock:
+            record = self.open.get( trace )
+            if( record is None ): return                                # Unknown or dropped trace
+            self.observe_locked( stage, now - record["stages"][-1][1] ) # ...
+            record[ "stages" ].append( (stage, now) )                   # ...
+
+    def finish( self, trace, outcome="ok" ):
+        '''
+        Close a trace and append it to the trace log
+
+        INPUTS:
+            - trace  : ID of trace
+            - outcome: "ok", "failed", ...
+        '''
+
+        with self.lock:
+            record = self.open.pop( trace, None )
+            if( record is None ): return
+            t0 = record["stages"][0][1]                                 # Whole journey on this node
+            self.observe_locked( "total", record["stages"][-1][1] - t0 )
+            self.frames[ outcome ] = self.frames.get( outcome, 0 ) + 1  # ...
+
+            if( self.log is not None ):                                 # Log it
+                record[ "outcome" ] = outcome                           # ...
+                self.log.write( json.dumps(record) + "\n" )             # ...
+                self.log.flush()                                        # ...
+
+    def render( self ):
+        '''
+        Metrics in the Prometheus text exposition format
+        '''
+
+        lines = [ "# HELP rls_stage_seconds Time frames spent in each stage",
+                  "# TYPE rls_stage_seconds histogram" ]
+        with self.lock:
+            for stage, hist in self.hists.items():
+                label = 'node="{}",stage="{}"'.format( self.node, stage )
+                for bound, n in hist.cumulative():
+                    lines.append( 'rls_stage_seconds_bucket{{{},le="{}"}} {}'.format(label, bound, n) )
+                lines.append( "rls_stage_seconds_sum{{{}}} {:.6f}".format(label, hist.sum) )
+                lines.append( "rls_stage_seconds_count{{{}}} {}".format(label, hist.count) )
+
+            lines += [ "# HELP rls_frames_total Frames whose trace finished, by outcome",
+                       "# TYPE rls_frames_total counter" ]
+            for outcome, n in sorted( self.frames.items() ):
+                lines.append( 'rls_frames_total{{node="{}",outcome="{}"}} {}'.format(self.node, outcome, n) )
+        return( "\n".join(lines) + "\n" )
+
+    def close( self ):
+        if( self.server is not None ): self.server.stop()
+        if( self.log is not None ): self.log.close()
+
+# ------------------------------------------------------------------------
+
+class MetricsRequestHandler( BaseHTTPRequestHandler ):
+    '''
+    Serve GET /metrics from the server's Tracer
+    '''
+
+    def do_GET( self ):
+        if( self.path.split('?')[0] != "/metrics" ):                    # Only one page
+            self.send_response( 404 )                                   # ...
+            self.end_headers()                                          # ...
+            return
+
+        body = self.server.tracer.render().encode( "utf-8" )
+        self.send_response( 200 )
+        self.send_header( "Content-Type", "text/plain; version=0.0.4" )
+        self.send_header( "Content-Length", str(len(body)) )
+        self.end_headers()
+        self.wfile.write( body )
+
+    def log_message( self, *args ):
+        pass                                                            # Keep the console quiet
+
+# ------------------------------------------------------------------------
+
+class MetricsServer( BackgroundHTTPServer ):
+    '''
+    Threaded HTTP endpoint serving a Tracer's metrics
+    '''
+
+    def __init__( self, tracer, port=METRICS_PORT, host='' ):
+        '''
+        Initialize class
+
+        INPUTS:
+            - tracer: Tracer to serve metrics from
+            - port  : TCP port to listen on
+            - host  : Interface to bind to ('' == all)
+        '''
+
+        BackgroundHTTPServer.__init__( self, (host, port), MetricsRequestHandler )
+        self.tracer = tracer                                            # Metrics to be served
@@ -0,0 +1,178 @@
+'''
+*
+* Multi-node scan protocol shared by the FTP server and client.
+*
+* Every camera node (FTP server) publishes under its own topic
+* namespace so several nodes can share one broker and client:
+*
+*   ftp/nodes/<node>/info     retained registration: address & capabilities
+*   ftp/nodes/<node>/images   frame announcements (see scan_manifest)
+*   ftp/nodes/<node>/status   node -> client handshakes (EOT)
+*   ftp/nodes/<node>/control  client -> node handshakes (SOH, EOT)
+*   ftp/nodes/<node>/acks     client -> node: name of each frame it has
+*   ftp/nodes/<node>/general  anything else
+*
+* The registration is cleared (empty retained message) when a node
+* shuts down, or by its last will when it drops off the network,
+* so the client always knows which nodes are live:
+*
+*   { "node": "cam0", "ip": "192.168.42.10", "ftp_port": 21,
+*     "stream_port": 8021, "scan": "1534262400123",
+*     "token": "9f86d0...", "capabilities": { ... } }
+*
+* "scan" is unique to each run of a node, so a client that takes
+* several scans in a row can tell a node's next scan from a stale
+* registration of the one it just finished. "token" is a random
+* secret of the run that the node's frame endpoint requires with
+* every request; it is only as private as the broker is.
+*
+'''
+
+# Import modules
+from    threading                   import  Event                       # Per-node completion flags
+import  json                                                            # Message encoding
+import  itertools                                                       # Download order tie-breaker
+import  posixpath                                                       # Image names may hold a sub-folder
+
+try:    from Queue                  import  PriorityQueue               # Queue of images awaiting download (Python 2)
+except: from queue                  import  PriorityQueue               # ... (Python 3)
+
+NODES_ROOT = "ftp/nodes"                                                # Parent of every node's namespace
+PREVIEW, FULL, STOP = 0, 1, 2                                           # Download priorities, most urgent first
+
+# ************************************************************************
+# =========================> DEFINE  FUNCTIONS <==========================
+# ************************************************************************
+def node_topics( node ):
+    '''
+    Topics making up a node's namespace
+
+    INPUT:
+        - node: Name of node (no '/', '+' or '#')
+
+    OUTPUT:
+        - topics: Dictionary of topic names
+    '''
+
+    if( not node or any(c in node for c in "/+#") ):                    # Must be a single topic level
+        raise ValueError( "Invalid node name {!r}".format(node) )       # ...
+
+    root = "{}/{}/".format( NODES_ROOT, node )
+    return( { "info"   : root + "info"   ,                              # Registration (retained)
+              "images" : root + "images" ,                              # Frame announcements
+              "status" : root + "status" ,                              # Node -> client handshakes
+              "control": root + "control",                              # Client -> node handshakes
+              "acks"   : root + "acks"   ,                              # Client -> node frame acks
+              "general": root + "general" } )                           # Everything else
+
+# ------------------------------------------------------------------------
+
+def parse_topic( topic ):
+    '''
+    Split a topic into the node it belongs to and its kind
+
+    INPUT:
+        - topic: Topic name
+
+    OUTPUTS:
+        - node: Name of node (None if not a node topic)
+        - kind: Key of the topic in node_topics()
+    '''
+
+    parts = topic.split( '/' )
+    if( len(parts) != 4 or '/'.join(parts[:2]) != NODES_ROOT ):         # Not ftp/nodes/<node>/<kind>
+        return( None, None )                                            # ...
+    return( parts[2], parts[3] )
+
+# ------------------------------------------------------------------------
+
+def encode_info( node, ip, ftp_port, stream_port, capabilities, scan=None, token=None ):
+    '''
+    Encode a node's registration
+
+    INPUTS:
+        - node        : Name of node
+        - ip          : Address the client should pull from
+        - ftp_port    : Port of the node's FTP server
+        - stream_port : Port of the node's RAM endpoint (None == FTP only)
+        - capabilities: Dictionary describing what the node can do
+        - scan        : ID of this run of the node
+        - token       : Secret the node's RAM endpoint requires
+
+    OUTPUT:
+        - payload: JSON string
+    '''
+
+    return( json.dumps( {"node": node, "ip": ip, "ftp_port": ftp_port, "stream_port": stream_port,
+                         "scan": scan, "token": token, "capabilities": capabilities} ) )
+
+# ------------------------------------------------------------------------
+
+def decode_info( payload ):
+    '''
+    Decode a message received on a node's info topic
+
+    INPUT:
+        - payload: Decoded (unicode) message payload
+
+    OUTPUT:
+        - info: Registration dictionary (None == node is gone)
+    '''
+
+    if( payload == '' ): return( None )                                 # Registration cleared
+    return( json.loads(payload) )
+
+# ************************************************************************
+# ============================> DEFINE CLASS <============================
+# ************************************************************************
+class RemoteNode( object ):
+    '''
+    Client-side state of one camera node
+    '''
+
+    def __init__( self, info, ftp_port=21, stream=True ):
+        '''
+        Initialize class
+
+        INPUTS:
+            - info    : Registration received from the node
+            - ftp_port: FTP port to use if the node does not advertise one
+            - stream  : Pull from the node's RAM endpoint when it has one
+        '''
+
+        self.name = info["node"]                                        # Node name
+        self.scan = info.get( "scan" )                                  # ID of the node's current run
+        self.ip = info["ip"]                                            # Address to pull from
+        self.ftp_port = info.get( "ftp_port" ) or ftp_port              # ...
+        self.stream_port = info.get( "stream_port" ) if stream else None
+        self.token = info.get( "token" )                                # ...and the secret it asks for
+        self.capabilities = info.get( "capabilities", {} )              # What the node can do
+        self.topics = node_topics( self.name )                          # Node's namespace
+
+        self.queue = PriorityQueue()                                    # Images announced but not yet downloaded
+        self.order = itertools.count()                                  # FIFO among equal priorities
+        self.final_manifest = None                                      # Every frame of the node's scan
+        self.got_manifest = Event()                                     # Set once the final manifest arrives
+        self.finishing = False                                          # EOT received (or node lost)
+        self.lost = False                                               # Node dropped off before its EOT
+        self.done = Event()                                             # Set once the node's frames are all in
+        self.failures = {}                                              # Name -> rounds of failed retries
+
+    def enqueue( self, name, priority=FULL ):
+        '''
+        Queue an image for download. Previews jump ahead of full
+        frames; STOP (with name None) stops a worker once the rest
+        of the queue is done.
+        '''
+
+        self.queue.put( (priority, next(self.order), name) )
+
+    def local_name( self, name ):
+        '''
+        Name a node's image is stored under on the client, so frames
+        with the same name from different nodes never collide. A
+        sub-folder in the name (e.g. "preview/") is kept.
+        '''
+
+        folder, name = posixpath.split( name )
+        return( posixpath.join(folder, "{}_{}".format(self.name, name)) )
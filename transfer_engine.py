@@ -0,0 +1,309 @@
+'''
+*
+* High-throughput transfer engine used by the client.
+*
+* Data is received with readinto-style calls into one large,
+* reusable buffer per worker and written straight into a file
+* preallocated to the expected size. The block size and the
+* receive socket buffer are tuned per link from the throughput
+* and latency measured on previous transfers.
+*
+* The receive buffer is requested before connecting: the TCP window
+* scale is agreed on in the SYN, so growing the buffer of a socket
+* that is already connected barely opens its window.
+*
+'''
+
+# Import modules
+from    threading                   import  Lock                        # Tuner is shared by the download workers
+from    ftplib                      import  error_reply                 # Unexpected reply to RETR
+import  socket                                                          # Socket buffer options
+
+try:    from time                   import  monotonic                   # Monotonic clock (Python 3)
+except: from time                   import  time as monotonic           # Fallback clock  (Python 2)
+
+# ************************************************************************
+# =========================> DEFINE  FUNCTIONS <==========================
+# ************************************************************************
+def grow_rcvbuf( sock, want ):
+    '''
+    Grow a socket's receive buffer to want bytes, never shrinking
+    the OS default
+    '''
+
+    try:
+        have = sock.getsockopt( socket.SOL_SOCKET, socket.SO_RCVBUF )
+        if( want > have ):                                              # Never shrink the OS default
+            sock.setsockopt( socket.SOL_SOCKET, socket.SO_RCVBUF, want )
+    except socket.error:
+        pass
+
+# ------------------------------------------------------------------------
+
+def open_socket( address, timeout=None, rcvbuf=None ):
+    '''
+    Open a TCP connection like socket.create_connection(), sizing
+    the receive buffer before the SYN so the window scale follows it
+
+    INPUTS:
+        - address: (host, port) to connect to
+        - timeout: Socket timeout in seconds (None, or not a number == default)
+        - rcvbuf : Receive buffer to request (None == OS default)
+
+    OUTPUT:
+        - sock: Connected socket
+    '''
+
+    host, port = address
+    err = socket.error( "No address found for {}".format(host) )
+    for family, kind, proto, _, addr in socket.getaddrinfo( host, port, 0, socket.SOCK_STREAM ):
+        sock = socket.socket( family, kind, proto )                     # Try each address in turn
+        try:                                                            # ...
+            if( rcvbuf is not None ): grow_rcvbuf( sock, rcvbuf )       # ...buffer first,
+            if( isinstance(timeout, (int, float)) ): sock.settimeout( timeout )
+            sock.connect( addr )                                        # ...then connect
+            return( sock )                                              # ...
+        except socket.error as e:                                       # ...
+            sock.close()                                                # ...
+            err = e                                                     # ...
+    raise err
+
+# ************************************************************************
+# ==========================> DEFINE  CLASSES <===========================
+# ************************************************************************
+class LinkTuner( object ):
+    '''
+    Per-link block size and socket buffer tuning.
+
+    The block size hill-climbs in powers of two between min_block
+    and max_block towards the size with the best smoothed (EWMA)
+    throughput. A transfer only says something about a block size
+    it took at least two blocks of, so the climb stops at half the
+    size of the transfers seen, and steps back down when frames
+    turn out to be shorter than that. The receive buffer is sized
+    to twice the measured bandwidth-delay product of the link.
+    '''
+
+    def __init__( self, min_block=2**16, max_block=2**22, start_block=2**18,
+                  min_sockbuf=2**16, max_sockbuf=2**23, alpha=0.3 ):
+        '''
+        Initialize class
+
+        INPUTS:
+            - min_block  : Smallest block size tried
+            - max_block  : Largest block size tried (and buffer size)
+            - start_block: Block size used on a new link
+            - min_sockbuf: Smallest receive socket buffer requested
+            - max_sockbuf: Largest receive socket buffer requested
+            - alpha      : Weight of the newest sample in the averages
+        '''
+
+        self.min_block, self.max_block = min_block, max_block           # Block size bounds
+        self.start_block = start_block                                  # ...
+        self.min_sockbuf, self.max_sockbuf = min_sockbuf, max_sockbuf   # Socket buffer bounds
+        self.alpha = alpha                                              # EWMA weight
+        self.links = {}                                                 # Host -> tuning state
+        self.lock = Lock()                                              # Guard links
+
+    def state( self, host ):
+        if( host not in self.links ):                                   # New link
+            self.links[ host ] = { "block"  : self.start_block,         # ...
+                                   "rates"  : {},                       # Block size -> EWMA bytes/sec
+                                   "latency": None,                     # EWMA time to first byte
+                                   "sockbuf": None }                    # Receive buffer to request
+        return( self.links[host] )
+
+    def block_size( self, host ):
+        with self.lock:
+            return( self.state(host)["block"] )
+
+    def sockbuf( self, host ):
+        with self.lock:
+            return( self.state(host)["sockbuf"] )
+
+    def record( self, host, block, nbytes, seconds, latency ):
+        '''
+        Feed a finished transfer back into the link's tuning
+
+        INPUTS:
+            - host   : Link the transfer ran over
+            - block  : Block size it used
+            - nbytes : Bytes transferred
+            - seconds: Time spent receiving
+            - latency: Time from request to first byte
+        '''
+
+        with self.lock:
+            s = self.state( host )
+            if( nbytes < 2*block or seconds <= 0 ):                     # Too short to time this block size
+                if( block <= nbytes and s["block"] == block ):          # ...a frame it has outgrown (not a preview
+                    s["block"] = max( self.min_block, block//2 )        # ...far below it), so step down
+                return
+            a = self.alpha
+            rate = nbytes / seconds                                     # Throughput of this transfer
+            old = s["rates"].get( block )                               # Smooth per block size
+            s["rates"][ block ] = rate if old is None else a*rate + (1-a)*old
+            if( latency is not None ):                                  # Smooth latency
+                s["latency"] = latency if s["latency"] is None else a*latency + (1-a)*s["latency"]
+
+            up, down = block*2, block//2                                # Neighbouring block sizes
+            fits = lambda b: self.min_block <= b <= self.max_block and 2*b <= nbytes
+            if( fits(up) and up not in s["rates"] ):                    # Explore larger blocks first, as far
+                s["block"] = up                                         # ...as transfers this size can time them
+            else:                                                       # Otherwise settle on the best neighbour
+                candidates = [ b for b in (down, block, up)             # ...
+                               if b in s["rates"] and fits(b) ]
+                s["block"] = max( candidates, key=lambda b: s["rates"][b] )
+
+            if( s["latency"] is not None ):                             # Size buffer to 2x bandwidth-delay product
+                bdp = 2 * s["rates"][block] * s["latency"]              # ...
+                s["sockbuf"] = int( min(self.max_sockbuf, max(self.min_sockbuf, bdp)) )
+
+# ------------------------------------------------------------------------
+
+class TransferEngine( object ):
+    '''
+    Receives transfers for one worker into a reusable buffer
+    '''
+
+    def __init__( self, tuner, host ):
+        '''
+        Initialize class
+
+        INPUTS:
+            - tuner: LinkTuner shared by all workers
+            - host : Host this worker downloads from
+        '''
+
+        self.tuner = tuner                                              # Shared tuning state
+        self.host = host                                                # Link being tuned
+        self.buf = bytearray( tuner.max_block )                         # Reusable receive buffer
+        self.view = memoryview( self.buf )                              # ...
+        self.last_rate = 0.0                                            # Bytes/sec of the last transfer
+
+    def sockbuf( self ):
+        '''
+        Receive buffer new connections to the link should request
+        '''
+
+        return( self.tuner.sockbuf(self.host) )
+
+    def ftp_data( self, ftp, cmd, offset=0 ):
+        '''
+        Start a transfer over a passive data connection opened with
+        the tuned receive buffer, as FTP.transfercmd() would; active
+        sessions fall back to transfercmd()
+
+        OUTPUT:
+            - conn: Data connection
+        '''
+
+        if( not ftp.passiveserver ):                                    # Server connects to us
+            return( ftp.transfercmd(cmd, offset or None) )              # ...
+
+        address = ftp.makepasv()                                        # Where the server listens
+        conn = open_socket( address, ftp.timeout, self.sockbuf() )      # ...buffer sized before the SYN
+        try:
+            if( offset ): ftp.sendcmd( "REST {}".format(offset) )       # Resume
+            resp = ftp.sendcmd( cmd )                                   # ...
+            if( resp[0] == '2' ): resp = ftp.getresp()                  # Some servers send a 200 before the 150
+            if( resp[0] != '1' ): raise error_reply( resp )             # ...
+        except:
+            conn.close()
+            raise
+        return( conn )
+
+    def receive( self, read_into, f, offset=0, expected=None, t_request=None ):
+        '''
+        Copy a byte stream into a file until it ends
+
+        INPUTS:
+            - read_into: Function filling a memoryview, returning bytes read (0 == end)
+            - f        : Binary file opened for writing/updating
+            - offset   : Where in the file the stream starts
+            - expected : Number of bytes expected, used to preallocate
+            - t_request: When the transfer was requested (for latency)
+
+        OUTPUT:
+            - n: Number of bytes received
+        '''
+
+        block = self.tuner.block_size( self.host )                      # Tuned block size for this link
+        view = self.view[ :block ]                                      # ...
+
+        if( expected ):                                                 # Preallocate the whole file up front
+            f.truncate( offset + expected )                             # ...
+        f.seek( offset )                                                # ...
+
+        n, t_first, t_start = 0, None, monotonic()
+        try:
+            while( True ):
+                got = read_into( view )                                 # Fill buffer straight from the socket
+                if( not got ): break                                    # End of stream
+                if( t_first is None ): t_first = monotonic()            # Time to first byte
+                f.write( view[:got] )                                   # ...
+                n += got                                                # ...
+        finally:
+            if( expected and n != expected ):                           # Drop preallocated space we never filled
+                f.truncate( offset + n )                                # ...so a resume starts at the right place
+
+        t_end = monotonic()
+        seconds = t_end - ( t_first or t_start )                        # Time spent receiving
+        self.last_rate = n / seconds if seconds > 0 else 0.0            # ...
+        latency = ( t_first - t_request ) if ( t_first and t_request ) else None
+        self.tuner.record( self.host, block, n, seconds, latency )      # Tune the link
+        return( n )
+
+    def ftp_retr( self, ftp, name, f, offset=0, expected=None ):
+        '''
+        Retrieve a file over FTP into f, resuming at offset
+
+        INPUTS:
+            - ftp     : Logged in FTP session
+            - name    : Name of file to retrieve
+            - f       : Binary file to write into
+            - offset  : Byte offset to resume from (FTP REST)
+            - expected: Number of bytes expected from offset on
+
+        OUTPUT:
+            - n: Number of bytes received
+        '''
+
+        t_request = monotonic()
+        ftp.voidcmd( "TYPE I" )                                         # Binary mode
+        conn = self.ftp_data( ftp, "RETR " + name, offset )             # Open data connection
+        try:
+            n = self.receive( conn.recv_into, f, offset, expected, t_request )
+        finally:
+            conn.close()
+        ftp.voidresp()                                                  # Wait for "226 Transfer complete"
+        return( n )
+
+    def stream_fetch( self, conn, name, f, offset=0, expected=None ):
+        '''
+        Retrieve a frame from a FrameStreamServer into f, resuming
+        at offset
+
+        INPUTS:
+            - conn    : FrameStreamClient connected to the server
+            - name    : Name of frame to retrieve
+            - f       : Binary file to write into
+            - offset  : Byte offset to resume from (HTTP Range)
+            - expected: Number of bytes expected from offset on
+
+        OUTPUT:
+            - n: Number of bytes received
+        '''
+
+        t_request = monotonic()
+        conn.retune( self.sockbuf() )                                   # Reconnect if the buffer outgrew the socket
+        resp = conn.request( name, offset )                             # Request frame
+
+        if( hasattr(resp, "readinto") ): read_into = resp.readinto      # Python 3
+        else:                                                           # Python 2: no readinto, copy via read()
+            def read_into( view ):
+                data = resp.read( len(view) )
+                view[ :len(data) ] = data
+                return( len(data) )
+
+        return( self.receive( read_into, f, offset, expected, t_request ) )